@@ -1,13 +1,15 @@
 #!/usr/bin/python
 import os
 import re
+import json
+import struct
 import logging
 import datetime
 import zipfile
+import multiprocessing
 from optparse import OptionParser, make_option
 import yaml
 from collections import OrderedDict
-from PIL import Image
 import pytz
 
 logging.basicConfig(
@@ -28,6 +30,261 @@ yaml.add_representer(OrderedDict, dict_representer)
 yaml.add_constructor(_mapping_tag, dict_constructor)
 
 
+# EXIF tags & JPEG markers used to read 'DateTimeOriginal' straight from
+# the APP1 segment, without decoding the image
+EXIF_IFD_POINTER = 0x8769
+EXIF_DATETIME_ORIGINAL = 0x9003
+JPEG_SOI = b'\xff\xd8'
+JPEG_APP1 = 0xFFE1
+JPEG_SOS = 0xFFDA
+JPEG_EOI = 0xFFD9
+
+
+def read_ifd(tiff, endian, offset):
+    """
+    Returns a dictionary {tag: (type, count, value_field)} of the
+    TIFF image file directory (IFD) that starts at a given offset.
+    """
+    entries = {}
+    (n,) = struct.unpack(endian + 'H', tiff[offset:offset + 2])
+    for i in range(n):
+        start = offset + 2 + i * 12
+        tag, typ, count = struct.unpack(
+            endian + 'HHL', tiff[start:start + 8]
+        )
+        entries[tag] = (typ, count, tiff[start + 8:start + 12])
+    return entries
+
+
+def parse_exif_datetime(tiff):
+    """
+    Returns the raw 'DateTimeOriginal' string (e.g. '2016:05:01 12:30:00')
+    from the TIFF structure embedded in the EXIF APP1 segment or None.
+    """
+    if tiff[:2] == b'II':
+        endian = '<'
+    elif tiff[:2] == b'MM':
+        endian = '>'
+    else:
+        return None
+    (ifd0,) = struct.unpack(endian + 'L', tiff[4:8])
+    pointer = read_ifd(tiff, endian, ifd0).get(EXIF_IFD_POINTER)
+    if not pointer:
+        return None
+    (exif_ifd,) = struct.unpack(endian + 'L', pointer[2])
+    value = read_ifd(tiff, endian, exif_ifd).get(EXIF_DATETIME_ORIGINAL)
+    if not value:
+        return None
+    typ, count, field = value
+    if count <= 4:
+        data = field[:count]
+    else:
+        (offset,) = struct.unpack(endian + 'L', field)
+        data = tiff[offset:offset + count]
+    return data.decode('ascii', 'ignore').strip('\x00 ') or None
+
+
+def read_exif_datetime(filepath):
+    """
+    Reads 'DateTimeOriginal' EXIF tag of a JPEG file. Only the segment
+    headers preceding the image data are read so this is much cheaper
+    than opening the file with PIL. Returns None when the tag can not be
+    found or the file can not be parsed.
+    """
+    try:
+        with open(filepath, 'rb') as f:
+            if f.read(2) != JPEG_SOI:
+                return None
+            while True:
+                header = f.read(4)
+                if len(header) < 4:
+                    return None
+                marker, size = struct.unpack('>HH', header)
+                if marker in (JPEG_SOS, JPEG_EOI):
+                    return None
+                if marker == JPEG_APP1:
+                    segment = f.read(size - 2)
+                    if segment[:6] == b'Exif\x00\x00':
+                        return parse_exif_datetime(segment[6:])
+                else:
+                    f.seek(size - 2, 1)
+    except (IOError, OSError, struct.error, IndexError):
+        return None
+
+
+def scan_exif_worker(filepath):
+    """
+    Process pool entry point; it has to be a module level function
+    so it can be pickled.
+    """
+    return filepath, read_exif_datetime(filepath)
+
+
+class DateRecordedManifest(object):
+    """
+    On-disk cache of (path, size, mtime) -> raw EXIF 'DateTimeOriginal'.
+    Entries are appended (one JSON list per line) as soon as they are
+    computed so an interrupted run can be resumed and re-running after
+    adding new files only processes these new files. Raw EXIF values are
+    stored (not the UTC timestamps) so the cache does not depend on the
+    selected timezone.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self.stream = None
+        if path and os.path.isfile(path):
+            with open(path, 'r') as f:
+                for line in f:
+                    try:
+                        filepath, size, mtime, value = json.loads(line)
+                    except ValueError:
+                        # e.g. a line truncated by an interrupted run
+                        continue
+                    self.entries[filepath] = (size, mtime, value)
+
+    def get(self, filepath, size, mtime):
+        """
+        Returns a tuple (True, value) for a cache hit or (False, None)
+        when the file is unknown or has been modified since.
+        """
+        entry = self.entries.get(filepath)
+        if entry and entry[0] == size and entry[1] == mtime:
+            return True, entry[2]
+        return False, None
+
+    def add(self, filepath, size, mtime, value):
+        self.entries[filepath] = (size, mtime, value)
+        if not self.path:
+            return
+        if self.stream is None:
+            self.stream = open(self.path, 'a')
+        self.stream.write(json.dumps([filepath, size, mtime, value]) + '\n')
+        self.stream.flush()
+
+    def close(self):
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+
+
+class ResourceScanner(object):
+    """
+    Walks the directories of given collections only once and collects
+    all required information about the files: the structure used to build
+    the YAML definition, the list of files to put into a zip archive and
+    (mtime, 'DateTimeOriginal') pairs. EXIF headers are read across a pool
+    of processes and cached in a :class:`DateRecordedManifest`.
+    """
+
+    def __init__(
+            self, data_dir, collections, image_ext='.JPG',
+            workers=None, manifest_path=None
+    ):
+        self.data_dir = data_dir
+        self.collections = collections
+        self.image_ext = image_ext
+        self.workers = workers or multiprocessing.cpu_count()
+        self.manifest_path = manifest_path
+        self.tree = None
+        self.files_info = {}
+
+    def walk(self):
+        """
+        Builds `self.tree`, an ordered dictionary:
+        {collection: {'path', 'files', 'deployments', 'levels'}} where
+        `files` are the names of files stored directly in a collection
+        directory, `deployments` is an ordered dictionary
+        {deployment: (path, filenames)} and `levels` is a list of
+        (path, filenames) tuples of all directories found recursively.
+        """
+        if self.tree is not None:
+            return self.tree
+        self.tree = OrderedDict()
+        for collection in self.collections:
+            collection_path = os.path.join(self.data_dir, collection)
+            collection_obj = {
+                'path': collection_path,
+                'files': [],
+                'deployments': OrderedDict(),
+                'levels': [],
+            }
+            for root, dirnames, filenames in os.walk(collection_path):
+                if root == collection_path:
+                    collection_obj['files'] = filenames
+                    for dirname in dirnames:
+                        collection_obj['deployments'][dirname] = (
+                            os.path.join(root, dirname), []
+                        )
+                elif os.path.dirname(root) == collection_path:
+                    deployment = os.path.basename(root)
+                    collection_obj['deployments'][deployment] = (
+                        root, filenames
+                    )
+                collection_obj['levels'].append((root, filenames))
+            self.tree[collection] = collection_obj
+        return self.tree
+
+    def scan(self, filepaths):
+        """
+        Stats given files and reads EXIF 'DateTimeOriginal' of images that
+        are not present in the manifest yet.
+        """
+        manifest = DateRecordedManifest(self.manifest_path)
+        pending = []
+        cached = 0
+        for filepath in filepaths:
+            stat = os.stat(filepath)
+            key = os.path.relpath(filepath, self.data_dir)
+            self.files_info[filepath] = (stat.st_mtime, None)
+            if os.path.splitext(filepath)[1] != self.image_ext:
+                continue
+            hit, value = manifest.get(key, stat.st_size, stat.st_mtime)
+            if hit:
+                self.files_info[filepath] = (stat.st_mtime, value)
+                cached += 1
+            else:
+                pending.append((filepath, key, stat))
+        logging.info(
+            'EXIF cache: %s hits, %s files to scan with %s workers.',
+            cached, len(pending), self.workers
+        )
+        stats = dict((k[0], k[1:]) for k in pending)
+        paths = [k[0] for k in pending]
+        pool = None
+        if self.workers > 1 and len(paths) > 1:
+            pool = multiprocessing.Pool(self.workers)
+            results = pool.imap_unordered(
+                scan_exif_worker, paths, chunksize=64
+            )
+        else:
+            results = (scan_exif_worker(k) for k in paths)
+        try:
+            for filepath, value in results:
+                key, stat = stats[filepath]
+                self.files_info[filepath] = (stat.st_mtime, value)
+                manifest.add(key, stat.st_size, stat.st_mtime, value)
+        except BaseException:
+            # e.g. KeyboardInterrupt, don't wait for remaining files
+            if pool is not None:
+                pool.terminate()
+            raise
+        else:
+            if pool is not None:
+                pool.close()
+        finally:
+            if pool is not None:
+                pool.join()
+            manifest.close()
+
+    def get_file_info(self, filepath):
+        """
+        Returns a tuple (mtime, 'DateTimeOriginal') of a scanned file.
+        """
+        return self.files_info[filepath]
+
+
 class YAMLDefinitionGenerator(object):
     """
     """
@@ -35,7 +292,7 @@ class YAMLDefinitionGenerator(object):
     def __init__(
             self, data_dir, collections, yaml_path, timezone,
             video_ext='.mp4', video_extra_ext='.webm',
-            image_ext='.JPG', project_name='',
+            image_ext='.JPG', project_name='', scanner=None,
     ):
         self.data_dir = data_dir
         self.collections = collections
@@ -45,6 +302,9 @@ class YAMLDefinitionGenerator(object):
         self.video_extra_ext = video_extra_ext
         self.image_ext = image_ext
         self.project_name = project_name
+        self.scanner = scanner or ResourceScanner(
+            data_dir=data_dir, collections=collections, image_ext=image_ext
+        )
 
     def get_collection_def(self, name):
         collection_def = OrderedDict()
@@ -66,29 +326,27 @@ class YAMLDefinitionGenerator(object):
         The method to get datetime when resource was recorded under
         a simple assumption that this is a date of the last modification of
         recorded file. It returns UTC timestamp. In case of images it first
-        tries to read 'DateTimeOriginal` EXIF tag.
+        tries to use 'DateTimeOriginal` EXIF tag (read by the scanner).
         """
-        if os.path.splitext(filepath)[1] == self.image_ext:
+        mtime, exif_datetime = self.scanner.get_file_info(filepath)
+        if exif_datetime:
             try:
-                t = Image.open(filepath)._getexif()[36867]
-                t = datetime.datetime.strptime(t, '%Y:%m:%d %H:%M:%S')
+                t = datetime.datetime.strptime(
+                    exif_datetime, '%Y:%m:%d %H:%M:%S'
+                )
                 return str(self.timezone.localize(t).astimezone(pytz.utc))
-            except (AttributeError, KeyError, IndexError, IOError, ValueError), e:
-                t = os.path.getmtime(filepath)
-        else:
-            t = os.path.getmtime(filepath)
-        return str(datetime.datetime.utcfromtimestamp(t))
+            except ValueError:
+                pass
+        return str(datetime.datetime.utcfromtimestamp(mtime))
 
-    def get_resource_def(self, resource, resources_level):
+    def get_resource_def(self, resource, resources_level, filenames):
         filepath = os.path.join(resources_level, resource)
         split_name = os.path.splitext(resource)
         resource_def = OrderedDict()
         resource_def['name'] = split_name[0]
         resource_def['file'] = resource
         extra_file = "".join([split_name[0], self.video_extra_ext])
-        extra_file_path = os.path.join(resources_level, extra_file)
-        extra_file_exists = os.path.exists(extra_file_path)
-        if extra_file_exists:
+        if extra_file in filenames:
             resource_def['extra_file'] = extra_file
         resource_def['date_recorded'] = self.get_date_recorded(filepath)
         return resource_def
@@ -100,59 +358,171 @@ class YAMLDefinitionGenerator(object):
             ]
         ]
 
+    def scan_files(self, tree):
+        """
+        Runs the scanner over all files that are referenced in
+        the definition file.
+        """
+        filepaths = []
+        for collection_obj in tree.values():
+            levels = [(collection_obj['path'], collection_obj['files'])]
+            levels.extend(collection_obj['deployments'].values())
+            for level, filenames in levels:
+                filepaths.extend(
+                    os.path.join(level, k) for k in
+                    self.filter_files(filenames)
+                )
+        self.scanner.scan(filepaths)
+
     def build_data_dict(self):
         data_dict = OrderedDict()
         data_dict['collections'] = []
-        collections_level = os.path.join(self.data_dir)
-        for collection in  self.collections:
+        tree = self.scanner.walk()
+        self.scan_files(tree)
+        for collection in self.collections:
             # first create collection object
             collection_obj = self.get_collection_def(
                 name=collection,
             )
-            deployments_level = os.path.join(collections_level,collection)
-            deployments = [
-                k for k in os.listdir(deployments_level) if os.path.isdir(
-                    os.path.join(deployments_level,k)
-                )
-            ]
-            for deployment in deployments:
+            collection_tree = tree[collection]
+            deployments = collection_tree['deployments']
+            for deployment, (resources_level, filenames) in deployments.items():
                 deployment_obj = self.get_deployment_def(deployment)
-                resources_level = os.path.join(deployments_level,deployment)
-                resources = [
-                    k for k in os.listdir(resources_level) if os.path.isfile(
-                        os.path.join(resources_level,k)
-                    )
-                ]
-                resources = self.filter_files(resources)
+                resources = self.filter_files(filenames)
                 for resource in resources:
                     resource_obj = self.get_resource_def(
-                        resource, resources_level
+                        resource, resources_level, filenames
                     )
                     deployment_obj['resources'].append(resource_obj)
                 collection_obj['deployments'].append(deployment_obj)
 
             # "free" resources without assigned deployments
-            resources = [
-                k for k in os.listdir(deployments_level) if os.path.isfile(
-                    os.path.join(deployments_level,k)
-                )
-            ]
-            resources = self.filter_files(resources)
+            filenames = collection_tree['files']
+            resources = self.filter_files(filenames)
             for resource in resources:
                 resource_obj = self.get_resource_def(
-                    resource, deployments_level
+                    resource, collection_tree['path'], filenames
                 )
                 collection_obj['resources'].append(resource_obj)
 
             data_dict['collections'].append(collection_obj)
         return data_dict
 
-    def dump_yaml(self):
+    def dump_yaml(self, data_dict=None):
         f = open(self.yaml_path, 'w')
-        data_dict = self.build_data_dict()
+        if data_dict is None:
+            data_dict = self.build_data_dict()
         yaml.dump(data_dict, f)
 
 
+class PackageSplitter(object):
+    """
+    Splits a data package definition (see
+    :meth:`YAMLDefinitionGenerator.build_data_dict`) into a number of
+    smaller, self-contained packages. Each package gets its own definition
+    that references only the files stored in its own archive. Definitions
+    of the same collection in different packages are merged by TRAPPER
+    as collections are identified by their names and owners.
+    """
+
+    def __init__(self, data_dir, max_size=None, by_deployment=False):
+        self.data_dir = data_dir
+        self.max_size = max_size
+        self.by_deployment = by_deployment
+        self.packages = []
+        self.current = None
+
+    def new_package(self):
+        self.current = {
+            'collections': OrderedDict(),
+            'files': [],
+            'size': 0,
+        }
+        self.packages.append(self.current)
+
+    def get_collection_def(self, collection_def):
+        """
+        Returns a copy of a collection definition (without resources)
+        stored in the current package. The `deployments` key is always
+        present as it is required by `CollectionProcessor`.
+        """
+        collections = self.current['collections']
+        name = collection_def['name']
+        if name not in collections:
+            package_def = OrderedDict()
+            for key, value in collection_def.items():
+                if key not in ('deployments', 'resources'):
+                    package_def[key] = value
+            package_def['deployments'] = []
+            package_def['resources'] = []
+            collections[name] = package_def
+        return collections[name]
+
+    def get_resource_files(self, resource_def, resources_dir):
+        files = [resource_def['file']]
+        if 'extra_file' in resource_def:
+            files.append(resource_def['extra_file'])
+        files = [os.path.join(resources_dir, k) for k in files]
+        size = sum(
+            os.path.getsize(os.path.join(self.data_dir, k)) for k in files
+        )
+        return files, size
+
+    def add_resources(self, collection_def, deployment_id, resources):
+        resources_dir = collection_def['resources_dir']
+        if deployment_id is not None:
+            resources_dir = os.path.join(resources_dir, deployment_id)
+        if self.current is None or self.by_deployment:
+            self.new_package()
+        target = None
+        for resource_def in resources:
+            files, size = self.get_resource_files(resource_def, resources_dir)
+            if (
+                self.max_size and self.current['files'] and
+                self.current['size'] + size > self.max_size
+            ):
+                self.new_package()
+                target = None
+            if target is None:
+                package_def = self.get_collection_def(collection_def)
+                if deployment_id is None:
+                    target = package_def['resources']
+                else:
+                    deployment_def = OrderedDict()
+                    deployment_def['deployment_id'] = deployment_id
+                    deployment_def['resources'] = []
+                    package_def['deployments'].append(deployment_def)
+                    target = deployment_def['resources']
+            target.append(resource_def)
+            self.current['files'].extend(files)
+            self.current['size'] += size
+
+    def split(self, data_dict):
+        """
+        Returns a list of tuples (definition, files, size) where `files`
+        is a list of paths relative to the data directory.
+        """
+        for collection_def in data_dict['collections']:
+            for deployment_def in collection_def['deployments']:
+                self.add_resources(
+                    collection_def, deployment_def['deployment_id'],
+                    deployment_def['resources']
+                )
+            self.add_resources(
+                collection_def, None, collection_def['resources']
+            )
+        packages = []
+        for package in self.packages:
+            if not package['files']:
+                continue
+            package_dict = OrderedDict()
+            package_dict['collections'] = list(
+                package['collections'].values()
+            )
+            packages.append((package_dict, package['files'], package['size']))
+        return packages
+
+
 class GenerateDataPackage(object):
     """
     """
@@ -160,7 +530,8 @@ class GenerateDataPackage(object):
     def __init__(
             self, data_path, output_path, collections, timezone, 
             video_ext='.mp4', video_extra_ext='.webm',
-            image_ext='.JPG', project=None
+            image_ext='.JPG', project=None, workers=None, manifest_path=None,
+            compression=zipfile.ZIP_STORED, max_size=None, by_deployment=False
     ):
         self.ts = datetime.datetime.now().strftime('%Y%m%d%H%M%S')
         if not os.path.isdir(data_path):
@@ -190,12 +561,44 @@ class GenerateDataPackage(object):
         self.video_extra_ext = video_extra_ext
         self.image_ext = image_ext
         self.project = project
+        if manifest_path is None:
+            manifest_path = os.path.join(self.data_path, '.trapper_manifest')
+        self.scanner = ResourceScanner(
+            data_dir=self.data_path,
+            collections=self.collections,
+            image_ext=self.image_ext,
+            workers=workers,
+            manifest_path=manifest_path
+        )
+        self.compression = compression
+        self.max_size = max_size
+        self.by_deployment = by_deployment
+
+    @property
+    def is_split(self):
+        return bool(self.max_size or self.by_deployment)
 
-    def get_package_name(self, ext):
+    def get_package_name(self, ext, part=None):
         if len(self.collections) == 1:
-            return self.collections[0] + '_' + self.ts + ext
+            name = self.collections[0] + '_' + self.ts
         else:
-            return '_'.join(self.collections) + '_' + self.ts + ext
+            name = '_'.join(self.collections) + '_' + self.ts
+        if part is not None:
+            name += '_part%03d' % part
+        return name + ext
+
+    def get_yaml_generator(self, yaml_path):
+        return YAMLDefinitionGenerator(
+            data_dir=self.data_path,
+            collections=self.collections,
+            yaml_path=yaml_path,
+            video_ext = self.video_ext,
+            video_extra_ext=self.video_extra_ext,
+            image_ext=self.image_ext,
+            timezone=self.timezone,
+            project_name=self.project,
+            scanner=self.scanner
+        )
 
     def generate_yaml_definition(self):
         yaml_path = os.path.join(
@@ -206,17 +609,7 @@ class GenerateDataPackage(object):
             'Generating data package definition file:\n%s',
             yaml_path
         )
-        gen = YAMLDefinitionGenerator(
-            data_dir=self.data_path,
-            collections=self.collections,
-            yaml_path=yaml_path,
-            video_ext = self.video_ext,
-            video_extra_ext=self.video_extra_ext,
-            image_ext=self.image_ext,
-            timezone=self.timezone,
-            project_name=self.project
-        )
-        gen.dump_yaml()
+        self.get_yaml_generator(yaml_path).dump_yaml()
 
     def filter_files(self, filenames):
         regexp = '.*\.?({video_ext}|{video_extra_ext}|{image_ext})'.format(
@@ -236,12 +629,10 @@ class GenerateDataPackage(object):
             'Collecting %s, %s and %s files...',
             self.video_ext, self.video_extra_ext, self.image_ext
         )
+        tree = self.scanner.walk()
         for collection in self.collections:
             logging.info('Collection: %s', collection)
-            collection_path = os.path.join(
-                self.data_path, collection
-            )
-            for root, dirnames, filenames in os.walk(collection_path):
+            for root, filenames in tree[collection]['levels']:
                 for filename in self.filter_files(filenames):
                     matches.append(os.path.join(root, filename))
         logging.info('Found %s files in total.', len(matches))
@@ -256,12 +647,52 @@ class GenerateDataPackage(object):
         )
         logging.info('Building the zip archive: %s', zip_path)
         logging.info('')
-        with zipfile.ZipFile(zip_path, 'w', allowZip64=True) as zip:
+        with zipfile.ZipFile(
+                zip_path, 'w', self.compression, allowZip64=True
+        ) as zip:
             for f in files:
                 f_archive = re.sub('^'+self.data_path+os.path.sep+'?', '', f)
                 logging.info('Adding file: %s', f_archive)
                 zip.write(f, f_archive)
 
+    def make_split_packages(self):
+        """
+        Builds a number of smaller data packages (a zip archive and
+        a matching definition file each) split by deployments and/or capped
+        by size. Only files referenced in the definitions are archived.
+        """
+        gen = self.get_yaml_generator(yaml_path=None)
+        data_dict = gen.build_data_dict()
+        splitter = PackageSplitter(
+            data_dir=self.data_path,
+            max_size=self.max_size,
+            by_deployment=self.by_deployment
+        )
+        packages = splitter.split(data_dict)
+        logging.info('Splitting data into %s packages.', len(packages))
+        for part, (package_dict, files, size) in enumerate(packages, 1):
+            gen.yaml_path = os.path.join(
+                self.output_path,
+                self.get_package_name('.yaml', part=part)
+            )
+            zip_path = os.path.join(
+                self.output_path,
+                self.get_package_name('.zip', part=part)
+            )
+            logging.info(
+                'Building package %s (%s files, %.1f MB): %s',
+                part, len(files), size / 1024. / 1024., zip_path
+            )
+            gen.dump_yaml(package_dict)
+            with zipfile.ZipFile(
+                    zip_path, 'w', self.compression, allowZip64=True
+            ) as zip:
+                for f_archive in files:
+                    logging.info('Adding file: %s', f_archive)
+                    zip.write(
+                        os.path.join(self.data_path, f_archive), f_archive
+                    )
+
 
 def main():
     title = 'Generate data package that can be uploaded using trapper web interface'
@@ -319,6 +750,50 @@ def main():
             help=('Acronym of the research project that uploaded '
                   'resources belong to.')
         ),
+        make_option(
+            '--workers',
+            action='store',
+            type='int',
+            dest='workers',
+            default=None,
+            help=('Number of processes used to read EXIF data '
+                  '(default: number of CPUs).')
+        ),
+        make_option(
+            '--manifest-path',
+            action='store',
+            dest='manifest_path',
+            default=None,
+            help=('Path to the cache of already scanned files '
+                  '(default: DATA_PATH/.trapper_manifest). Use an empty '
+                  'string to disable it.')
+        ),
+        make_option(
+            '--deflate',
+            action='store_true',
+            dest='deflate',
+            default=False,
+            help=('Compress archived files. By default files are only '
+                  'stored as media files (JPEG, MP4) can hardly be '
+                  'compressed any further.')
+        ),
+        make_option(
+            '--max-size',
+            action='store',
+            type='int',
+            dest='max_size',
+            default=None,
+            help=('Split data into multiple packages, each of them not '
+                  'bigger than a given size (in MB).')
+        ),
+        make_option(
+            '--split-by-deployment',
+            action='store_true',
+            dest='by_deployment',
+            default=False,
+            help=('Split data into multiple packages, one for each '
+                  'deployment (and one for resources without deployment).')
+        ),
     ]
     parser = OptionParser(usage, option_list=option_list)
     (options, args) = parser.parse_args()
@@ -349,10 +824,20 @@ def main():
         video_extra_ext=options.video_extra_ext,
         image_ext=options.image_ext,
         timezone=timezone,
-        project=options.project
+        project=options.project,
+        workers=options.workers,
+        manifest_path=options.manifest_path,
+        compression=(
+            zipfile.ZIP_DEFLATED if options.deflate else zipfile.ZIP_STORED
+        ),
+        max_size=options.max_size and options.max_size * 1024 * 1024,
+        by_deployment=options.by_deployment
     )
-    gen.generate_yaml_definition()
-    gen.make_zip()
+    if gen.is_split:
+        gen.make_split_packages()
+    else:
+        gen.generate_yaml_definition()
+        gen.make_zip()
 
 
 if __name__ == "__main__":
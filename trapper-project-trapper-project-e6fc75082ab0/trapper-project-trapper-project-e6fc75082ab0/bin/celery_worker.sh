@@ -4,9 +4,14 @@
 #
 # Run celery worker for project in virtualenv
 #
+# Usage: celery_worker.sh [queue]
+# Worker consumes a single queue (default: 'default') with settings of
+# a pool defined in CELERY_WORKER_POOLS.
+#
 ###############################################################
 
-NAME="trapper - celery_worker"
+QUEUE="${1:-default}"
+NAME="trapper - celery_worker (${QUEUE})"
 
 SCRIPT_DIR=$( cd "$( dirname "${BASH_SOURCE[0]}" )" && pwd )
 PROJECT_DIR=$(readlink -f "${SCRIPT_DIR}/..")
@@ -27,4 +32,7 @@ fi
 exec celery \
   -A trapper worker \
   --loglevel="${LOG_LEVEL}" \
+  --queues="${QUEUE}" \
+  --hostname="${QUEUE}@%h" \
+  -Ofair
 
@@ -59,6 +59,7 @@ requires = [
     'python-memcached==1.57',
     'pytz==2016.3',
     'rest-pandas==0.4.0',
+    'scandir==1.2',
     'simplejson==3.8.2',
     'six==1.10.0',
     'sqlparse==0.1.19',
@@ -7,9 +7,10 @@ email notification that user can be moderated
 
 from allauth.account.adapter import DefaultAccountAdapter
 
-from django.core.mail import send_mail, mail_admins
+from django.core.mail import mail_admins
 from django.core.urlresolvers import reverse
 from trapper.middleware import get_current_request
+from trapper.apps.messaging.mail import send_email
 from django.contrib import messages
 from django.utils import timezone
 from django.conf import settings
@@ -44,7 +45,7 @@ class TrapperAdapter(DefaultAccountAdapter):
         * to user
         * to admins
         """
-        send_mail(
+        send_email(
             subject=u'Your Trapper account has just been created!',
             message=(
                 u'Dear {username},\n\n'
@@ -54,9 +55,7 @@ class TrapperAdapter(DefaultAccountAdapter):
                 u'Best regards,\n'
                 u'Trapper Team'
             ).format(username=user.username.capitalize()),
-            from_email=None,
-            recipient_list=[user.email],
-            fail_silently=True
+            recipient_list=[user.email]
         )
         mail_admins(
             u"New request for Trapper account",
@@ -10,10 +10,12 @@ from django.contrib.auth.models import Permission, ContentType
 from django.contrib.auth.admin import UserAdmin
 from django.contrib.auth import get_user_model
 from django.shortcuts import render
-from django.core.mail import send_mail
 
-from trapper.apps.accounts.models import UserProfile, UserTask
+from trapper.apps.accounts.models import (
+    UserProfile, UserTask, UserTaskHistory
+)
 from trapper.apps.accounts.forms import AdminSetUserRolesForm, AdminMailUsersForm
+from trapper.apps.messaging.mail import send_emails
 from trapper.apps.research.models import ResearchProjectRole
 from trapper.apps.media_classification.models import ClassificationProjectRole
 
@@ -77,15 +79,12 @@ class TrapperUserAdmin(UserAdmin):
             if form.is_valid():
                 subject = form.cleaned_data['subject']
                 text = form.cleaned_data['text']
-                for user in queryset:
-                    if user.userprofile.system_notifications:
-                        send_mail(
-                            subject=subject,
-                            message=text,
-                            from_email=None,
-                            recipient_list=[user.email,],
-                            fail_silently=True
-                        )
+                send_emails([
+                    (subject, text, [email])
+                    for email in queryset.filter(
+                        userprofile__system_notifications=True
+                    ).values_list('email', flat=True)
+                ])
 
                 self.message_user(
                     request, 
@@ -108,5 +107,6 @@ class TrapperUserAdmin(UserAdmin):
 admin.site.register(User, TrapperUserAdmin)
 admin.site.register(UserProfile)
 admin.site.register(UserTask)
+admin.site.register(UserTaskHistory)
 admin.site.register(Permission)
 admin.site.register(ContentType)
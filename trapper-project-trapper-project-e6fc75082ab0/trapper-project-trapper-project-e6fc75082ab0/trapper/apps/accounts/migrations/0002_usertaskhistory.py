@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserTaskHistory',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('task_id', models.CharField(max_length=765, unique=True)),
+                ('name', models.CharField(blank=True, max_length=255)),
+                ('state', models.CharField(default='PENDING', max_length=50)),
+                ('date_created', models.DateTimeField(default=django.utils.timezone.now)),
+                ('date_started', models.DateTimeField(blank=True, null=True)),
+                ('runtime', models.FloatField(blank=True, null=True)),
+                ('result', models.TextField(blank=True)),
+                ('traceback', models.TextField(blank=True)),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+                ('user_task', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='history', to='accounts.UserTask')),
+            ],
+            options={
+                'ordering': ['-date_created'],
+            },
+        ),
+        migrations.AlterIndexTogether(
+            name='usertaskhistory',
+            index_together=set([('user', 'date_created')]),
+        ),
+    ]
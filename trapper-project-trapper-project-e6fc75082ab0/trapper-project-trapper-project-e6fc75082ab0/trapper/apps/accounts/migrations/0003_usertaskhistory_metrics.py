@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0002_usertaskhistory'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='usertaskhistory',
+            name='metrics',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='usertaskhistory',
+            name='progress',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='usertaskhistory',
+            name='rows',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -12,19 +12,29 @@ Instad of mail is sent to admins, so they can activate account
 from __future__ import unicode_literals
 
 import os
+import json
+import datetime
 
 from django.db import models
 from django.conf import settings
+from django.core.cache import cache
 from django.contrib.auth.models import AbstractUser
 from django.core.urlresolvers import reverse
 from  django.core.files.storage import FileSystemStorage
 from django.db.models.signals import pre_save, post_save
 from django.dispatch import receiver
-from django.core.mail import send_mail
+from django.utils.encoding import force_text
+from django.utils.text import Truncator
 from django.utils.timezone import now
 
+from celery import states
+from celery.signals import (
+    task_prerun, task_postrun, task_failure, task_revoked
+)
+
 from trapper.apps.common.fields import ResizedImageField, SafeTextField
 from trapper.apps.messaging.taxonomies import MessageType
+from trapper.apps.messaging.mail import send_email
 from trapper.apps.common.utils.models import delete_old_file
 from trapper.apps.common.fields import SafeTextField
 from trapper.apps.accounts.utils import (
@@ -32,6 +42,21 @@ from trapper.apps.accounts.utils import (
     get_external_data_packages_path
 )
 from trapper.apps.accounts.taxonomy import PackageType, ExternalStorageSettings
+from trapper.apps.accounts.task_metrics import (
+    start_task_metrics, finish_task_metrics
+)
+
+
+USER_COUNTERS_CACHE_KEY = 'user_counters_{pk}'
+
+
+def invalidate_user_counters(users):
+    """Remove cached counters (see :meth:`UserProfile.get_counters`) of
+    given users (or their primary keys)"""
+    cache.delete_many([
+        USER_COUNTERS_CACHE_KEY.format(pk=getattr(k, 'pk', k))
+        for k in users
+    ])
 
 
 class User(AbstractUser):
@@ -79,52 +104,77 @@ class UserProfile(models.Model):
                 url=settings.STATIC_URL
             )
 
+    def get_counters(self):
+        """Returns a dict with numbers of unread and inbox messages and
+        collection requests awaiting resolution.
+
+        Counters are cached per user (see :func:`invalidate_user_counters`)
+        and memoized on the profile instance, so rendering all of them
+        costs at most one cache lookup.
+        """
+        counters = getattr(self, '_counters', None)
+        if counters is None:
+            cache_key = USER_COUNTERS_CACHE_KEY.format(pk=self.user_id)
+            counters = cache.get(cache_key)
+            if counters is None:
+                counters = self.calculate_counters()
+                cache.set(
+                    cache_key, counters, settings.USER_COUNTERS_TIMEOUT
+                )
+            self._counters = counters
+        return counters
+
+    def calculate_counters(self):
+        """Calculate counters returned by :meth:`get_counters` using
+        a single query for messages and a single query for requests"""
+        not_request = ~models.Q(message_type__in=[
+            MessageType.COLLECTION_REQUEST,
+            MessageType.RESOURCE_REQUEST
+        ])
+        counters = self.user.received_messages.aggregate(
+            unread=models.Count(models.Case(
+                models.When(
+                    not_request & models.Q(date_received__isnull=True),
+                    then=1
+                )
+            )),
+            inbox=models.Count(models.Case(
+                models.When(
+                    ~models.Q(message_type=MessageType.COLLECTION_REQUEST),
+                    then=1
+                )
+            )),
+        )
+        counters['awaiting_collection_requests'] = \
+            self.user.collection_requests.filter(
+                resolved_at__isnull=True
+            ).count()
+        return counters
+
     def has_unread_messages(self):
         """Checks whether user has any unread messages
         (see :class:`trapper.apps.messaging.models.Message`).
         """
-
-        return self.user.received_messages.filter(
-            date_received=None
-        ).exclude(
-            message_type__in=[
-                MessageType.COLLECTION_REQUEST,
-                MessageType.RESOURCE_REQUEST
-            ]
-        ).exists()
+        return self.count_unread_messages() > 0
 
     def count_unread_messages(self):
         """Returns the number of unread messages.
         (see :class:`trapper.apps.messaging.models.Message`).
         """
-
-        return self.user.received_messages.filter(
-            date_received=None
-        ).exclude(
-            message_type__in=[
-                MessageType.COLLECTION_REQUEST,
-                MessageType.RESOURCE_REQUEST
-            ]
-        ).count()
+        return self.get_counters()['unread']
 
     def count_inbox_messages(self):
         """Returns total number of inbox messages.
         (see :class:`trapper.apps.messaging.models.Message`).
         """
-
-        return self.user.received_messages.exclude(
-            message_type=MessageType.COLLECTION_REQUEST
-        ).count()
+        return self.get_counters()['inbox']
 
     def awaiting_collection_requests(self):
         """Returns the number of collections requests that has not been
         resolved yet.
         This means that some users asked for access to collection
         """
-
-        return self.user.collection_requests.filter(
-            resolved_at__isnull=True
-        ).count()
+        return self.get_counters()['awaiting_collection_requests']
 
     def awaiting_resource_requests(self):
         """Returns the number of resource requests that has not been
@@ -169,7 +219,7 @@ def active_notifiction(sender, instance, **kwargs):
             create_external_media(username=instance.username)
 
             # send an email notification to a user that account has been activated
-            send_mail(
+            send_email(
                 subject='Your Trapper account has just been activated!',
                 message=(
                     'Dear {username},\n\n'
@@ -177,9 +227,7 @@ def active_notifiction(sender, instance, **kwargs):
                     'Best regards,\n'
                     'Trapper Team'
                 ).format(username=instance.username.capitalize()),
-                from_email=None,
-                recipient_list=[instance.email],
-                fail_silently=True
+                recipient_list=[instance.email]
             )
 
 
@@ -192,6 +240,148 @@ class UserTask(models.Model):
     task_id = models.CharField(max_length=765, unique=True)
 
 
+class UserTaskHistory(models.Model):
+    """
+    Status, runtime and a truncated result of a user's celery task, used
+    to render the dashboard without querying celery tables.
+
+    Entries are updated by celery signals (see below). A history of each
+    user is limited to `settings.USER_TASK_HISTORY_SIZE` latest tasks.
+    Progress and metrics are reported by tasks using
+    :mod:`trapper.apps.accounts.task_metrics`.
+    """
+
+    user_task = models.OneToOneField(
+        UserTask, null=True, blank=True, related_name='history'
+    )
+    user = models.ForeignKey(User, null=True, blank=True)
+    task_id = models.CharField(max_length=765, unique=True)
+    name = models.CharField(max_length=255, blank=True)
+    state = models.CharField(max_length=50, default=states.PENDING)
+    date_created = models.DateTimeField(default=now)
+    date_started = models.DateTimeField(null=True, blank=True)
+    runtime = models.FloatField(null=True, blank=True)
+    result = models.TextField(blank=True)
+    traceback = models.TextField(blank=True)
+    rows = models.PositiveIntegerField(null=True, blank=True)
+    progress = models.FloatField(null=True, blank=True)
+    metrics = models.TextField(blank=True)
+
+    class Meta:
+        index_together = ['user', 'date_created']
+        ordering = ['-date_created']
+
+    @classmethod
+    def update_task(cls, task_id, **fields):
+        """Update an entry of given task; only tasks assigned to users
+        (see :class:`UserTask`) have entries"""
+        cls.objects.filter(task_id=task_id).update(**fields)
+
+    @classmethod
+    def prune(cls, user):
+        """Remove entries (and related user tasks) exceeding the history
+        size of given user. Entries of tasks that have never been assigned
+        to any user are removed after a day."""
+        pks = list(
+            cls.objects.filter(user=user).order_by(
+                '-date_created'
+            ).values_list('pk', flat=True)[settings.USER_TASK_HISTORY_SIZE:]
+        )
+        if pks:
+            UserTask.objects.filter(history__pk__in=pks).delete()
+            cls.objects.filter(pk__in=pks).delete()
+        cls.objects.filter(
+            user__isnull=True,
+            date_created__lt=now() - datetime.timedelta(days=1)
+        ).delete()
+
+    @property
+    def progress_display(self):
+        """Progress of a running task reported with
+        :func:`trapper.apps.accounts.task_metrics.task_progress`"""
+        if self.state != states.STARTED:
+            return ''
+        if self.progress is not None:
+            return '{progress:.0f}%'.format(progress=self.progress)
+        if self.rows:
+            return '{rows} rows'.format(rows=self.rows)
+        return ''
+
+    def get_metrics(self):
+        """Return a dict with metrics of a finished task"""
+        if not self.metrics:
+            return {}
+        return json.loads(self.metrics)
+
+    @staticmethod
+    def summarize(value, html=True):
+        """Truncate a task result stored in the history"""
+        if value is None:
+            return ''
+        return Truncator(force_text(value)).chars(
+            settings.USER_TASK_RESULT_LENGTH, html=html
+        )
+
+
+@receiver(post_save, sender=UserTask)
+def create_user_task_history(sender, instance, created, **kwargs):
+    """When a user task is created - create its history entry and remove
+    the oldest ones"""
+    if created:
+        UserTaskHistory.objects.update_or_create(
+            task_id=instance.task_id,
+            defaults={'user_task': instance, 'user': instance.user}
+        )
+        UserTaskHistory.prune(user=instance.user)
+
+
+@task_prerun.connect
+def task_started_history(task_id, task, **kwargs):
+    """Mark a task as started and start collecting its metrics"""
+    UserTaskHistory.update_task(
+        task_id=task_id, name=task.name,
+        state=states.STARTED, date_started=now()
+    )
+    start_task_metrics(task_id=task_id, name=task.name)
+
+
+@task_postrun.connect
+def task_finished_history(task_id, task, retval, state, **kwargs):
+    """Store a state, runtime, metrics and a result summary of a finished
+    task"""
+    metrics = finish_task_metrics(task_id=task_id, state=state)
+    try:
+        history = UserTaskHistory.objects.get(task_id=task_id)
+    except UserTaskHistory.DoesNotExist:
+        return
+    history.name = task.name
+    history.state = state or history.state
+    if history.date_started:
+        history.runtime = (now() - history.date_started).total_seconds()
+    history.result = UserTaskHistory.summarize(retval)
+    if metrics is not None:
+        history.rows = metrics['rows']
+        history.progress = None
+        history.metrics = json.dumps(metrics)
+    history.save()
+
+
+@task_failure.connect
+def task_failed_history(task_id, einfo=None, **kwargs):
+    """Store a traceback of a failed task"""
+    UserTaskHistory.objects.filter(task_id=task_id).update(
+        traceback=UserTaskHistory.summarize(einfo, html=False)
+    )
+
+
+@task_revoked.connect
+def task_revoked_history(request, **kwargs):
+    """Mark a task as revoked"""
+    UserTaskHistory.objects.filter(task_id=request.id).update(
+        state=states.REVOKED
+    )
+
+
 external_media_location = FileSystemStorage(
     location=settings.EXTERNAL_MEDIA_ROOT,
     base_url=settings.EXTERNAL_MEDIA_URL
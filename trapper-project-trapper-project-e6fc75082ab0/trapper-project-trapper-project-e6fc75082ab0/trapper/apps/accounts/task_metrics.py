@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""
+Instrumentation of celery tasks.
+
+Metrics of each task (wall time, number of processed rows, rows per second,
+RSS of a worker process after a task and its growth during a task, number
+and time of SQL queries and a breakdown into phases) are collected between `task_prerun` and `task_postrun` signals
+(see :mod:`trapper.apps.accounts.models`), stored in a task history and
+exported as JSON lines to the `trapper.task_metrics` logger.
+
+Tasks (or classes used by them) report progress and phases with
+:func:`task_progress` and :func:`task_phase`. Both functions do nothing when
+code is not executed by a celery worker (e.g. when `CELERY_ENABLED` is
+False), so they can be used unconditionally.
+"""
+from __future__ import unicode_literals
+
+import json
+import logging
+import resource
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import connections
+
+TASK_METRICS_LOGGER = logging.getLogger('trapper.task_metrics')
+
+_current = threading.local()
+
+
+def get_current_rss():
+    """Return a current resident set size of this process in kilobytes
+    or None if it can't be read (`/proc` is available only on linux).
+    Unlike `ru_maxrss` (a peak of a whole process lifetime) it can be
+    compared before and after a single task."""
+    try:
+        with open('/proc/self/statm') as statm:
+            pages = int(statm.read().split()[1])
+    except (IOError, OSError, IndexError, ValueError):
+        return None
+    return pages * resource.getpagesize() // 1024
+
+
+class TaskMetrics(object):
+    """Metrics of a single task execution.
+
+    Queries are counted by wrapping cursors created by database connections
+    of a worker thread, so (unlike a debug cursor) executed SQL is not kept
+    in memory.
+    """
+    CURSOR_FACTORIES = ('make_cursor', 'make_debug_cursor')
+
+    def __init__(self, task_id, name):
+        self.task_id = task_id
+        self.name = name
+        self.start = time.time()
+        self.start_rss = get_current_rss()
+        self.rows = 0
+        self.total = None
+        self.queries = 0
+        self.sql_time = 0.0
+        self.phases = OrderedDict()
+        self.current_phase = None
+        self.last_report = self.start
+        self.connections = list(connections.all())
+        for connection in self.connections:
+            for attr in self.CURSOR_FACTORIES:
+                setattr(
+                    connection, attr,
+                    self.wrap_factory(getattr(connection, attr))
+                )
+
+    def wrap_factory(self, factory):
+        def wrapper(cursor):
+            wrapped = factory(cursor)
+            wrapped.execute = self.wrap_execute(wrapped.execute)
+            wrapped.executemany = self.wrap_execute(wrapped.executemany)
+            return wrapped
+        return wrapper
+
+    def wrap_execute(self, execute):
+        def wrapper(*args, **kwargs):
+            start = time.time()
+            try:
+                return execute(*args, **kwargs)
+            finally:
+                self.queries += 1
+                self.sql_time += time.time() - start
+        return wrapper
+
+    def phase(self, name):
+        """Start a new phase of a task; a previous phase is finished.
+        Time and queries of phases with the same name are summed up"""
+        self.end_phase()
+        self.current_phase = (name, time.time(), self.queries)
+
+    def end_phase(self):
+        if self.current_phase is None:
+            return
+        name, start, queries = self.current_phase
+        phase = self.phases.setdefault(name, {'time': 0, 'queries': 0})
+        phase['time'] += time.time() - start
+        phase['queries'] += self.queries - queries
+        self.current_phase = None
+
+    def progress(self, rows, total=None):
+        """Store a number of processed rows; progress is written to a task
+        history at most every `settings.TASK_PROGRESS_INTERVAL` seconds"""
+        self.rows = rows
+        if total is not None:
+            self.total = total
+        now = time.time()
+        if now - self.last_report < settings.TASK_PROGRESS_INTERVAL:
+            return
+        self.last_report = now
+        from trapper.apps.accounts.models import UserTaskHistory
+        UserTaskHistory.objects.filter(task_id=self.task_id).update(
+            rows=self.rows, progress=self.get_progress()
+        )
+
+    def get_progress(self):
+        """Return progress in percents or None if total is unknown"""
+        if not self.total:
+            return None
+        return min(100.0, 100.0 * self.rows / self.total)
+
+    def finish(self, state=None):
+        """Restore connections and return a dict with collected metrics"""
+        self.end_phase()
+        for connection in self.connections:
+            for attr in self.CURSOR_FACTORIES:
+                connection.__dict__.pop(attr, None)
+        wall_time = time.time() - self.start
+        rss = get_current_rss()
+        if rss is None or self.start_rss is None:
+            rss_delta = None
+        else:
+            rss_delta = rss - self.start_rss
+        return {
+            'task': self.name,
+            'task_id': self.task_id,
+            'state': state,
+            'wall_time': wall_time,
+            'rows': self.rows,
+            'total': self.total,
+            'rows_per_second': self.rows / wall_time if wall_time else None,
+            # kilobytes
+            'rss': rss,
+            'rss_delta': rss_delta,
+            'queries': self.queries,
+            'sql_time': self.sql_time,
+            'phases': self.phases,
+        }
+
+
+def get_task_metrics():
+    """Return metrics of a task executed by current thread or None"""
+    return getattr(_current, 'metrics', None)
+
+
+def start_task_metrics(task_id, name):
+    """Start collecting metrics of given task in current thread"""
+    previous = get_task_metrics()
+    if previous is not None:
+        # postrun signal of a previous task was not received
+        previous.finish()
+    _current.metrics = TaskMetrics(task_id=task_id, name=name)
+    return _current.metrics
+
+
+def finish_task_metrics(task_id, state=None):
+    """Stop collecting metrics of given task, export them to a log and
+    return them (or None if metrics of this task are not collected)"""
+    metrics = get_task_metrics()
+    if metrics is None or metrics.task_id != task_id:
+        return None
+    del _current.metrics
+    data = metrics.finish(state=state)
+    TASK_METRICS_LOGGER.info(json.dumps(data))
+    return data
+
+
+def task_progress(rows, total=None):
+    """Report a number of rows processed by a current task"""
+    metrics = get_task_metrics()
+    if metrics is not None:
+        metrics.progress(rows, total=total)
+
+
+def task_phase(name):
+    """Mark the beginning of a next phase of a current task"""
+    metrics = get_task_metrics()
+    if metrics is not None:
+        metrics.phase(name)
@@ -5,10 +5,17 @@ import os
 from django.core.urlresolvers import reverse
 from django.contrib.auth import get_user_model
 from django.conf import settings
+from django.test import override_settings
 from django.utils.lorem_ipsum import words
 
 from trapper.apps.common.utils.identity import create_hashcode
 from trapper.apps.common.utils.test_tools import ExtendedTestCase
+from trapper.apps.accounts.models import (
+    UserTask, UserTaskHistory, task_started_history
+)
+from trapper.apps.accounts.task_metrics import (
+    start_task_metrics, finish_task_metrics, task_phase, task_progress
+)
 from trapper.apps.accounts.taxonomy import ExternalStorageSettings
 
 User = get_user_model()
@@ -193,3 +200,86 @@ class UserProfileTestCase(ExtendedTestCase):
         )
         self.assertTrue(logged_in)
 
+
+
+class UserTaskHistoryTestCase(ExtendedTestCase):
+    """Tests related to the history of user's celery tasks"""
+
+    def setUp(self):
+        super(UserTaskHistoryTestCase, self).setUp()
+        self.summon_alice()
+
+    def test_history_created(self):
+        """History entry is created together with a user task"""
+        user_task = UserTask.objects.create(
+            user=self.alice, task_id=create_hashcode()
+        )
+        history = UserTaskHistory.objects.get(task_id=user_task.task_id)
+        self.assertEqual(history.user, self.alice)
+        self.assertEqual(history.user_task, user_task)
+
+    def test_history_of_user_tasks_only(self):
+        """Tasks that are not assigned to users don't have history
+        entries"""
+        class Task(object):
+            name = 'test'
+
+        user_task = UserTask.objects.create(
+            user=self.alice, task_id=create_hashcode()
+        )
+        other_id = create_hashcode()
+        for task_id in (user_task.task_id, other_id):
+            task_started_history(task_id=task_id, task=Task())
+            finish_task_metrics(task_id=task_id)
+        history = UserTaskHistory.objects.get(task_id=user_task.task_id)
+        self.assertIsNotNone(history.date_started)
+        self.assertFalse(
+            UserTaskHistory.objects.filter(task_id=other_id).exists()
+        )
+
+    @override_settings(USER_TASK_HISTORY_SIZE=2)
+    def test_history_bounded(self):
+        """Only the latest tasks are kept in a history"""
+        task_ids = []
+        for i in range(3):
+            task_ids.append(
+                UserTask.objects.create(
+                    user=self.alice, task_id=create_hashcode()
+                ).task_id
+            )
+        self.assertItemsEqual(
+            UserTaskHistory.objects.filter(
+                user=self.alice
+            ).values_list('task_id', flat=True),
+            task_ids[1:]
+        )
+        self.assertFalse(
+            UserTask.objects.filter(task_id=task_ids[0]).exists()
+        )
+
+    @override_settings(TASK_PROGRESS_INTERVAL=0)
+    def test_task_metrics(self):
+        """Task metrics count queries per phase and progress is stored
+        in a history"""
+        user_task = UserTask.objects.create(
+            user=self.alice, task_id=create_hashcode()
+        )
+        start_task_metrics(task_id=user_task.task_id, name='test')
+        task_phase('read')
+        list(UserTask.objects.all())
+        task_progress(5, 10)
+        history = UserTaskHistory.objects.get(task_id=user_task.task_id)
+        self.assertEqual(history.rows, 5)
+        self.assertEqual(history.progress, 50)
+
+        metrics = finish_task_metrics(task_id=user_task.task_id)
+        self.assertEqual(metrics['rows'], 5)
+        self.assertGreaterEqual(metrics['phases']['read']['queries'], 1)
+        self.assertGreaterEqual(metrics['queries'], 2)
+        if metrics['rss'] is not None:
+            self.assertGreater(metrics['rss'], 0)
+            self.assertIsNotNone(metrics['rss_delta'])
+
+        # metrics are not collected after a task is finished
+        task_progress(10)
+        self.assertIsNone(finish_task_metrics(task_id=user_task.task_id))
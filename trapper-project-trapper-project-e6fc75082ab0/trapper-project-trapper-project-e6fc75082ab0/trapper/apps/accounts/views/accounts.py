@@ -8,7 +8,7 @@ from __future__ import unicode_literals
 
 import os
 import datetime
-from djcelery.models import TaskState, TaskMeta
+from celery import states
 
 from django.views import generic
 from django.shortcuts import render, get_object_or_404, redirect
@@ -19,7 +19,7 @@ from django.http import HttpResponseRedirect, Http404, HttpResponseForbidden
 from django.utils import timezone
 
 from trapper.apps.accounts.models import (
-    UserProfile, UserTask, UserDataPackage
+    UserProfile, UserTaskHistory, UserDataPackage
 )
 from trapper.apps.accounts.forms import (
     UserProfileForm, UserProfilePasswordChangeForm,
@@ -297,35 +297,23 @@ class DashboardView(LoginRequiredMixin, generic.TemplateView):
         return name
 
     def get_celery_tasks(self):
-        """Get current celery tasks for currently logged in user"""
-        user = self.request.user
-        # get user tasks ids
-        tasks_ids = UserTask.objects.filter(user=user).values_list(
-            'task_id', flat=True
-        )
+        """Get latest celery tasks of currently logged in user"""
         exclude_tasks = [
             'trapper.apps.storage.tasks.celery_update_thumbnails',
         ]
-        # get task states
-        tasks = TaskState.objects.filter(
-            task_id__in=tasks_ids
-        ).exclude(name__in=exclude_tasks)
-        # get task metas
-        metas = TaskMeta.objects.filter(task_id__in=tasks_ids)
-        metas = [(k.task_id, k.result) for k in metas]
-        metas = dict(metas)
+        tasks = UserTaskHistory.objects.filter(
+            user=self.request.user
+        ).exclude(
+            name__in=exclude_tasks
+        ).order_by('-date_created')[:settings.DASHBOARD_TASKS]
 
         for task in tasks:
             task.dashboard_name = self._clean_task_name(name=task.name)
-            runtime = task.runtime or 0
+            start = task.date_started or task.date_created
             task.dashboard_end = (
-                task.tstamp + datetime.timedelta(seconds=runtime)
+                start + datetime.timedelta(seconds=task.runtime or 0)
             )
             task.dashboard_status = StateSettings.STATE_MAP[task.state]
-            try:
-                task.result = metas[task.task_id]
-            except KeyError:
-                task.result = ''
 
         return tasks
 
@@ -362,19 +350,16 @@ class CeleryTaskCancelView(generic.View):
     def post(self, request, *args, **kwargs):
         """If user has any task that can be stoppable, then calling this
         method will stop it and return to dashboard with proper message"""
-        lookup = u"'username': '{name}'".format(
-            name=self.request.user.username
-        )
         task_id = request.POST.get('task_id', None)
 
         if task_id:
             try:
-                task = TaskState.objects.get(
-                    kwargs__icontains=lookup,
+                task = UserTaskHistory.objects.get(
+                    user=self.request.user,
                     state__in=StateSettings.STOPPABLE,
                     task_id=task_id
                 )
-            except TaskState.DoesNotExist:
+            except UserTaskHistory.DoesNotExist:
                 messages.error(
                     request=request,
                     message=(
@@ -385,6 +370,8 @@ class CeleryTaskCancelView(generic.View):
                 )
             else:
                 app.control.revoke(task.task_id)
+                task.state = states.REVOKED
+                task.save(update_fields=['state'])
                 messages.success(
                     request=request,
                     message='Task {task_id} has been stopped'.format(
@@ -5,11 +5,15 @@ Relation to other models is defined as generic foreign key
 """
 from __future__ import unicode_literals
 
+import operator
+from collections import defaultdict
+
 from django.conf import settings
 from django.utils.encoding import force_text
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.db import models
+from django.db.models import Count, Q
 from django.utils import timezone
 
 from mptt.models import MPTTModel, TreeForeignKey
@@ -20,6 +24,18 @@ from trapper.apps.common.fields import SafeTextField
 
 COMMENT_MAX_LENGTH = getattr(settings, 'COMMENT_MAX_LENGTH', 3000)
 
+# attributes used to store prefetched comments on commented objects
+PREFETCHED_COMMENTS_ATTR = '_prefetched_comments'
+PREFETCHED_COMMENTS_COUNT_ATTR = '_prefetched_comments_count'
+
+
+def get_object_key(obj):
+    """Return a tuple `(content type pk, object pk)` that identifies
+    comments of given object. Content types are cached by django so
+    this doesn't hit the database more than once per model"""
+    content_type = ContentType.objects.get_for_model(obj)
+    return content_type.pk, force_text(obj._get_pk_val())
+
 
 class UserCommentManager(models.Manager):
     """Add custom methods to :class:`UserComment` model such as filtering
@@ -38,6 +54,65 @@ class UserCommentManager(models.Manager):
             )
         return queryset
 
+    def for_objects(self, objects):
+        """
+        QuerySet for all comments of given instances (possibly of different
+        models) evaluated with a single query.
+        """
+        lookups = defaultdict(set)
+        for obj in objects:
+            content_type_pk, object_pk = get_object_key(obj)
+            lookups[content_type_pk].add(object_pk)
+        if not lookups:
+            return self.none()
+        return self.get_queryset().filter(reduce(operator.or_, [
+            Q(content_type__pk=ct_pk, object_pk__in=pks)
+            for ct_pk, pks in lookups.items()
+        ]))
+
+    def prefetch(self, objects, counts_only=False):
+        """
+        Load comments of many objects at once and store them on these
+        objects, so templatetags don't have to query the database for
+        each object separately.
+
+        Comment trees are fetched in tree order (as required by
+        `recursetree`) together with their authors, and the commented
+        object is attached to each comment. With `counts_only`, only
+        numbers of comments are fetched using a single aggregate query.
+        """
+        objects = [k for k in objects if k is not None]
+        queryset = self.for_objects(objects)
+        if counts_only:
+            counts = dict(
+                ((k['content_type'], k['object_pk']), k['count'])
+                for k in queryset.values(
+                    'content_type', 'object_pk'
+                ).annotate(count=Count('pk')).order_by()
+            )
+            for obj in objects:
+                setattr(
+                    obj, PREFETCHED_COMMENTS_COUNT_ATTR,
+                    counts.get(get_object_key(obj), 0)
+                )
+            return
+
+        comments = defaultdict(list)
+        queryset = queryset.select_related(
+            'user__userprofile'
+        ).order_by('tree_id', 'lft')
+        for comment in queryset:
+            comments[(comment.content_type_id, comment.object_pk)].append(
+                comment
+            )
+        cache_attr = self.model.content_object.cache_attr
+        for obj in objects:
+            nodes = comments.get(get_object_key(obj), [])
+            for node in nodes:
+                setattr(node, cache_attr, obj)
+            setattr(obj, PREFETCHED_COMMENTS_ATTR, nodes)
+            setattr(obj, PREFETCHED_COMMENTS_COUNT_ATTR, len(nodes))
+
 
 class UserComment(MPTTModel):
     """
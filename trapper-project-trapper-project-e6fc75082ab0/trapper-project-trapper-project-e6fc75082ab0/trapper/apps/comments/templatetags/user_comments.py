@@ -3,7 +3,7 @@
 Comments application is pluggable into another applications by using
 templatetags.
 
-This module contains three simple templatetags that makes comments usuable
+This module contains simple templatetags that makes comments usuable
 
 * :func:`get_comment_form` that should be used for posting or replaying comments
 * :func:`get_comments` that should be used to get comments
@@ -15,7 +15,9 @@ from django.contrib.contenttypes.models import ContentType
 from django.conf import settings
 
 from trapper.apps.comments.forms import UserCommentForm
-from trapper.apps.comments.models import UserComment
+from trapper.apps.comments.models import (
+    UserComment, PREFETCHED_COMMENTS_ATTR, PREFETCHED_COMMENTS_COUNT_ATTR
+)
 
 register = template.Library()
 
@@ -41,12 +43,8 @@ class CommentTag(object):
 
     def get_content_type(self):
         """To get list of comments, it's necessary to get content type
-        of items we want to return"""
-        meta = getattr(self.item, '_meta')
-        return ContentType.objects.get(
-            model=meta.model_name,
-            app_label=meta.app_label
-        )
+        of items we want to return. Content types are cached by django"""
+        return ContentType.objects.get_for_model(self.item)
 
     def render_form(self):
         """Render comment form containing content type and item primary
@@ -60,11 +58,11 @@ class CommentTag(object):
         return {'form': form, 'show_header': self.show_header}
 
     def get_comments(self):
-        """Get queryset with comments that belong to given item"""
-        return UserComment.objects.filter(
-            content_type=self.content_type,
-            object_pk=self.item.pk
-        )
+        """Get list of comments that belong to given item. Comments
+        are loaded with their authors using a single query"""
+        if not hasattr(self.item, PREFETCHED_COMMENTS_ATTR):
+            UserComment.objects.prefetch([self.item])
+        return getattr(self.item, PREFETCHED_COMMENTS_ATTR)
 
     def render_comments(self):
         """Render list of structured comments"""
@@ -77,7 +75,9 @@ class CommentTag(object):
 
     def render_comments_count(self):
         """Return number of comments that belong to given item"""
-        return self.get_comments().count()
+        if not hasattr(self.item, PREFETCHED_COMMENTS_COUNT_ATTR):
+            UserComment.objects.prefetch([self.item], counts_only=True)
+        return getattr(self.item, PREFETCHED_COMMENTS_COUNT_ATTR)
 
 
 @register.inclusion_tag('user_comments/form.html', takes_context=True)
@@ -143,3 +143,4 @@ def get_comments_count(context, item=None):
     """
     tag = CommentTag(context=context, item=item)
     return tag.render_comments_count()
+
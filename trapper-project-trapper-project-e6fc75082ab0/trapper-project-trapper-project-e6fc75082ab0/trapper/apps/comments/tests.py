@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+
+from django.db import connection
+from django.template import Context, Template
+from django.test.utils import CaptureQueriesContext
+
+from trapper.apps.common.utils.test_tools import (
+    ExtendedTestCase, ResourceTestMixin
+)
+from trapper.apps.comments.models import UserComment
+from trapper.apps.storage.models import Resource
+
+
+class CommentTagsTestCase(ExtendedTestCase, ResourceTestMixin):
+    """Templatetags used to render comments of an object"""
+
+    def setUp(self):
+        super(CommentTagsTestCase, self).setUp()
+        self.summon_alice()
+        self.summon_ziutek()
+        self.resource = self.create_resource(owner=self.alice)
+
+    def add_comment(self, user, parent=None):
+        return UserComment.objects.create(
+            content_object=self.resource, user=user, parent=parent,
+            comment=u'comment'
+        )
+
+    def render_comments(self):
+        """Render comments of a resource and return a number of executed
+        queries"""
+        resource = Resource.objects.get(pk=self.resource.pk)
+        template = Template(
+            '{% load user_comments %}'
+            '{% get_comments item=resource %}'
+            '{% get_comments_count item=resource %}'
+        )
+        with CaptureQueriesContext(connection) as queries:
+            template.render(Context({'resource': resource}))
+        return len(queries)
+
+    def test_comments_queries(self):
+        """A number of queries doesn't depend on a number of comments and
+        their authors"""
+        comment = self.add_comment(user=self.alice)
+        queries = self.render_comments()
+
+        self.add_comment(user=self.ziutek, parent=comment)
+        self.add_comment(user=self.ziutek)
+        self.assertEqual(self.render_comments(), queries)
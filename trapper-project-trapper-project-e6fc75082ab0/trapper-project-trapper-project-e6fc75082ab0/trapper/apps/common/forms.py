@@ -177,7 +177,7 @@ class BaseBulkUpdateForm(BaseCrispyModelForm):
             pks_list = parse_pks(records_pks)
             records = self.filter_editable()
             records = records.filter(pk__in=pks_list)
-            if records:
+            if records.exists():
                 self.cleaned_data['records'] = records
 
     def clean(self):
@@ -3,15 +3,109 @@
 from django.core.management.base import BaseCommand
 from django.contrib.contenttypes.models import ContentType
 from django.conf import settings
+from django.db import connection, transaction
+from django.utils.encoding import force_str
 
-from itertools import chain
+from heapq import merge
 from optparse import make_option
 import os
 import shutil
 
+from trapper.apps.common.utils.models import server_side_cursor
+
+try:
+    from os import scandir
+except ImportError:
+    from scandir import scandir
+
 ORPHANED_APPS_MEDIABASE_DIRS = getattr(settings, 'ORPHANED_APPS_MEDIABASE_DIRS',{})
 
 
+def iter_needed_files(model, field):
+    """Stream all non-empty values of a file field sorted by their bytes
+    (the "C" collation) i.e. in the same order as
+    :meth:`OrphanedFilesFinder.walk` yields files."""
+    qn = connection.ops.quote_name
+    column = qn(field.column)
+    sql = (
+        'SELECT {column} FROM {table} WHERE {column} IS NOT NULL AND '
+        '{column} <> \'\' ORDER BY {column} COLLATE "C"'
+    ).format(column=column, table=qn(model._meta.db_table))
+    for (value,) in server_side_cursor(sql):
+        yield force_str(value)
+
+
+class OrphanedFilesFinder(object):
+    """Single pass over a media root: files are visited in the sorted
+    order of their paths (relative to MEDIA_ROOT) and merge-joined with
+    a sorted stream of files that are referenced in database. Empty
+    directories are detected in the same pass."""
+
+    def __init__(self, app_root, needed_files, skip=(), exclude=()):
+        self.app_root = force_str(app_root)
+        self.needed_files = needed_files
+        self.skip = [force_str(k) for k in skip]
+        self.exclude = [force_str(k) for k in exclude]
+        self.empty_dirs = []
+        self.total_files = 0
+
+    def should_skip(self, path):
+        for skip_dir in self.skip:
+            if path.startswith(skip_dir):
+                return True
+        return False
+
+    def walk(self, path, rel_path, state):
+        """Yield `(path, relative path, entry)` for all files below `path`.
+        Entries are sorted by name with a trailing separator for
+        directories, so paths are yielded in a lexicographic order.
+        `state['has_content']` is set when `path` is not empty; topmost
+        empty sub-directories are collected in `self.empty_dirs`."""
+        entries = []
+        for entry in scandir(path):
+            if entry.is_dir(follow_symlinks=False):
+                entries.append((entry.name + os.sep, entry))
+            else:
+                entries.append((entry.name, entry))
+        entries.sort()
+        empty_children = []
+        for key, entry in entries:
+            entry_rel_path = os.path.join(rel_path, entry.name)
+            if not key.endswith(os.sep):
+                state['has_content'] = True
+                if entry.name not in self.exclude:
+                    yield entry.path, entry_rel_path, entry
+                continue
+            if self.should_skip(entry.path):
+                state['has_content'] = True
+                continue
+            child_state = {'has_content': False}
+            for item in self.walk(entry.path, entry_rel_path, child_state):
+                yield item
+            if child_state['has_content']:
+                state['has_content'] = True
+            else:
+                empty_children.append(entry.path)
+        if state['has_content']:
+            # only the topmost empty directories are removed (recursively)
+            self.empty_dirs.extend(empty_children)
+
+    def __iter__(self):
+        """Yield `(path, entry)` of orphaned files."""
+        needed = iter(self.needed_files)
+        current = next(needed, None)
+        rel_root = os.path.relpath(self.app_root, force_str(settings.MEDIA_ROOT))
+        if rel_root == os.curdir:
+            rel_root = ''
+        state = {'has_content': True}
+        for path, rel_path, entry in self.walk(self.app_root, rel_root, state):
+            self.total_files += 1
+            while current is not None and current < rel_path:
+                current = next(needed, None)
+            if current != rel_path:
+                yield path, entry
+
+
 class Command(BaseCommand):
     help = "Delete all orphaned files"
     base_options = (
@@ -20,106 +114,74 @@ class Command(BaseCommand):
     )
     option_list = BaseCommand.option_list + base_options
 
+    def get_needed_files(self, app):
+        """Sorted stream of all files referenced by models of a given app"""
+        streams = []
+        for model in ContentType.objects.filter(app_label=app):
+            mc = model.model_class()
+            if mc is None:
+                continue
+            for field in mc._meta.fields:
+                if field.get_internal_type() in ('FileField', 'ImageField'):
+                    streams.append(iter_needed_files(mc, field))
+        return merge(*streams)
+
     def handle(self, **options):
         self.only_info = options.get('info')
 
         for app in ORPHANED_APPS_MEDIABASE_DIRS.keys():
             if (ORPHANED_APPS_MEDIABASE_DIRS[app].has_key('root')):
-                needed_files = []
-                all_files = []
-                possible_empty_dirs = []
-                empty_dirs = []
                 total_freed_bytes = 0
-                total_freed = '0'
-                delete_files = []
+                total_deleted = 0
+                empty_dirs = []
                 skip = ORPHANED_APPS_MEDIABASE_DIRS[app].get('skip', ())
                 exclude = ORPHANED_APPS_MEDIABASE_DIRS[app].get('exclude', ())
 
-                for model in ContentType.objects.filter(app_label=app):
-                    mc = model.model_class()
-                    if mc is None:
-                        continue
-                    fields = []
-                    for field in mc._meta.fields:
-                        if (field.get_internal_type() == 'FileField' or field.get_internal_type() == 'ImageField'):
-                            fields.append(field.name)
-
-                    # we have found a model with FileFields
-                    if len(fields) > 0:
-                        files = mc.objects.all().values_list(*fields)
-                        needed_files.extend([os.path.join(settings.MEDIA_ROOT, file) for file in filter(None, chain.from_iterable(files))])
-
-                # traverse root folder and store all files and empty directories
-                def should_skip(dir):
-                    for skip_dir in skip:
-                        if dir.startswith(skip_dir):
-                            return True
-                    return False
+                if self.only_info:
+                    print "\r\n=== %s ===" % app
+                    print "\r\nFollowing files will be deleted:\r\n"
 
                 # process each root of the app
                 app_roots = ORPHANED_APPS_MEDIABASE_DIRS[app]['root']
                 if isinstance(app_roots, basestring): # backwards compatibility
                     app_roots = [app_roots]
                 for app_root in app_roots:
-                    for root, dirs, files in os.walk(app_root):
-                        if should_skip(root):
-                            continue
-                        if len(files) > 0:
-                            for basename in files:
-                                if basename not in exclude:
-                                    all_files.append(os.path.join(root, basename))
-                        elif not os.path.samefile(root, app_root):
-                            possible_empty_dirs.append(root)
-
-                # ignore empty dirs with subdirs + files
-                for ed in possible_empty_dirs:
-                    dont_delete = False
-                    for files in all_files:
-                        try:
-                            if files.index(ed) == 0:
-                                dont_delete = True
-                        except ValueError:
-                            pass
-                    for skip_dir in skip:
-                        try:
-                            if (skip_dir.index(ed) == 0):
-                                dont_delete = True
-                        except ValueError:
-                            pass
-                    if not dont_delete:
-                        empty_dirs.append(ed)
-
-                # select deleted files (delete_files = all_files - needed_files)
-                aa = set(all_files)
-                delete_files = list(aa.difference(needed_files))
-                delete_files.sort()
-                empty_dirs.sort()
-                empty_dirs = set(empty_dirs) #remove possible duplicates
-
-                # to be freed
-                for df in delete_files:
-                    total_freed_bytes += os.path.getsize(df)
+                    if not os.path.isdir(app_root):
+                        continue
+                    # server-side cursors require a transaction
+                    with transaction.atomic():
+                        finder = OrphanedFilesFinder(
+                            app_root=app_root,
+                            needed_files=self.get_needed_files(app),
+                            skip=skip,
+                            exclude=exclude
+                        )
+                        # orphaned files are deleted as soon as they are found
+                        for path, entry in finder:
+                            total_freed_bytes += entry.stat(
+                                follow_symlinks=False
+                            ).st_size
+                            total_deleted += 1
+                            if self.only_info:
+                                print " ", path
+                            else:
+                                os.remove(path)
+                    empty_dirs.extend(finder.empty_dirs)
+
                 total_freed = "%0.1f MB" % (total_freed_bytes/(1024*1024.0))
 
                 # only show
                 if (self.only_info):
-                    print "\r\n=== %s ===" % app
+                    if total_deleted > 0:
+                        print "\r\nTotally %s files will be deleted, and "\
+                            "totally %s will be freed.\r\n" % (total_deleted, total_freed)
+                    else:
+                        print "No files to delete!"
                     if len(empty_dirs) > 0:
                         print "\r\nFollowing empty dirs will be removed:\r\n"
                         for file in empty_dirs:
                             print " ", file
-
-                    if len(delete_files) > 0:
-                        print "\r\nFollowing files will be deleted:\r\n"
-                        for file in delete_files:
-                            print " ", file
-                        print "\r\nTotally %s files will be deleted, and "\
-                            "totally %s will be freed.\r\n" % (len(delete_files), total_freed)
-                    else:
-                        print "No files to delete!"
                 # DELETE NOW!
                 else:
-                    for file in delete_files:
-                        os.remove(file)
                     for dirs in empty_dirs:
                         shutil.rmtree(dirs, ignore_errors=True)
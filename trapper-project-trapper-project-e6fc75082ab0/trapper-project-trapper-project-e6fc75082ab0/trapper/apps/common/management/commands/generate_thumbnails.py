@@ -1,11 +1,56 @@
+import time
 import logging
+import datetime
+import subprocess
+import multiprocessing
 from optparse import make_option
-from django.core.management.base import BaseCommand
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, models
+from django.utils import dateparse
+from trapper.apps.common.task_args import LazyObjects, dump_task_args
+from trapper.apps.common.tools import datetime_aware
 from trapper.apps.storage.models import Resource
+from trapper.apps.storage.tasks import celery_update_thumbnails
+from trapper.apps.storage.taxonomy import ResourceType
+from trapper.apps.storage.thumbnailer import (
+    Thumbnailer, ThumbnailerException
+)
+from trapper.apps.variables.models import Variable
 
 logging.basicConfig(level=logging.INFO)
 LOGGER = logging.getLogger('generate_thumbnails')
 
+CHECKPOINT_NAMESPACE = 'generate_thumbnails'
+
+
+def process_chunk(pks):
+    """Generate thumbnails for a chunk of resources. It is a module level
+    function so it can be used by the process pool.
+
+    :return: tuple (last pk of a chunk, number of resources, number of
+        successfully processed resources)
+    """
+    processed = 0
+    for resource in Resource.objects.filter(pk__in=pks):
+        try:
+            Thumbnailer(resource=resource).create()
+        except (
+            ThumbnailerException, IOError, OSError,
+            subprocess.CalledProcessError
+        ) as error:
+            LOGGER.error(u"RESOURCE {pk}: {error}".format(
+                pk=resource.pk, error=error
+            ))
+        else:
+            processed += 1
+    return pks[-1], len(pks), processed
+
+
+def close_connections():
+    """Each worker process has to open its own database connection"""
+    connections.close_all()
+
 
 class Command(BaseCommand):
     """Base command class to handle all this stuff"""
@@ -18,32 +63,182 @@ class Command(BaseCommand):
             help='(Re)generate thumbnails for all resources. By default only '\
             'resources with missing thumbnails are selected.'
         ),
+        make_option(
+            '--since',
+            action='store',
+            default=None,
+            help='Select only resources uploaded since a given date '\
+            '(YYYY-MM-DD or YYYY-MM-DD HH:MM:SS).'
+        ),
+        make_option(
+            '--collection',
+            action='append',
+            type='int',
+            dest='collections',
+            default=None,
+            help='Select only resources from a given collection (pk). '\
+            'Can be used multiple times.'
+        ),
+        make_option(
+            '--chunk-size',
+            action='store',
+            type='int',
+            dest='chunk_size',
+            default=200,
+            help='Number of resources processed as a single job (default: 200).'
+        ),
+        make_option(
+            '--workers',
+            action='store',
+            type='int',
+            default=1,
+            help='Number of local worker processes (default: 1).'
+        ),
+        make_option(
+            '--celery',
+            action='store_true',
+            default=None,
+            help='Send chunks of resources to celery workers instead of '\
+            'processing them locally.'
+        ),
+        make_option(
+            '--restart',
+            action='store_true',
+            default=None,
+            help='Ignore a checkpoint left by an interrupted run.'
+        ),
     )
 
-    def __init__(self):
-        super(Command, self).__init__()
-        self.resources = Resource.objects.all()
+    def get_since(self, value):
+        if not value:
+            return None
+        since = dateparse.parse_datetime(value)
+        if since is None:
+            date = dateparse.parse_date(value)
+            if date is None:
+                raise CommandError(u"Invalid date: {value}".format(value=value))
+            since = datetime.datetime.combine(date, datetime.time())
+        return datetime_aware(data=since)
 
+    def get_queryset(self, options):
+        """Select resources in SQL, ordered by pk so they can be processed
+        in chunks using keyset pagination"""
+        queryset = Resource.objects.filter(
+            resource_type__in=ResourceType.THUMBNAIL_TYPES
+        )
+        if not options['all']:
+            queryset = queryset.filter(
+                models.Q(file_thumbnail__isnull=True) |
+                models.Q(file_thumbnail='')
+            )
+        since = self.get_since(options['since'])
+        if since:
+            queryset = queryset.filter(date_uploaded__gte=since)
+        if options['collections']:
+            queryset = queryset.filter(
+                pk__in=Resource.objects.filter(
+                    collection__pk__in=options['collections']
+                ).values('pk')
+            )
+        return queryset.order_by('pk')
+
+    def get_checkpoint_name(self, options):
+        """Checkpoints are stored separately for each selection scope"""
+        return u"all={all};since={since};collections={collections}".format(
+            all=bool(options['all']),
+            since=options['since'] or '',
+            collections=','.join(
+                str(k) for k in sorted(options['collections'] or [])
+            )
+        )
+
+    def iter_chunks(self, queryset, chunk_size, last_pk):
+        """Yield lists of primary keys; each chunk is a separate query
+        so the whole selection is never loaded into memory"""
+        while True:
+            pks = list(
+                queryset.filter(pk__gt=last_pk).values_list(
+                    'pk', flat=True
+                )[:chunk_size]
+            )
+            if not pks:
+                return
+            yield pks
+            last_pk = pks[-1]
 
     def handle(self, *args, **options):
-        all_res = options['all']
-        resources = self.resources
+        checkpoint_name = self.get_checkpoint_name(options)
+        if options['restart']:
+            last_pk = 0
+        else:
+            last_pk = Variable.get(
+                namespace=CHECKPOINT_NAMESPACE, name=checkpoint_name, default=0
+            )
+            if last_pk:
+                LOGGER.info(u"Resuming after resource {pk}.".format(pk=last_pk))
 
-        if not all_res:
+        if not options['all']:
             LOGGER.info(u"Generating missing thumbnails only.")
-            resources = [
-                r for r in resources if not bool(r.file_thumbnail)
-            ]
         else:
             LOGGER.info(u"(Re)generating thumbnails for all resources.")
-        N = len(resources)
+        queryset = self.get_queryset(options)
+        N = queryset.filter(pk__gt=last_pk).count()
         LOGGER.info(u"Found {number} resources.".format(
             number=N
         ))
-        i = 1
-        for r in resources:
-            LOGGER.info(u"RESOURCE {i}/{N}: {resource}".format(
-                resource=r.name, i=i, N=N
-            ))
-            r.generate_thumbnails()
-            i += 1
+        chunks = self.iter_chunks(queryset, options['chunk_size'], last_pk)
+
+        start = time.time()
+        if options['celery']:
+            # checkpoints are stored when chunks are sent to workers;
+            # chunks are sent with a low priority so thumbnails of newly
+            # uploaded resources are not delayed
+            for pks in chunks:
+                celery_update_thumbnails.apply_async(
+                    kwargs=dump_task_args({
+                        'resources': LazyObjects(Resource, pks)
+                    }),
+                    priority=settings.CELERY_BULK_TASK_PRIORITY
+                )
+                Variable.set(CHECKPOINT_NAMESPACE, checkpoint_name, pks[-1])
+                LOGGER.info(u"Sent {n} resources (up to {pk}) to celery.".format(
+                    n=len(pks), pk=pks[-1]
+                ))
+        else:
+            pool = None
+            if options['workers'] > 1:
+                close_connections()
+                pool = multiprocessing.Pool(
+                    options['workers'], initializer=close_connections
+                )
+                results = pool.imap(process_chunk, chunks)
+            else:
+                results = (process_chunk(pks) for pks in chunks)
+            i = 0
+            try:
+                # results are ordered, so the checkpoint always points to
+                # the last resource of a contiguous range of finished chunks
+                for chunk_last_pk, number, processed in results:
+                    i += number
+                    Variable.set(
+                        CHECKPOINT_NAMESPACE, checkpoint_name, chunk_last_pk
+                    )
+                    elapsed = time.time() - start
+                    LOGGER.info(
+                        u"RESOURCES {i}/{N}: {processed} processed, "
+                        u"{rate:.1f} resources/s".format(
+                            i=i, N=N, processed=processed,
+                            rate=i / elapsed if elapsed else 0
+                        )
+                    )
+            finally:
+                if pool is not None:
+                    pool.close()
+                    pool.join()
+
+        Variable.objects.filter(
+            namespace=CHECKPOINT_NAMESPACE, name=checkpoint_name
+        ).delete()
+        LOGGER.info(u"Finished in {elapsed:.1f}s.".format(
+            elapsed=time.time() - start
+        ))
@@ -0,0 +1,38 @@
+from optparse import make_option
+from django.core.management.base import BaseCommand
+from trapper.apps.geomap.models import (
+    Location, Deployment, refresh_accessible_sets
+)
+
+
+class Command(BaseCommand):
+    """Rebuild materialized sets of accessible locations and deployments
+    (see :func:`trapper.apps.geomap.models.refresh_accessible_sets`) of all
+    objects, e.g. after they have been changed outside of the application.
+    Sets are refreshed in chunks, each in a separate transaction."""
+
+    help = 'Rebuild materialized sets of accessible locations and deployments.'
+
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--chunk-size',
+            action='store',
+            type='int',
+            default=500,
+            help='Number of objects refreshed in a single transaction.'
+        ),
+    )
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        for model, param in (
+            (Location, 'location_pks'), (Deployment, 'deployment_pks')
+        ):
+            pks = list(
+                model.objects.order_by('pk').values_list('pk', flat=True)
+            )
+            for i in range(0, len(pks), chunk_size):
+                refresh_accessible_sets(**{param: pks[i:i + chunk_size]})
+            self.stdout.write(u"{model}: {n} refreshed".format(
+                model=model._meta.verbose_name_plural, n=len(pks)
+            ))
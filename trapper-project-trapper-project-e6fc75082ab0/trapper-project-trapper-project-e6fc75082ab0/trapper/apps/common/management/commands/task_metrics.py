@@ -0,0 +1,122 @@
+import glob
+import json
+import os
+from collections import defaultdict
+from optparse import make_option
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+def percentile(values, q):
+    values = sorted(values)
+    if not values:
+        return 0
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+class Command(BaseCommand):
+    """Summarize celery task metrics exported by
+    :mod:`trapper.apps.accounts.task_metrics` to plan worker concurrency
+    and task time limits"""
+
+    help = 'Summarize metrics of executed celery tasks.'
+
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--file',
+            action='store',
+            default=os.path.join(settings.LOG_DIR, 'task_metrics'),
+            help='Path to a metrics log (rotated files are read too).'
+        ),
+        make_option(
+            '--task',
+            action='store',
+            default=None,
+            help='Summarize only tasks with names containing this value.'
+        ),
+    )
+
+    def read_metrics(self, path, task=None):
+        paths = glob.glob(path + '.*') + [path]
+        if not any(os.path.exists(k) for k in paths):
+            raise CommandError(u"No metrics found in {path}".format(path=path))
+        metrics = defaultdict(list)
+        for filename in paths:
+            with open(filename) as metrics_file:
+                for line in metrics_file:
+                    try:
+                        data = json.loads(line)
+                    except ValueError:
+                        continue
+                    if task and task not in data['task']:
+                        continue
+                    metrics[data['task']].append(data)
+        return metrics
+
+    def handle(self, *args, **options):
+        metrics = self.read_metrics(options['file'], task=options['task'])
+        soft_limit = getattr(settings, 'CELERYD_TASK_SOFT_TIME_LIMIT', None)
+        for name in sorted(metrics):
+            runs = metrics[name]
+            wall = [k['wall_time'] for k in runs]
+            rates = [k['rows_per_second'] for k in runs if k['rows']]
+            self.stdout.write(name)
+            self.stdout.write(
+                u"  runs: {runs}, failed: {failed}".format(
+                    runs=len(runs),
+                    failed=len([k for k in runs if k['state'] != 'SUCCESS'])
+                )
+            )
+            self.stdout.write(
+                u"  wall time [s]: mean {mean:.1f}, p95 {p95:.1f}, "
+                u"max {max:.1f}".format(
+                    mean=sum(wall) / len(wall), p95=percentile(wall, 0.95),
+                    max=max(wall)
+                )
+            )
+            if rates:
+                self.stdout.write(
+                    u"  rows/s: mean {mean:.1f}, min {min:.1f}".format(
+                        mean=sum(rates) / len(rates), min=min(rates)
+                    )
+                )
+            self.stdout.write(
+                u"  queries: mean {queries:.0f}, "
+                u"sql time [s]: mean {sql:.1f}".format(
+                    queries=sum(k['queries'] for k in runs) / float(len(runs)),
+                    sql=sum(k['sql_time'] for k in runs) / len(runs)
+                )
+            )
+            # older metrics contain only a peak rss of a worker process
+            deltas = [
+                k['rss_delta'] for k in runs if k.get('rss_delta') is not None
+            ]
+            if deltas:
+                self.stdout.write(
+                    u"  rss growth [MB]: mean {mean:.1f}, max {max:.1f}, "
+                    u"rss after task [MB]: max {rss:.0f}".format(
+                        mean=sum(deltas) / 1024.0 / len(deltas),
+                        max=max(deltas) / 1024.0,
+                        rss=max(
+                            k['rss'] for k in runs if k.get('rss') is not None
+                        ) / 1024.0
+                    )
+                )
+            phases = defaultdict(float)
+            for run in runs:
+                for phase, data in run['phases'].items():
+                    phases[phase] += data['time']
+            if phases:
+                self.stdout.write(u"  phases [s]: {phases}".format(
+                    phases=', '.join(
+                        u"{name} {time:.1f}".format(
+                            name=k, time=phases[k] / len(runs)
+                        ) for k in sorted(phases, key=phases.get, reverse=True)
+                    )
+                ))
+            if soft_limit and max(wall) > soft_limit:
+                self.stdout.write(
+                    u"  WARNING: exceeds soft time limit ({limit}s)".format(
+                        limit=soft_limit
+                    )
+                )
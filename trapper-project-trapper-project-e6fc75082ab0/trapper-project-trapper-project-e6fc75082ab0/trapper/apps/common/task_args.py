@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+"""
+Compact arguments of celery tasks.
+
+Instead of pickling whole model instances, querysets and data frames
+into broker messages, arguments are replaced by light references with
+:func:`dump_task_args`:
+
+* model instances are replaced by `(app label, model name, pk)`,
+* querysets and lists of model instances are replaced by a model and
+  a list of primary keys,
+* pandas data frames are stored in a shared staging area
+  (`settings.CELERY_STAGING_ROOT`) and replaced by a path of a file.
+
+Tasks decorated with :func:`rehydrate` re-hydrate references when
+they are executed, so workers always use current database state. Model
+instances are fetched again, lists of objects are loaded lazily in
+chunks of `settings.CELERY_TASK_ARGS_CHUNK_SIZE` objects (see
+:class:`LazyObjects`) and staged data frames are read. Staged files are
+removed once a task succeeds, so a failed task can be retried with the
+same arguments; files left by tasks that never succeeded are removed
+after `settings.CELERY_STAGING_MAX_AGE` seconds.
+
+Values that are not references are passed unchanged, so decorated tasks
+can still be called directly (e.g. when `settings.CELERY_ENABLED` is
+False).
+"""
+from __future__ import unicode_literals
+
+import errno
+import functools
+import os
+import time
+import uuid
+
+import pandas
+
+from django.apps import apps
+from django.conf import settings
+from django.db import models, transaction
+
+REF_KEY = '__task_ref__'
+
+
+class LazyObjects(object):
+    """Sequence of model instances with given primary keys that are
+    fetched in chunks while iterating, so only a single chunk of objects
+    is kept in memory at once. Objects that don't exist anymore are
+    skipped."""
+
+    def __init__(
+            self, model, pks, chunk_size=None,
+            select_related=(), prefetch_related=()
+    ):
+        self.model = model
+        self.pks = list(pks)
+        self.chunk_size = chunk_size or settings.CELERY_TASK_ARGS_CHUNK_SIZE
+        self._select_related = tuple(select_related)
+        self._prefetch_related = tuple(prefetch_related)
+
+    def _clone(self, **kwargs):
+        params = {
+            'chunk_size': self.chunk_size,
+            'select_related': self._select_related,
+            'prefetch_related': self._prefetch_related,
+        }
+        params.update(kwargs)
+        return LazyObjects(self.model, self.pks, **params)
+
+    def select_related(self, *fields):
+        return self._clone(select_related=self._select_related + fields)
+
+    def prefetch_related(self, *lookups):
+        return self._clone(
+            prefetch_related=self._prefetch_related + lookups
+        )
+
+    @property
+    def queryset(self):
+        """Queryset of all objects (e.g. to be used in subqueries)"""
+        queryset = self.model._default_manager.filter(pk__in=self.pks)
+        if self._select_related:
+            queryset = queryset.select_related(*self._select_related)
+        if self._prefetch_related:
+            queryset = queryset.prefetch_related(*self._prefetch_related)
+        return queryset
+
+    def __len__(self):
+        return len(self.pks)
+
+    def __iter__(self):
+        for i in range(0, len(self.pks), self.chunk_size):
+            chunk = self.pks[i:i + self.chunk_size]
+            objects = dict(
+                (k.pk, k) for k in self.queryset.filter(pk__in=chunk)
+            )
+            for pk in chunk:
+                if pk in objects:
+                    yield objects[pk]
+
+
+def _model_label(model):
+    return '{app}.{model}'.format(
+        app=model._meta.app_label, model=model._meta.model_name
+    )
+
+
+def clean_staging_area(max_age=None):
+    """Remove files older than `max_age` seconds (by default
+    `settings.CELERY_STAGING_MAX_AGE`) from the staging area, i.e. data
+    frames of tasks that failed or were never executed; return a number
+    of removed files"""
+    if max_age is None:
+        max_age = settings.CELERY_STAGING_MAX_AGE
+    root = settings.CELERY_STAGING_ROOT
+    if not os.path.isdir(root):
+        return 0
+    oldest = time.time() - max_age
+    removed = 0
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        try:
+            if os.path.getmtime(path) < oldest:
+                os.remove(path)
+                removed += 1
+        except OSError as e:
+            # removed by another process in the meantime
+            if e.errno != errno.ENOENT:
+                raise
+    return removed
+
+
+def stage_dataframe(df):
+    """Store a data frame in the staging area and return a path of it;
+    orphaned files are removed from the staging area first"""
+    if not os.path.exists(settings.CELERY_STAGING_ROOT):
+        os.makedirs(settings.CELERY_STAGING_ROOT)
+    clean_staging_area()
+    path = os.path.join(
+        settings.CELERY_STAGING_ROOT,
+        '{name}.pkl'.format(name=uuid.uuid4().hex)
+    )
+    df.to_pickle(path)
+    return path
+
+
+def read_staged_dataframe(path):
+    """Read a staged data frame; a file is kept in the staging area until
+    it is removed with :func:`remove_staged_files`"""
+    return pandas.read_pickle(path)
+
+
+def remove_staged_files(paths):
+    """Remove given files from the staging area"""
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+
+
+def dump_task_args(value):
+    """Recursively replace model instances, querysets, lists of model
+    instances and data frames in given value with references"""
+    if isinstance(value, models.Model):
+        return {
+            REF_KEY: 'object', 'model': _model_label(value.__class__),
+            'pk': value.pk
+        }
+    if isinstance(value, models.QuerySet):
+        return {
+            REF_KEY: 'objects', 'model': _model_label(value.model),
+            'pks': list(value.values_list('pk', flat=True))
+        }
+    if isinstance(value, LazyObjects):
+        return {
+            REF_KEY: 'objects', 'model': _model_label(value.model),
+            'pks': value.pks
+        }
+    if isinstance(value, pandas.DataFrame):
+        return {REF_KEY: 'dataframe', 'path': stage_dataframe(value)}
+    if isinstance(value, (list, tuple)):
+        if value and all(isinstance(k, models.Model) for k in value):
+            model = value[0].__class__
+            if all(k.__class__ is model for k in value):
+                return {
+                    REF_KEY: 'objects', 'model': _model_label(model),
+                    'pks': [k.pk for k in value]
+                }
+        return value.__class__(dump_task_args(k) for k in value)
+    if isinstance(value, dict):
+        return dict((k, dump_task_args(v)) for k, v in value.items())
+    return value
+
+
+def load_task_args(value, staged=None):
+    """Recursively replace references created by :func:`dump_task_args`
+    with objects they refer to. Paths of read staged data frames are
+    appended to `staged` list (if given)"""
+    if isinstance(value, dict):
+        ref = value.get(REF_KEY)
+        if ref == 'object':
+            model = apps.get_model(value['model'])
+            return model._default_manager.get(pk=value['pk'])
+        if ref == 'objects':
+            return LazyObjects(apps.get_model(value['model']), value['pks'])
+        if ref == 'dataframe':
+            df = read_staged_dataframe(value['path'])
+            if staged is not None:
+                staged.append(value['path'])
+            return df
+        return dict(
+            (k, load_task_args(v, staged=staged)) for k, v in value.items()
+        )
+    if isinstance(value, (list, tuple)):
+        return value.__class__(load_task_args(k, staged=staged) for k in value)
+    return value
+
+
+def rehydrate(func):
+    """Decorator of task functions that loads all arguments with
+    :func:`load_task_args`. Staged data frames are removed only when
+    a task succeeds; when it raises an exception they are kept, so a task
+    can be retried"""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        staged = []
+        result = func(
+            *[load_task_args(k, staged=staged) for k in args],
+            **dict(
+                (k, load_task_args(v, staged=staged))
+                for k, v in kwargs.items()
+            )
+        )
+        remove_staged_files(staged)
+        return result
+    return wrapper
+
+
+def delay_task(task, **kwargs):
+    """Run a task asynchronously with arguments replaced by references
+    (see :func:`dump_task_args`).
+
+    Referenced objects may be created in a current transaction, so a task
+    is sent when it is committed (immediately outside of atomic blocks).
+    An id of a task is known before that, so a returned result can be
+    used e.g. to create :class:`accounts.models.UserTask` right away."""
+    task_kwargs = dump_task_args(kwargs)
+    task_id = str(uuid.uuid4())
+    transaction.on_commit(
+        lambda: task.apply_async(kwargs=task_kwargs, task_id=task_id)
+    )
+    return task.AsyncResult(task_id)
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+"""
+Celery tasks shared by views of various applications
+"""
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+from celery import shared_task
+
+from django.apps import apps
+from django.db.models.deletion import ProtectedError
+
+from trapper.apps.accounts.task_metrics import task_phase
+from trapper.apps.common.utils.models import delete_in_chunks
+
+
+@shared_task
+def celery_bulk_delete(app_label, model_name, pks):
+    """
+    Celery task that deletes a large number of objects in chunks
+    (see :func:`trapper.apps.common.utils.models.delete_in_chunks`)
+
+    :param app_label: label of an application of a model
+    :param model_name: name of a model
+    :param pks: list of primary keys of objects to delete
+    """
+    model = apps.get_model(app_label, model_name)
+    task_phase('delete')
+    try:
+        deleted = delete_in_chunks(model, pks)
+    except ProtectedError:
+        return (
+            'Some of selected items can not be deleted because they are '
+            'referenced through a protected foreign key. Items processed '
+            'before have been deleted.'
+        )
+    return '{n} record(s) have been successfully deleted.'.format(n=deleted)
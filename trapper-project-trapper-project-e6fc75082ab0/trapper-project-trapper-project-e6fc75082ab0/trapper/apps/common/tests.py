@@ -1,7 +1,29 @@
 # -*- coding: utf-8 -*-
 
+import os
+import shutil
+import tempfile
+from importlib import import_module
+
+import pandas
+
+from celery.app.defaults import DEFAULTS as CELERY_DEFAULTS
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.urlresolvers import reverse
+from django.test.utils import override_settings
+
 from trapper.apps.common.utils.test_tools import ExtendedTestCase
 from trapper.apps.common.tools import parse_pks, clean_html
+from trapper.apps.common.task_args import (
+    LazyObjects, dump_task_args, load_task_args, rehydrate,
+    clean_staging_area, delay_task
+)
+from trapper.apps.common.management.commands.delete_orphaned import (
+    OrphanedFilesFinder
+)
+from trapper.celery_app import app, get_worker_pool
+from trapper.middleware import RequestStats
 
 
 class ParsePksTestCase(ExtendedTestCase):
@@ -69,3 +91,247 @@ class CleanHtmlTestCase(ExtendedTestCase):
             clean_html('<p><strong style="color: red;">text</strong></p>'),
             '<strong>text</strong>'
         )
+
+
+class OrphanedFilesFinderTestCase(ExtendedTestCase):
+    """Tests related to the single pass merge-join of files stored in
+    the media root with files referenced in database"""
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.app_root = os.path.join(self.media_root, 'storage')
+        for path in [
+            'storage/a/1.jpg', 'storage/a/2.jpg', 'storage/a-b.jpg',
+            'storage/x/y/z.jpg', 'storage/k/.gitignore',
+            'storage/skip/file.jpg'
+        ]:
+            path = os.path.join(self.media_root, path)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            open(path, 'w').close()
+        os.makedirs(os.path.join(self.app_root, 'e1', 'e2'))
+        os.makedirs(os.path.join(self.app_root, 'e3'))
+
+    def tearDown(self):
+        shutil.rmtree(self.media_root, ignore_errors=True)
+
+    def test_orphaned_files(self):
+        """Files that are not referenced are orphaned; topmost empty
+        directories are detected in the same pass"""
+        needed_files = sorted([
+            'storage/a/1.jpg', 'storage/x/y/z.jpg', 'storage/zzz.jpg'
+        ])
+        with override_settings(MEDIA_ROOT=self.media_root):
+            finder = OrphanedFilesFinder(
+                app_root=self.app_root,
+                needed_files=needed_files,
+                skip=[os.path.join(self.app_root, 'skip')],
+                exclude=['.gitignore']
+            )
+            orphaned = [path for path, entry in finder]
+        self.assertEqual(orphaned, [
+            os.path.join(self.app_root, 'a-b.jpg'),
+            os.path.join(self.app_root, 'a', '2.jpg'),
+        ])
+        self.assertItemsEqual(finder.empty_dirs, [
+            os.path.join(self.app_root, 'e1'),
+            os.path.join(self.app_root, 'e3'),
+        ])
+
+
+@override_settings(
+    INSTRUMENTATION_ENABLED=True,
+    INSTRUMENTATION_SAMPLE_RATE=1,
+    INSTRUMENTATION_SERVER_TIMING=True,
+    CACHES={'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'
+    }}
+)
+class InstrumentationTestCase(ExtendedTestCase):
+    """Test case for middleware that collects stats of sampled requests"""
+
+    def setUp(self):
+        super(InstrumentationTestCase, self).setUp()
+        self.summon_alice()
+
+    def test_server_timing(self):
+        """Sampled responses contain `Server-Timing` header with number
+        of executed queries"""
+        self.login_alice()
+        response = self.client.get(reverse('accounts:dashboard'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Server-Timing', response)
+        self.assertIn('queries', response['Server-Timing'])
+
+    @override_settings(INSTRUMENTATION_SAMPLE_RATE=0)
+    def test_not_sampled(self):
+        """Responses that are not sampled are not changed"""
+        self.login_alice()
+        response = self.client.get(reverse('accounts:dashboard'))
+        self.assertNotIn('Server-Timing', response)
+
+    def test_normalize(self):
+        """Queries that differ only by parameters are grouped together"""
+        stats = RequestStats()
+        stats.finish()
+        self.assertEqual(
+            stats.normalize("SELECT * FROM a WHERE id = 1 AND name = 'x'"),
+            stats.normalize("SELECT * FROM a WHERE id = 22 AND name = 'y'"),
+        )
+        self.assertEqual(
+            stats.normalize("SELECT * FROM a WHERE id IN (1, 2, 3)"),
+            "SELECT * FROM a WHERE id IN (...)",
+        )
+
+
+class TaskArgsTestCase(ExtendedTestCase):
+    """Tests related to compact arguments of celery tasks"""
+
+    def setUp(self):
+        super(TaskArgsTestCase, self).setUp()
+        self.summon_alice()
+        self.summon_ziutek()
+        self.staging_root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.staging_root, ignore_errors=True)
+        super(TaskArgsTestCase, self).tearDown()
+
+    def test_round_trip(self):
+        """Model instances, querysets and data frames are replaced by
+        references and loaded again"""
+        User = get_user_model()
+        df = pandas.DataFrame({'a': [1, 2]})
+        users = User.objects.filter(
+            pk__in=[self.alice.pk, self.ziutek.pk]
+        ).order_by('pk')
+        with override_settings(
+            CELERY_STAGING_ROOT=self.staging_root,
+            CELERY_TASK_ARGS_CHUNK_SIZE=1
+        ):
+            dumped = dump_task_args({
+                'user': self.alice,
+                'data': {'users': users, 'df': df, 'keys': ['x']},
+            })
+            self.assertEqual(dumped['data']['keys'], ['x'])
+            self.assertEqual(len(os.listdir(self.staging_root)), 1)
+            self.assertEqual(dumped['user']['pk'], self.alice.pk)
+
+            loaded = load_task_args(dumped)
+            self.assertEqual(loaded['user'], self.alice)
+            self.assertIsInstance(loaded['data']['users'], LazyObjects)
+            self.assertEqual(list(loaded['data']['users']), list(users))
+            self.assertTrue(loaded['data']['df'].equals(df))
+            # staged data frames are kept until a task succeeds
+            self.assertEqual(len(os.listdir(self.staging_root)), 1)
+
+    def test_rehydrate(self):
+        """Staged data frames are removed after a task succeeds and kept
+        when it fails, so it can be retried"""
+        df = pandas.DataFrame({'a': [1, 2]})
+
+        @rehydrate
+        def task(df, fail=False):
+            if fail:
+                raise ValueError
+            return len(df)
+
+        with override_settings(CELERY_STAGING_ROOT=self.staging_root):
+            dumped = dump_task_args({'df': df})
+            with self.assertRaises(ValueError):
+                task(fail=True, **dumped)
+            self.assertEqual(len(os.listdir(self.staging_root)), 1)
+            self.assertEqual(task(**dumped), 2)
+            self.assertEqual(os.listdir(self.staging_root), [])
+
+    def test_clean_staging_area(self):
+        """Only staged files older than a maximum age are removed"""
+        df = pandas.DataFrame({'a': [1, 2]})
+        with override_settings(
+            CELERY_STAGING_ROOT=self.staging_root,
+            CELERY_STAGING_MAX_AGE=60
+        ):
+            old = dump_task_args(df)['path']
+            new = dump_task_args(df)['path']
+            os.utime(old, (0, 0))
+            self.assertEqual(clean_staging_area(), 1)
+            self.assertEqual(os.listdir(self.staging_root), [
+                os.path.basename(new)
+            ])
+
+    def test_delay_task_on_commit(self):
+        """Tasks are not sent before a transaction that may create their
+        objects is committed, but their ids are known right away"""
+        sent = []
+
+        class Task(object):
+            AsyncResult = app.AsyncResult
+
+            def apply_async(self, **options):
+                sent.append(options)
+
+        # test cases are wrapped in a transaction that is never committed
+        result = delay_task(Task(), user=self.alice)
+        self.assertTrue(result.task_id)
+        self.assertEqual(sent, [])
+
+
+class CeleryRoutingTestCase(ExtendedTestCase):
+    """Tests related to routing of celery tasks to queues per workload
+    class"""
+
+    def test_routes(self):
+        """Routed tasks exist and are sent to their queues; other tasks
+        are sent to the default queue"""
+        router = app.amqp.Router()
+        for name, options in settings.CELERY_ROUTES.items():
+            import_module(name.rsplit('.', 1)[0])
+            self.assertIn(name, app.tasks)
+            self.assertEqual(
+                router.route({}, name)['queue'].name, options['queue']
+            )
+        self.assertEqual(
+            router.route({}, 'trapper.unknown')['queue'].name,
+            settings.CELERY_DEFAULT_QUEUE
+        )
+
+    def test_worker_pools(self):
+        """Each queue has its own worker pool"""
+        for queue in app.amqp.queues:
+            self.assertEqual(
+                get_worker_pool(queue), settings.CELERY_WORKER_POOLS[queue]
+            )
+        self.assertIsNone(get_worker_pool('media,imports'))
+        self.assertIsNone(get_worker_pool(None))
+
+    def test_worker_pools_settings(self):
+        """Worker pools use only settings known to celery, so none of
+        them is silently ignored when a pool is applied"""
+        self.assertIn('CELERYD_TASK_SOFT_TIME_LIMIT', CELERY_DEFAULTS)
+        self.assertEqual(
+            app.conf.CELERYD_TASK_SOFT_TIME_LIMIT,
+            settings.CELERYD_TASK_SOFT_TIME_LIMIT
+        )
+        for queue in app.amqp.queues:
+            pool = get_worker_pool(queue)
+            self.assertIn('CELERYD_TASK_SOFT_TIME_LIMIT', pool)
+            for name in pool:
+                self.assertIn(name, CELERY_DEFAULTS)
+
+    def test_memory_broker(self):
+        """Tasks are published to their queues with a priority"""
+        from trapper.apps.messaging.tasks import celery_deliver_emails
+        with app.connection('memory://') as connection:
+            celery_deliver_emails.apply_async(
+                kwargs={'emails': []}, connection=connection
+            )
+            channel = connection.default_channel
+            self.assertIsNone(app.amqp.queues['media'](channel).get())
+            message = app.amqp.queues['notifications'](channel).get(
+                no_ack=True
+            )
+        self.assertEqual(message.payload['task'], celery_deliver_emails.name)
+        self.assertEqual(
+            message.properties.get('priority'),
+            settings.CELERY_DEFAULT_TASK_PRIORITY
+        )
@@ -1,6 +1,12 @@
 # -*- coding: utf-8 -*-
 """Various functions that could be used in other applications models"""
 import os
+import uuid
+
+from django.conf import settings
+from django.db import connection
+
+from trapper.apps.accounts.task_metrics import task_progress
 
 
 def delete_old_file(instance, field):
@@ -23,3 +29,104 @@ def delete_old_file(instance, field):
             ):
                 os.remove(old_file.path)
 
+
+
+def server_side_cursor(sql, params=None, itersize=2000):
+    """Yield rows returned by a given query using a PostgreSQL server-side
+    (named) cursor, so huge result sets are streamed from database in
+    chunks of `itersize` rows instead of being loaded into memory.
+
+    Named cursors exist only within a transaction so this has to be
+    consumed inside of :func:`django.db.transaction.atomic` block."""
+    connection.ensure_connection()
+    cursor = connection.connection.cursor(
+        name='trapper_{uid}'.format(uid=uuid.uuid4().hex)
+    )
+    cursor.itersize = itersize
+    try:
+        cursor.execute(sql, params)
+        for row in cursor:
+            yield row
+    finally:
+        cursor.close()
+
+
+def bulk_add_related(queryset, through, source, target, values, extra=None):
+    """Link every object selected by a queryset with every object from
+    `values` (instances or primary keys) using a single
+    `INSERT ... SELECT` query. Rows of a `through` model are created
+    for `source` and `target` fields (and constant values of `extra`
+    fields, e.g. a content type of generic relations); already existing
+    rows are skipped."""
+    value_pks = list(set(getattr(k, 'pk', k) for k in values))
+    if not value_pks:
+        return
+    qn = connection.ops.quote_name
+    sql, params = queryset.order_by().values('pk').query.sql_with_params()
+    extra = [
+        (qn(through._meta.get_field(k).column), v)
+        for k, v in (extra or {}).items()
+    ]
+    source = qn(through._meta.get_field(source).column)
+    target = qn(through._meta.get_field(target).column)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'INSERT INTO {table} ({source}, {target}{columns}) '
+            'SELECT DISTINCT R.{pk}, V.value{values} '
+            'FROM ({sql}) R CROSS JOIN UNNEST(%s) V(value) '
+            'WHERE NOT EXISTS (SELECT 1 FROM {table} T '
+            'WHERE T.{source} = R.{pk} AND T.{target} = V.value'
+            '{conditions})'.format(
+                table=qn(through._meta.db_table),
+                source=source,
+                target=target,
+                columns=''.join(', ' + k for k, v in extra),
+                values=', %s' * len(extra),
+                conditions=''.join(
+                    ' AND T.{column} = %s'.format(column=k) for k, v in extra
+                ),
+                pk=qn(queryset.model._meta.pk.column),
+                sql=sql
+            ),
+            [v for k, v in extra] + list(params) + [value_pks] +
+            [v for k, v in extra]
+        )
+
+
+def bulk_set_m2m(queryset, field_name, values):
+    """Set objects related through a many-to-many field `field_name`
+    of every object selected by a queryset to given `values` with two
+    queries; only rows of a through model that differ are deleted or
+    inserted. `m2m_changed` signals are not sent."""
+    field = queryset.model._meta.get_field(field_name)
+    through = getattr(queryset.model, field_name).through
+    source = field.m2m_field_name()
+    target = field.m2m_reverse_field_name()
+    through.objects.filter(**{
+        source + '__in': queryset.order_by().values('pk')
+    }).exclude(**{
+        target + '__in': [getattr(k, 'pk', k) for k in values]
+    }).delete()
+    bulk_add_related(queryset, through, source, target, values)
+
+
+def delete_in_chunks(model, pks, chunk_size=None):
+    """Delete objects of a given model with given primary keys in chunks
+    of `settings.BULK_DELETE_CHUNK_SIZE` objects, so objects collected
+    by the ORM cascade are never loaded into memory at once. Progress
+    is reported to a current celery task. Return a number of deleted
+    objects."""
+    chunk_size = chunk_size or settings.BULK_DELETE_CHUNK_SIZE
+    pks = list(pks)
+    deleted = 0
+    from trapper.apps.geomap.models import defer_accessible_sets
+    for i in range(0, len(pks), chunk_size):
+        # signals of deleted objects refresh materialized sets of
+        # accessible locations and deployments once per chunk
+        with defer_accessible_sets():
+            _, counts = model.objects.filter(
+                pk__in=pks[i:i + chunk_size]
+            ).delete()
+        deleted += counts.get(model._meta.label, 0)
+        task_progress(min(i + chunk_size, len(pks)), total=len(pks))
+    return deleted
@@ -7,7 +7,8 @@ from django.contrib import messages
 from django.contrib.contenttypes.models import ContentType
 from django.core.urlresolvers import reverse
 from django.db.models.deletion import ProtectedError
-from django.db.models import Q
+from django.db import transaction
+from django.db.models import Q, QuerySet
 from django.http import HttpResponseForbidden
 from django.conf import settings
 from django.template import RequestContext
@@ -15,13 +16,17 @@ from django.template.loader import render_to_string
 
 from braces.views import JSONResponseMixin, UserPassesTestMixin
 from braces.views._access import AccessMixin
-from bulk_update.helper import bulk_update
 from taggit.models import Tag
 
 from django.contrib.auth.views import redirect_to_login
 from django.core.exceptions import PermissionDenied
 
 from trapper.apps.common.tools import parse_pks
+from trapper.apps.common.tasks import celery_bulk_delete
+from trapper.apps.common.utils.models import (
+    bulk_add_related, bulk_set_m2m, delete_in_chunks
+)
+from trapper.apps.accounts.models import UserTask
 
 
 class LoginRequiredMixin(AccessMixin):
@@ -136,15 +141,40 @@ class BaseDeleteView(LoginRequiredMixin, View, JSONResponseMixin):
         item.delete()
 
     def bulk_delete(self, queryset):
-        queryset.delete()
+        """Delete objects in chunks (see
+        :func:`trapper.apps.common.utils.models.delete_in_chunks`).
+        When more than `settings.BULK_DELETE_ASYNC_THRESHOLD` objects are
+        selected they are deleted by a celery task; True is returned
+        in that case."""
+        model = queryset.model
+        pks = list(queryset.values_list('pk', flat=True))
+        if (
+            settings.CELERY_ENABLED and
+            len(pks) > settings.BULK_DELETE_ASYNC_THRESHOLD
+        ):
+            task = celery_bulk_delete.delay(
+                app_label=model._meta.app_label,
+                model_name=model._meta.model_name,
+                pks=pks
+            )
+            user_task = UserTask(
+                user=self.request.user,
+                task_id=task.task_id
+            )
+            user_task.save()
+            return True
+        with transaction.atomic():
+            delete_in_chunks(model, pks)
 
     def filter_editable(self, queryset, user):
         if getattr(self.model, 'managers', None):
-            return queryset.filter(
+            editable = queryset.filter(
                 Q(owner=user) | Q(managers=user)
             )
         else:
-            return queryset.filter(owner=user)
+            editable = queryset.filter(owner=user)
+        # avoid duplicates caused by a join with managers
+        return queryset.filter(pk__in=editable.values('pk'))
 
     def get(self, request, *args, **kwargs):
         """Delete objects based on GET request
@@ -212,7 +242,10 @@ class BaseDeleteView(LoginRequiredMixin, View, JSONResponseMixin):
                 candidates, user
             )
 
-            total = len(candidates)
+            if isinstance(candidates, QuerySet):
+                total = candidates.count()
+            else:
+                total = len(candidates)
 
             if not total:
                 status = False
@@ -222,8 +255,13 @@ class BaseDeleteView(LoginRequiredMixin, View, JSONResponseMixin):
                 )
             else:
                 try:
-                    self.bulk_delete(candidates)
-                    msg = str(total) +' record(s) have been successfully deleted.'
+                    if self.bulk_delete(candidates):
+                        msg = (
+                            str(total) + ' record(s) are being deleted by '
+                            'a celery task.'
+                        )
+                    else:
+                        msg = str(total) +' record(s) have been successfully deleted.'
                 except ProtectedError:
                     status = False
                     msg = (
@@ -336,12 +374,68 @@ class BaseBulkUpdateView(
     def update_extra_m2m_fields(self, records, m2m_data):
         return
 
+    def update_tags(self, records, tags2add, tags2remove):
+        """Add and remove tags of all records with a constant number of
+        queries; both custom (`content_object`) and generic (`object_id`)
+        tagged items are supported"""
+        tags_through_model = getattr(records.model, self.tags_field).through
+        field_names = [
+            k.name for k in tags_through_model._meta.get_fields()
+        ]
+        if 'object_id' in field_names:
+            content_type = ContentType.objects.get_for_model(records.model)
+            source = 'object_id'
+            lookups = {'content_type': content_type}
+            extra = {'content_type': content_type.pk}
+        else:
+            source = 'content_object'
+            lookups = {}
+            extra = None
+        lookups[source + '__in'] = records.values('pk')
+
+        if tags2remove:
+            # remove specified tags (actually we only remove
+            # the objects of the "through" model i.e. `TaggedItem`)
+            tags_through_model.objects.filter(
+                tag__name__in=tags2remove, **lookups
+            ).delete()
+
+        if tags2add:
+            # get_or_create `Tag` objects for provided tag names
+            tags = [
+                Tag.objects.get_or_create(name=tag)[0] for tag in tags2add
+            ]
+            # create missing TaggedItems
+            bulk_add_related(
+                records, tags_through_model, source, 'tag', tags,
+                extra=extra
+            )
+
+    def records_selected(self, records):
+        """Called with selected records before they are updated (e.g. to
+        remember values that updates will change)"""
+        return
+
+    def records_updated(self, records):
+        """Called when all fields of records have been updated; bulk
+        updates do not send model signals so derived data should be
+        refreshed here"""
+        return
+
     def form_valid(self, form):
         """
+        Update all selected records without loading them into memory:
+
+        * uniform changes of basic fields are applied with a single
+          `UPDATE ... WHERE pk IN (subquery)` query,
+        * managers and tags are changed by computing differences of
+          through tables in SQL (see
+          :func:`trapper.apps.common.utils.models.bulk_set_m2m` and
+          :func:`trapper.apps.common.utils.models.bulk_add_related`).
         """
         form.cleaned_data.pop('records_pks', None)
         records = form.cleaned_data.pop('records', None)
-        if not records:
+        if records is None:
             msg = (
                 'Nothing to process (most probably you have no permission '
                 'to run this action on selected records)'
@@ -353,7 +447,15 @@ class BaseBulkUpdateView(
         else:
             # get model
             model = form.Meta.model
-            model_name = model._meta.model_name
+            # evaluate selected records once, before anything is changed;
+            # records are selected with permission lookups (e.g. managers)
+            # that updates below could affect (this also avoids
+            # duplicates caused by a join with managers)
+            pks = list(
+                records.order_by().values_list('pk', flat=True).distinct()
+            )
+            records = model.objects.filter(pk__in=pks)
+            self.records_selected(records)
             # get m2m fields of given model
             m2m_fields = [
                 k[0].name for k in model._meta.get_m2m_with_model()
@@ -365,102 +467,30 @@ class BaseBulkUpdateView(
             tags2add = form.cleaned_data.pop('tags2add', None)
             tags2remove = form.cleaned_data.pop('tags2remove', None)
 
-            if self.tags_field and (tags2add or tags2remove):
-                tags_through_model = getattr(model, self.tags_field).through
-
-                if tags2add:
-                    tags_through_to_create = []
-                    tags = []
-                    # get_or_create `Tag` objects for provided tag names
-                    for tag in tags2add:
-                        obj = Tag.objects.get_or_create(name=tag)
-                        tags.append(obj[0])
-
             # split posted data into 2 dicts
             for field in form.cleaned_data:
                 if field in m2m_fields:
                     m2m_data[field] = form.cleaned_data[field]
                 else:
-                    model_field = model._meta.get_field(field)
-                    if model_field.get_internal_type() == 'ForeignKey':
-                        if form.cleaned_data[field]:
-                            basic_data[field+'_id'] = form.cleaned_data[field].pk
-                        else:
-                            basic_data[field+'_id'] = None
-                    else:
-                        basic_data[field] = form.cleaned_data[field]
-
-            to_update = []
-
-            managers = m2m_data.pop('managers', None)
-            if managers:
-                managers_through_model = getattr(
-                    model, 'managers').through
-                managers_to_update = []
-
-            records_pks = []
-            for obj in records:
-                records_pks.append(obj.pk)
-
-                if basic_data:
-                    for field in basic_data:
-                        setattr(obj, field, basic_data[field])
-                    to_update.append(obj)
-
-                if managers:
-                    for m in managers:
-                        managers_through_obj = managers_through_model(
-                            user=m
-                        )
-                        setattr(managers_through_obj, model_name, obj)
-                        managers_to_update.append(managers_through_obj)
-
-                if self.tags_field and tags2add:
-                    for tag in tags:
-                        tags_through_obj = tags_through_model(
-                            tag=tag, content_object_id=obj.pk
-                        )
-                        tags_through_to_create.append(tags_through_obj)
+                    basic_data[field] = form.cleaned_data[field]
 
             if basic_data:
-                bulk_update(
-                    to_update, update_fields=basic_data.keys()
-                )
+                records.update(**basic_data)
 
+            managers = m2m_data.pop('managers', None)
             if managers:
-                managers_through_model.objects.filter(**{
-                    model_name +'__in': records
-                }).delete()
-                managers_through_model.objects.bulk_create(
-                    managers_to_update
-                )
-
-            if self.tags_field and tags2remove:
-                # remove specified tags (actually we only remove
-                # the objects of the "through" model i.e. `TaggedItem`)
-                tags_through_model.objects.filter(
-                    tag__name__in=tags2remove,
-                    content_object_id__in=records_pks
-                ).delete()
-
+                bulk_set_m2m(records, 'managers', managers)
 
-            if self.tags_field and tags2add:
-                # delete already existing TaggedItems to avoid duplicated records
-                tags_through_model.objects.filter(
-                    tag__in=tags, content_object_id__in=records_pks
-                )
-
-                # create new TaggedItems
-                tags_through_model.objects.bulk_create(
-                    tags_through_to_create
-                )
+            if self.tags_field and (tags2add or tags2remove):
+                self.update_tags(records, tags2add, tags2remove)
 
             # now bulk update extra m2m fields
             self.update_extra_m2m_fields(records, m2m_data)
+            self.records_updated(records)
 
             msg = (
                 'You have successfully updated <strong>{n}</strong> records.'.format(
-                    n=len(records)
+                    n=len(pks)
                 )
             )
             context = {
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""Server-side clustering of points displayed on maps.
+
+Points are grouped by PostGIS on a regular grid whose cell size depends
+on a zoom level, so the size of a response depends on the number of
+non-empty cells visible in a map tile instead of the number of matching
+objects. Clusters are requested per tile (`zoom/x/y` like in slippy
+maps) which makes them easy to cache.
+"""
+from __future__ import unicode_literals
+
+import hashlib
+import math
+
+from django.conf import settings
+from django.contrib.gis.geos import Polygon
+from django.core.cache import cache
+from django.db import connection
+from rest_framework.response import Response
+
+TILE_SIZE = 256
+
+
+def tile_bbox(zoom, x, y):
+    """Return WGS84 bbox `(xmin, ymin, xmax, ymax)` of a slippy map tile"""
+    n = 2.0 ** zoom
+
+    def lon(k):
+        return k / n * 360.0 - 180.0
+
+    def lat(k):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * k / n))))
+
+    return lon(x), lat(y + 1), lon(x + 1), lat(y)
+
+
+def get_grid_size(zoom):
+    """Return a size (in degrees) of a grid cell used to cluster points
+    at given zoom level; a cell covers `MAP_CLUSTER_RADIUS` pixels"""
+    return 360.0 / (2 ** zoom) / TILE_SIZE * settings.MAP_CLUSTER_RADIUS
+
+
+def get_clusters(queryset, geo_field, zoom, bbox=None):
+    """Cluster points of given queryset on a grid in a single query.
+
+    :param queryset: queryset with (already filtered) objects
+    :param geo_field: lookup of a point field e.g. `coordinates` or
+        `resource__deployment__location__coordinates`
+    :param zoom: zoom level used to calculate a grid size
+    :param bbox: optional bbox `(xmin, ymin, xmax, ymax)` used to limit
+        points (spatial index is used)
+    :return: dict with GeoJSON FeatureCollection; each feature contains
+        a number of clustered points and a primary key of an object when
+        a cluster contains only one point
+    """
+    queryset = queryset.order_by()
+    if bbox is not None:
+        queryset = queryset.filter(**{
+            '{field}__intersects'.format(field=geo_field): Polygon.from_bbox(
+                bbox
+            )
+        })
+    sql, params = queryset.values_list(
+        'pk', geo_field
+    ).query.sql_with_params()
+    query = (
+        'SELECT COUNT(*), ST_X(ST_Centroid(ST_Collect(U.geom))), '
+        'ST_Y(ST_Centroid(ST_Collect(U.geom))), MIN(U.pk) '
+        'FROM ({sql}) U (pk, geom) WHERE U.geom IS NOT NULL '
+        'GROUP BY ST_SnapToGrid(U.geom, %s)'
+    ).format(sql=sql)
+
+    features = []
+    with connection.cursor() as cursor:
+        cursor.execute(query, list(params) + [get_grid_size(zoom)])
+        for count, x, y, pk in cursor.fetchall():
+            features.append({
+                'type': 'Feature',
+                'geometry': {'type': 'Point', 'coordinates': [x, y]},
+                'properties': {
+                    'count': count,
+                    'pk': pk if count == 1 else None,
+                }
+            })
+    return {'type': 'FeatureCollection', 'features': features}
+
+
+class ClusterTileViewMixin(object):
+    """Mixin for DRF list views that returns clustered points of a single
+    map tile instead of serialized objects. Tile coordinates are taken
+    from url kwargs: `zoom`, `x` and `y`. Other query parameters are used
+    by filter backends of a view as usual.
+
+    Responses are cached per tile, query parameters and permission scope
+    of a user (see :meth:`get_cluster_scope`).
+    """
+    cluster_geo_field = None
+    cluster_cache_prefix = 'map_clusters'
+
+    def get_cluster_scope(self):
+        """Return a string that identifies a set of objects that a user
+        can access; users with the same scope share cached tiles"""
+        user = self.request.user
+        if not user.is_authenticated():
+            return 'anonymous'
+        return unicode(user.pk)
+
+    def get_cluster_cache_key(self, zoom, x, y):
+        params = sorted(
+            (key, sorted(values)) for key, values in self.request.GET.lists()
+        )
+        raw = '{scope}|{zoom}/{x}/{y}|{params}'.format(
+            scope=self.get_cluster_scope(), zoom=zoom, x=x, y=y,
+            params=params
+        )
+        return '{prefix}_{hash}'.format(
+            prefix=self.cluster_cache_prefix,
+            hash=hashlib.md5(raw.encode('utf-8')).hexdigest()
+        )
+
+    def get(self, request, zoom, x, y, *args, **kwargs):
+        zoom, x, y = int(zoom), int(x), int(y)
+        cache_key = self.get_cluster_cache_key(zoom, x, y)
+        data = cache.get(cache_key)
+        if data is None:
+            queryset = self.filter_queryset(self.get_queryset())
+            data = get_clusters(
+                queryset, self.cluster_geo_field, zoom,
+                bbox=tile_bbox(zoom, x, y)
+            )
+            cache.set(
+                cache_key, data, settings.MAP_CLUSTER_CACHE_TIMEOUT
+            )
+        return Response(data)
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_accessible_sets(apps, schema_editor):
+    # sets are built with the same SQL that maintains them later on
+    # (see `trapper.apps.geomap.models.refresh_accessible_sets`)
+    from django.core.management import call_command
+    call_command('refresh_accessible_sets')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('geomap', '0001_initial'),
+        ('storage', '0002_resource_deployment'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AccessibleDeployment',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('scope', models.CharField(choices=[('U', 'User'), ('A', 'Authenticated users'), ('P', 'Everyone')], default='U', max_length=1)),
+                ('deployment', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='geomap.Deployment')),
+                ('user', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='AccessibleLocation',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('scope', models.CharField(choices=[('U', 'User'), ('A', 'Authenticated users'), ('P', 'Everyone')], default='U', max_length=1)),
+                ('location', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='geomap.Location')),
+                ('user', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='accessibledeployment',
+            unique_together=set([('user', 'deployment', 'scope')]),
+        ),
+        migrations.AlterUniqueTogether(
+            name='accessiblelocation',
+            unique_together=set([('user', 'location', 'scope')]),
+        ),
+        # NULLs are never equal in unique constraints, so rows shared by
+        # all users of a scope need partial unique indexes
+        migrations.RunSQL(
+            'CREATE UNIQUE INDEX geomap_accessiblelocation_shared_uniq '
+            'ON geomap_accessiblelocation (location_id, scope) '
+            'WHERE user_id IS NULL; '
+            'CREATE UNIQUE INDEX geomap_accessibledeployment_shared_uniq '
+            'ON geomap_accessibledeployment (deployment_id, scope) '
+            'WHERE user_id IS NULL;',
+            'DROP INDEX geomap_accessiblelocation_shared_uniq; '
+            'DROP INDEX geomap_accessibledeployment_shared_uniq;'
+        ),
+        migrations.RunPython(
+            fill_accessible_sets, migrations.RunPython.noop
+        ),
+    ]
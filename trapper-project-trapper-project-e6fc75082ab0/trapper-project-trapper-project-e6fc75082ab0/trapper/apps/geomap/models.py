@@ -2,12 +2,19 @@
 from __future__ import unicode_literals
 
 import operator
+import threading
+import uuid
+from contextlib import contextmanager
 
 from django.contrib.gis.db import models
 from django.utils import timezone
 from django.core.urlresolvers import reverse
 from django.apps import apps 
 from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models.signals import m2m_changed, post_save, pre_save
+from django.dispatch import receiver
 from django.templatetags.tz import do_timezone
 
 from leaflet_storage.models import Map
@@ -18,7 +25,12 @@ from taggit.managers import TaggableManager
 from trapper.middleware import get_current_user
 from trapper.apps.common.fields import SafeTextField
 from trapper.apps.storage.mixins import APIContextManagerMixin
-from trapper.apps.geomap.taxonomy import DeploymentViewQuality
+from trapper.apps.geomap.taxonomy import (
+    DeploymentViewQuality, AccessibleScope
+)
+from trapper.apps.storage.taxonomy import (
+    ResourceStatus, CollectionStatus, CollectionMemberLevels
+)
 
 
 class MapManagerUtils(object):
@@ -38,6 +50,299 @@ class MapManagerUtils(object):
         return queryset
 
 
+def refresh_collections_bbox(**resource_filters):
+    """Refresh a bbox of each collection that contains resources matching
+    given lookups (e.g. `deployment__location__pk__in=[...]`). Affected
+    collections are selected with a single query and each of them is
+    refreshed only once. When celery is enabled and the number of affected
+    collections exceeds `settings.COLLECTIONS_BBOX_ASYNC_THRESHOLD` they
+    are refreshed by a celery task after the current transaction is
+    committed."""
+    resource_model = apps.get_model('storage', 'Resource')
+    collection_model = apps.get_model('storage', 'Collection')
+    resources = resource_model.objects.filter(
+        **resource_filters
+    ).values('pk')
+    collection_pks = list(
+        collection_model.objects.filter(
+            resources__in=resources
+        ).values_list('pk', flat=True).distinct()
+    )
+    if (
+        settings.CELERY_ENABLED and
+        len(collection_pks) > settings.COLLECTIONS_BBOX_ASYNC_THRESHOLD
+    ):
+        from trapper.apps.storage.tasks import (
+            celery_refresh_collections_bbox
+        )
+        transaction.on_commit(
+            lambda: celery_refresh_collections_bbox.apply_async(
+                kwargs={'collection_pks': collection_pks},
+                priority=settings.CELERY_BULK_TASK_PRIORITY
+            )
+        )
+        return
+    for collection in collection_model.objects.filter(pk__in=collection_pks):
+        collection.refresh_bbox()
+
+
+ACCESSIBLE_SETS_VERSION_KEY = 'geomap_accessible_sets_version'
+ACCESSIBLE_SETS_USER_VERSION_KEY = 'geomap_accessible_sets_version_{pk}'
+
+
+def _get_version(key):
+    """Return a version token stored in cache; a new token is created when
+    it is missing (e.g. evicted) so missing keys always mean outdated
+    cached data"""
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, uuid.uuid4().hex, None)
+        version = cache.get(key) or ''
+    return version
+
+
+def _get_user_pk(user):
+    if user is None or not user.is_authenticated():
+        return None
+    return user.pk
+
+
+def get_accessible_sets_version(user):
+    """Return a version of locations and deployments accessible for given
+    user; it is a part of keys of cached data derived from them (i.e. map
+    tiles and collection memberships)"""
+    return ':'.join([
+        _get_version(ACCESSIBLE_SETS_VERSION_KEY),
+        _get_version(ACCESSIBLE_SETS_USER_VERSION_KEY.format(
+            pk=_get_user_pk(user)
+        )),
+    ])
+
+
+def invalidate_accessible_sets(users=None):
+    """Change versions of accessible locations and deployments (see
+    :func:`get_accessible_sets_version`), so cached data derived from them
+    is not used anymore. Only cache keys are changed; materialized sets
+    are maintained by :func:`refresh_accessible_sets`.
+
+    :param users: iterable of users (or their primary keys) whose versions
+        should be changed; if None then versions of all users (including
+        anonymous ones) are changed
+    """
+    if users is None:
+        cache.set(ACCESSIBLE_SETS_VERSION_KEY, uuid.uuid4().hex, None)
+        return
+    cache.delete_many([
+        ACCESSIBLE_SETS_USER_VERSION_KEY.format(pk=getattr(k, 'pk', k))
+        for k in users
+    ])
+
+
+def _resource_user_sources(lookup, pks):
+    """Return querysets selecting `(user, object)` pairs of users that have
+    (at least basic) access to resources related to objects with given
+    primary keys through a `lookup` (i.e. `deployment`)"""
+    resource_model = apps.get_model('storage', 'Resource')
+    collection_model = apps.get_model('storage', 'Collection')
+    member_model = apps.get_model('storage', 'CollectionMember')
+    collection_lookup = 'resources__' + lookup
+    return [
+        resource_model.objects.filter(**{
+            lookup + '__in': pks
+        }).values_list('owner', lookup),
+        resource_model.managers.through.objects.filter(**{
+            'resource__' + lookup + '__in': pks
+        }).values_list('user', 'resource__' + lookup),
+        collection_model.objects.filter(**{
+            collection_lookup + '__in': pks
+        }).values_list('owner', collection_lookup),
+        collection_model.managers.through.objects.filter(**{
+            'collection__' + collection_lookup + '__in': pks
+        }).values_list('user', 'collection__' + collection_lookup),
+        member_model.objects.filter(**{
+            'level__in': (
+                CollectionMemberLevels.ACCESS,
+                CollectionMemberLevels.ACCESS_REQUEST,
+                CollectionMemberLevels.ACCESS_BASIC
+            ),
+            'collection__' + collection_lookup + '__in': pks
+        }).values_list('user', 'collection__' + collection_lookup),
+    ]
+
+
+def _resource_public_sources(lookup, pks):
+    """Return querysets selecting objects related (through a `lookup`) to
+    public resources and to resources of public collections"""
+    resource_model = apps.get_model('storage', 'Resource')
+    collection_model = apps.get_model('storage', 'Collection')
+    collection_lookup = 'resources__' + lookup
+    return (
+        resource_model.objects.filter(**{
+            lookup + '__in': pks, 'status': ResourceStatus.PUBLIC
+        }).values_list(lookup),
+        collection_model.objects.filter(**{
+            collection_lookup + '__in': pks,
+            'status': CollectionStatus.PUBLIC
+        }).values_list(collection_lookup),
+    )
+
+
+def _location_sources(pks):
+    """Return querysets of rows of materialized sets of given locations
+    per scope; they select the same locations as
+    :meth:`LocationManager.get_available` (with `public=None`)"""
+    public_resources, public_collections = _resource_public_sources(
+        'deployment__location', pks
+    )
+    return {
+        AccessibleScope.USER: [
+            Location.objects.filter(pk__in=pks).values_list('owner', 'pk'),
+            Location.managers.through.objects.filter(
+                location__in=pks
+            ).values_list('user', 'location'),
+        ] + _resource_user_sources('deployment__location', pks),
+        AccessibleScope.AUTHENTICATED: [public_collections],
+        AccessibleScope.PUBLIC: [public_resources],
+    }
+
+
+def _deployment_sources(pks):
+    """Return querysets of rows of materialized sets of given deployments
+    per scope; they select the same deployments as
+    :meth:`DeploymentManager.get_accessible`"""
+    return {
+        AccessibleScope.USER: [
+            Deployment.objects.filter(pk__in=pks).values_list('owner', 'pk'),
+            Deployment.managers.through.objects.filter(
+                deployment__in=pks
+            ).values_list('user', 'deployment'),
+        ] + _resource_user_sources('deployment', pks),
+        AccessibleScope.AUTHENTICATED: list(
+            _resource_public_sources('deployment', pks)
+        ),
+    }
+
+
+def _materialize(model, field, scope, querysets):
+    """Insert rows selected by querysets into a table of materialized
+    objects with a single INSERT ... SELECT query. Querysets select
+    `(user, object)` pairs for the user scope and objects otherwise."""
+    qn = connection.ops.quote_name
+    selects = []
+    params = [scope]
+    for queryset in querysets:
+        sql, sql_params = queryset.order_by().query.sql_with_params()
+        selects.append('({sql})'.format(sql=sql))
+        params.extend(sql_params)
+    if scope == AccessibleScope.USER:
+        user, columns = 'U.user_id', 'user_id, object_id'
+    else:
+        user, columns = 'NULL::integer', 'object_id'
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'INSERT INTO {table} ({scope}, {user}, {field}) '
+            'SELECT DISTINCT %s, {user_value}, U.object_id '
+            'FROM ({sql}) U({columns}) ON CONFLICT DO NOTHING'.format(
+                table=qn(model._meta.db_table),
+                scope=qn(model._meta.get_field('scope').column),
+                user=qn(model._meta.get_field('user').column),
+                field=qn(model._meta.get_field(field).column),
+                user_value=user,
+                sql=' UNION '.join(selects),
+                columns=columns
+            ),
+            params
+        )
+
+
+_deferred = threading.local()
+
+
+@contextmanager
+def defer_accessible_sets():
+    """Collect objects passed to :func:`refresh_accessible_sets` inside
+    a block and refresh them once, when the outermost block is left
+    (e.g. when many objects are changed one by one and each of them sends
+    signals)"""
+    pending = getattr(_deferred, 'pending', None)
+    if pending is not None:
+        yield
+        return
+    _deferred.pending = pending = {'locations': set(), 'deployments': set()}
+    try:
+        yield
+    finally:
+        _deferred.pending = None
+    refresh_accessible_sets(
+        location_pks=pending['locations'],
+        deployment_pks=pending['deployments']
+    )
+
+
+def refresh_accessible_sets(location_pks=(), deployment_pks=()):
+    """Recalculate rows of materialized sets of accessible locations and
+    deployments (of all users) for given objects only. Locations of given
+    deployments are refreshed too, as access to locations is derived from
+    access to resources of their deployments.
+
+    Signal handlers and bulk operations call it with objects affected by
+    a change, so sets are always up to date and are never rebuilt while
+    they are read. Refreshes of the same objects are serialized by row
+    locks; rows are unique so concurrent refreshes never insert duplicates.
+    """
+    location_pks = set(k for k in location_pks if k is not None)
+    deployment_pks = set(k for k in deployment_pks if k is not None)
+    pending = getattr(_deferred, 'pending', None)
+    if pending is not None:
+        pending['locations'].update(location_pks)
+        pending['deployments'].update(deployment_pks)
+        return
+    if deployment_pks:
+        location_pks.update(
+            Deployment.objects.filter(
+                pk__in=deployment_pks
+            ).values_list('location', flat=True)
+        )
+    if not location_pks and not deployment_pks:
+        return
+    location_pks = sorted(location_pks)
+    deployment_pks = sorted(deployment_pks)
+    with transaction.atomic():
+        for model, pks in (
+            (Location, location_pks), (Deployment, deployment_pks)
+        ):
+            list(
+                model.objects.select_for_update().filter(
+                    pk__in=pks
+                ).order_by('pk').values_list('pk', flat=True)
+            )
+        for model, field, pks, sources in (
+            (AccessibleLocation, 'location', location_pks, _location_sources),
+            (
+                AccessibleDeployment, 'deployment', deployment_pks,
+                _deployment_sources
+            ),
+        ):
+            if not pks:
+                continue
+            model.objects.filter(**{field + '__in': pks}).delete()
+            for scope, querysets in sources(pks).items():
+                _materialize(model, field, scope, querysets)
+
+
+def get_accessible_filter(user):
+    """Return lookups selecting rows of materialized sets that are
+    visible for given user"""
+    if _get_user_pk(user) is None:
+        return models.Q(scope=AccessibleScope.PUBLIC)
+    return (
+        models.Q(scope=AccessibleScope.USER, user=user) |
+        models.Q(scope__in=[
+            AccessibleScope.AUTHENTICATED, AccessibleScope.PUBLIC
+        ])
+    )
+
+
 class LocationManager(models.GeoManager):
     url_update = 'geomap:map_view'
     url_detail = 'geomap:location_detail'
@@ -81,6 +386,30 @@ class LocationManager(models.GeoManager):
         )
         return queryset.filter(filter_params)
 
+    def get_available_materialized(
+            self, user=None, base_queryset=None, public=True
+    ):
+        """The same as :meth:`get_available` but instead of joining
+        locations with accessible resources it uses materialized sets
+        of accessible locations (see :func:`refresh_accessible_sets`).
+        Sets are indexed tables so they can be combined with spatial
+        (i.e. bbox) lookups cheaply."""
+        user = user or get_current_user()
+
+        if base_queryset is None:
+            queryset = self.get_queryset()
+        else:
+            queryset = base_queryset
+
+        filter_params = models.Q(
+            pk__in=AccessibleLocation.objects.filter(
+                get_accessible_filter(user)
+            ).values('location')
+        )
+        if public is not None:
+            filter_params |= models.Q(is_public=bool(public))
+        return queryset.filter(filter_params)
+
     def api_update_context(self, item, user):
         context = None
         if item.can_update(user):
@@ -201,9 +530,7 @@ class Location(models.Model):
         super(Location, self).save(**kwargs)
 
         if old_instance and self.coordinates != old_instance.coordinates:
-            for deployment in self.deployments.all():
-                for resource in deployment.resources.all():
-                    resource.refresh_collection_bbox()
+            refresh_collections_bbox(deployment__location=self)
 
     def reverse_geocoding(self, set_fields=True, return_data=False):
         """ using pygeocoder: http://code.xster.net/pygeocoder/wiki/Home
@@ -312,6 +639,26 @@ class DeploymentManager(APIContextManagerMixin, models.Manager):
         )
         return queryset.filter(filter_params)
 
+    def get_accessible_materialized(self, user=None, base_queryset=None):
+        """The same as :meth:`get_accessible` but it uses a materialized
+        set of deployments accessible for given user (see
+        :func:`refresh_accessible_sets`)."""
+        user = user or get_current_user()
+
+        if base_queryset is None:
+            queryset = self.get_queryset()
+        else:
+            queryset = base_queryset
+
+        if not user.is_authenticated():
+            return queryset.none()
+
+        return queryset.filter(
+            pk__in=AccessibleDeployment.objects.filter(
+                get_accessible_filter(user)
+            ).values('deployment')
+        )
+
     def api_update_context(self, item, user):
         context = None
         if item.can_update(user):
@@ -429,3 +776,107 @@ class Deployment(models.Model):
 
     def __unicode__(self):
         return unicode(self.deployment_id)
+
+
+class AccessibleLocation(models.Model):
+    """Materialized set of accessible locations; each row refers either
+    to a single user or (when `user` is empty) to all users of its scope.
+    Maintained by :func:`refresh_accessible_sets`."""
+    scope = models.CharField(
+        max_length=1, choices=AccessibleScope.CHOICES,
+        default=AccessibleScope.USER
+    )
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL, null=True, related_name='+'
+    )
+    location = models.ForeignKey(Location, related_name='+')
+
+    class Meta:
+        unique_together = ['user', 'location', 'scope']
+
+
+class AccessibleDeployment(models.Model):
+    """Materialized set of accessible deployments; each row refers either
+    to a single user or (when `user` is empty) to all authenticated users.
+    Maintained by :func:`refresh_accessible_sets`."""
+    scope = models.CharField(
+        max_length=1, choices=AccessibleScope.CHOICES,
+        default=AccessibleScope.USER
+    )
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL, null=True, related_name='+'
+    )
+    deployment = models.ForeignKey(Deployment, related_name='+')
+
+    class Meta:
+        unique_together = ['user', 'deployment', 'scope']
+
+
+@receiver(pre_save, sender=Deployment)
+def deployment_store_location(sender, instance, **kwargs):
+    """
+    Signal used to remember a previous location of a deployment, so
+    the materialized set of that location can be refreshed too.
+    """
+    instance._previous_location_id = None
+    if instance.pk:
+        instance._previous_location_id = Deployment.objects.filter(
+            pk=instance.pk
+        ).values_list('location', flat=True).first()
+
+
+@receiver(post_save, sender=Location)
+@receiver(post_save, sender=Deployment)
+def location_accessible_sets_refresh(sender, instance, created, **kwargs):
+    """
+    Signal used to refresh materialized sets of a saved location
+    or deployment and to invalidate data cached for them. New objects
+    change only data of their owners.
+    """
+    if sender is Location:
+        refresh_accessible_sets(location_pks=[instance.pk])
+    else:
+        refresh_accessible_sets(
+            location_pks=[getattr(instance, '_previous_location_id', None)],
+            deployment_pks=[instance.pk]
+        )
+    if created:
+        invalidate_accessible_sets(users=[instance.owner_id])
+    else:
+        invalidate_accessible_sets()
+
+
+@receiver(m2m_changed, sender=Location.managers.through)
+@receiver(m2m_changed, sender=Deployment.managers.through)
+def managers_accessible_sets_refresh(
+        sender, instance, action, reverse, pk_set, **kwargs
+):
+    """
+    Signal used to refresh materialized sets of locations and deployments
+    whose managers are changed and to invalidate data cached for added or
+    removed managers.
+    """
+    field = 'locations' if sender is Location.managers.through else (
+        'deployments'
+    )
+    if reverse and action == 'pre_clear':
+        # objects managed by a user are not known after they are cleared
+        instance._cleared_managed = list(
+            getattr(instance, 'managed_' + field).values_list(
+                'pk', flat=True
+            )
+        )
+        return
+    if action not in ['post_add', 'post_remove', 'post_clear']:
+        return
+    if reverse:
+        if action == 'post_clear':
+            pk_set = getattr(instance, '_cleared_managed', [])
+        refresh_accessible_sets(**{field[:-1] + '_pks': pk_set or []})
+        invalidate_accessible_sets(users=[instance])
+    else:
+        refresh_accessible_sets(**{field[:-1] + '_pks': [instance.pk]})
+        if pk_set:
+            invalidate_accessible_sets(users=pk_set)
+        elif action == 'post_clear':
+            invalidate_accessible_sets()
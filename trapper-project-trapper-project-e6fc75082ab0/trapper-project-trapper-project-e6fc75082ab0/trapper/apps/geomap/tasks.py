@@ -1,12 +1,73 @@
 from __future__ import absolute_import
 
-import dateutil
+import pandas
 import pytz
+from bulk_update.helper import bulk_update
 from celery import shared_task
+from django.conf import settings
 from django.contrib.gis.geos import Point
+from django.db import transaction
+from django.db.models import Q
 from django.utils import timezone
 
-from trapper.apps.geomap.models import Location, Deployment
+from trapper.apps.accounts.task_metrics import task_phase, task_progress
+from trapper.apps.common.task_args import rehydrate
+from trapper.apps.geomap.models import (
+    Location, Deployment, refresh_collections_bbox,
+    invalidate_accessible_sets, refresh_accessible_sets
+)
+
+
+def get_editable_pks(model, objects, user):
+    """Return a set of primary keys of given objects that can be updated by
+    a user (owner or one of managers); evaluated with a single query."""
+    pks = [k.pk for k in objects]
+    if not pks:
+        return set()
+    return set(
+        model.objects.filter(
+            Q(owner=user) | Q(managers=user), pk__in=pks
+        ).values_list('pk', flat=True)
+    )
+
+
+def parse_datetime_column(series, tz):
+    """Vectorized version of parsing datetime strings into timezone aware
+    UTC timestamps. Values with an explicit UTC offset (following a time,
+    so a year of a date like `25-04-2016` is not taken for an offset) are
+    converted directly, naive values are localized with a given
+    timezone.
+
+    :return: a list of datetime objects (or None if a value could not
+        be parsed) and a list of positions of values that could not
+        be parsed
+    """
+    series = series.fillna('').astype(unicode).str.strip()
+    has_offset = series.str.contains(
+        r'\d{2}:\d{2}(?::\d{2}(?:\.\d+)?)?\s*(?:Z|[+-]\d{2}:?\d{2})$'
+    )
+    parsed = pandas.Series(pandas.NaT, index=series.index)
+    if has_offset.any():
+        parsed[has_offset] = pandas.to_datetime(
+            series[has_offset], errors='coerce', utc=True
+        )
+    naive = ~has_offset & (series != '')
+    if naive.any():
+        parsed[naive] = pandas.to_datetime(series[naive], errors='coerce')
+    values = []
+    errors = []
+    for i, (raw, value) in enumerate(zip(series, parsed)):
+        if pandas.isnull(value):
+            values.append(None)
+            errors.append(i)
+            continue
+        value = value.to_pydatetime()
+        if has_offset.iloc[i]:
+            value = value.replace(tzinfo=pytz.UTC)
+        else:
+            value = tz.localize(value).astimezone(pytz.UTC)
+        values.append(value)
+    return values, errors
 
 
 class LocationImporter():
@@ -26,85 +87,127 @@ class LocationImporter():
         self.imported = 0
         self.log = []
 
-    def import_location(
-            self, location_id, x, y, name='', description='',
-    ):
-
-        error_msg = '<strong>[ERROR] </strong>Location ID, {loc_id} '.format(
+    def get_error_msg(self, location_id):
+        return '<strong>[ERROR] </strong>Location ID, {loc_id} '.format(
             loc_id=location_id
         )
-        try:
-            location = Location.objects.get(
-                location_id=location_id,
+
+    def get_rows(self):
+        """Return a list of tuples (location_id, x, y, name, description)
+        built from a csv or gpx file"""
+        if self.csv:
+            df = self.df.where(pandas.notnull(self.df), None)
+            empty = [''] * len(df)
+            return zip(
+                df['location_id'].tolist(),
+                df['X'].tolist(),
+                df['Y'].tolist(),
+                df['name'].tolist() if 'name' in df.columns else empty,
+                df['description'].tolist()
+                if 'description' in df.columns else empty,
+            )
+        return [
+            (k.name, k.longitude, k.latitude, '', '')
+            for k in self.gpx.waypoints
+        ]
+
+    def import_rows(self, rows):
+        """Create or update locations using a constant number of queries:
+        existing locations and user's permissions are fetched set-wise and
+        changes are written with bulk create/update. Bboxes of collections
+        affected by changed coordinates are refreshed once at the end."""
+        location_ids = set(k[0] for k in rows)
+        existing = dict(
+            (k.location_id, k) for k in Location.objects.filter(
+                location_id__in=location_ids,
                 research_project=self.research_project
             )
-            if not location.can_update(user=self.user):
+        )
+        old_coordinates = dict(
+            (k.pk, k.coordinates) for k in existing.values()
+        )
+        editable = get_editable_pks(Location, existing.values(), self.user)
+
+        to_create = {}
+        to_update = {}
+        now = timezone.now()
+        task_phase('validate')
+        for i, (location_id, x, y, name, description) in enumerate(rows):
+            task_progress(i, len(rows))
+            error_msg = self.get_error_msg(location_id)
+            location = existing.get(location_id)
+            if location is not None and location.pk not in editable:
                 self.log.append(error_msg)
                 self.log.append(
                     'You are not allowed to update this location.'
                 )
-                return 1
-
-        except Location.DoesNotExist:
-            location = Location(
-                location_id=location_id,
-                research_project=self.research_project,
-                date_created=timezone.now(),
-                owner=self.user,
-                is_public=False
-            )
-        try:
-            coords = Point((float(x),float(y)), srid=4326)
-        except Exception as e:
-            self.log.append(error_msg)
-            self.log.append(
-                'Error when parsing coordinates: {e}'.format(e=str(e))
+                continue
+            try:
+                coords = Point((float(x),float(y)), srid=4326)
+            except Exception as e:
+                self.log.append(error_msg)
+                self.log.append(
+                    'Error when parsing coordinates: {e}'.format(e=str(e))
+                )
+                continue
+            if location is None:
+                location = to_create.get(location_id) or Location(
+                    location_id=location_id,
+                    research_project=self.research_project,
+                    date_created=now,
+                    owner=self.user,
+                    is_public=False
+                )
+                to_create[location_id] = location
+            else:
+                to_update[location_id] = location
+            location.coordinates = coords
+            location.timezone = self.timezone
+            location.name = name or ''
+            location.description = description or ''
+            self.imported += 1
+
+        moved = [
+            k.pk for k in to_update.values()
+            if k.coordinates != old_coordinates[k.pk]
+        ]
+        task_progress(len(rows), len(rows))
+        if settings.REVERSE_GEOCODING:
+            task_phase('geocoding')
+            for location in to_create.values():
+                location.reverse_geocoding()
+            for location in to_update.values():
+                if location.pk in moved:
+                    location.reverse_geocoding()
+
+        task_phase('write')
+        with transaction.atomic():
+            Location.objects.bulk_create(to_create.values())
+            if to_update:
+                bulk_update(to_update.values(), update_fields=[
+                    'coordinates', 'timezone', 'name', 'description',
+                    'country', 'state', 'county', 'city'
+                ])
+        if to_create:
+            # bulk_create does not send signals
+            refresh_accessible_sets(
+                location_pks=Location.objects.filter(
+                    owner=self.user, date_created=now
+                ).values_list('pk', flat=True)
             )
-            return 1
-        location.coordinates = coords
-        location.timezone = self.timezone
-        location.name = name
-        location.description = description
-        location.save()
-        return 0
+            invalidate_accessible_sets(users=[self.user])
+        if moved:
+            refresh_collections_bbox(deployment__location__pk__in=moved)
 
     def import_gpx(self):
         """Parse gpx data
         """
-        for waypoint in self.gpx.waypoints:
-            status = self.import_location(
-                location_id=waypoint.name,
-                x=waypoint.longitude,
-                y=waypoint.latitude
-            )
-            if status == 1:
-                continue
-            else:
-                self.imported += 1
+        self.import_rows(self.get_rows())
 
     def import_csv(self):
         """Parse csv data
         """
-        for i in range(0, len(self.df)):
-            location_id = self.df.iloc[i]['location_id']
-            x = self.df.iloc[i]['X']
-            y = self.df.iloc[i]['Y']
-            name = ''
-            if 'name' in self.df.columns:
-                name = self.df.iloc[i]['name']
-            description = ''
-            if 'description' in self.df.columns:
-                description = self.df.iloc[i]['description']
-
-            status = self.import_location(
-                location_id=location_id,
-                x=x, y=y, name=name,
-                description=description
-            )
-            if status == 1:
-                continue
-            else:
-                self.imported += 1
+        self.import_rows(self.get_rows())
 
     def import_locations(self):
         if self.csv:
@@ -137,6 +240,7 @@ class LocationImporter():
 
 
 @shared_task
+@rehydrate
 def celery_import_locations(data, user):
     """
     Celery task that imports locations from csv or gpx file.
@@ -148,6 +252,12 @@ def celery_import_locations(data, user):
 
 class DeploymentImporter():
 
+    UPDATE_FIELDS = [
+        'location', 'deployment_code', 'deployment_id', 'start_date',
+        'end_date', 'correct_setup', 'correct_tstamp', 'view_quality',
+        'comments'
+    ]
+
     def __init__(self, data, user):
         self.data = data
         self.user = user
@@ -157,89 +267,147 @@ class DeploymentImporter():
         self.log = []
 
     def import_deployments(self):
+        """Create or update deployments using a constant number of queries.
+        Referenced locations and existing deployments are fetched with one
+        query each, dates are parsed column-wise with pandas, permissions
+        are checked set-wise and changes are written with bulk
+        create/update."""
+        task_phase('parse')
         research_project = self.data['research_project']
         tz = self.data['timezone']
+        df = self.df.where(pandas.notnull(self.df), None)
 
-        for i in range(0, len(self.df)):
-            deployment_id = self.df.iloc[i]['deployment_id']
-            location_id = self.df.iloc[i]['location_id']
+        starts, start_errors = parse_datetime_column(
+            self.df['deployment_start'], tz
+        )
+        ends, end_errors = parse_datetime_column(
+            self.df['deployment_end'], tz
+        )
+        start_errors = set(start_errors)
+        end_errors = set(end_errors)
+        correct_setup = (df['correct_setup'] == 'True').tolist()
+        correct_tstamp = (df['correct_tstamp'] == 'True').tolist()
+        deployment_ids = df['deployment_id'].tolist()
+        location_ids = df['location_id'].tolist()
+        deployment_codes = df['deployment_code'].tolist()
+        view_quality = None
+        if 'view_quality' in df.columns:
+            view_quality = df['view_quality'].tolist()
+        comments = None
+        if 'comments' in df.columns:
+            comments = df['comments'].tolist()
+
+        locations = dict(
+            (k.location_id, k) for k in Location.objects.filter(
+                location_id__in=set(location_ids),
+                research_project=research_project
+            )
+        )
+        existing = dict(
+            (k.deployment_id, k) for k in Deployment.objects.filter(
+                deployment_id__in=set(deployment_ids),
+                research_project=research_project,
+            ).select_related('location')
+        )
+        old_locations = dict(
+            (k.pk, k.location_id) for k in existing.values()
+        )
+        editable = get_editable_pks(Deployment, existing.values(), self.user)
+
+        to_create = {}
+        to_update = {}
+        now = timezone.now()
+        task_phase('validate')
+        for i in range(0, len(df)):
+            task_progress(i, self.total)
+            deployment_id = deployment_ids[i]
 
             error_msg = '<strong>[ERROR] </strong>{i}, Deployment ID, {dep_id} '.format(
                 dep_id=deployment_id, i=i
             )
 
             # first check if deployment's location exists
-            try:
-                location = Location.objects.get(
-                    location_id=location_id,
-                    research_project=research_project
-                )
-            except Location.DoesNotExist, e:
+            location = locations.get(location_ids[i])
+            if location is None:
                 self.log.append(error_msg)
-                self.log.append(str(e))
+                self.log.append('Location matching query does not exist.')
                 continue
 
-            deployment_code = self.df.iloc[i]['deployment_code']
-            deployment_start = self.df.iloc[i]['deployment_start']
-            deployment_end = self.df.iloc[i]['deployment_end']
-            correct_setup = self.df.iloc[i]['correct_setup'] == 'True'
-            correct_tstamp = self.df.iloc[i]['correct_tstamp'] == 'True'
-
-            # try to parse datetime objects and make them timezone aware
-            try:
-                start = dateutil.parser.parse(deployment_start)
-                if start.tzinfo:
-                    start = start.astimezone(pytz.UTC)
-                else:
-                    start = tz.localize(start).astimezone(pytz.UTC)
-            except Exception, e:
+            if i in start_errors:
                 self.log.append(error_msg)
-                self.log.append(str(e))
-                start = None
-            try:
-                end = dateutil.parser.parse(deployment_end)
-                if end.tzinfo:
-                    end = end.astimezone(pytz.UTC)
-                else:
-                    end = tz.localize(end).astimezone(pytz.UTC)
-            except Exception, e:
+                self.log.append(
+                    'Could not parse the deployment start date: {date}'.format(
+                        date=self.df['deployment_start'].iloc[i]
+                    )
+                )
+            if i in end_errors:
                 self.log.append(error_msg)
-                self.log.append(str(e))
-                end= None
+                self.log.append(
+                    'Could not parse the deployment end date: {date}'.format(
+                        date=self.df['deployment_end'].iloc[i]
+                    )
+                )
 
             # create/update deployment
-            try:
-                deployment = Deployment.objects.get(
-                    deployment_id=deployment_id,
-                    research_project=research_project,
-                )
-                if not deployment.can_update(user=self.user):
+            deployment = existing.get(deployment_id)
+            if deployment is not None:
+                if deployment.pk not in editable:
                     self.log.append(error_msg)
                     self.log.append(
                         'You are not allowed to update this deployment.'
                     )
                     continue
-
-            except Deployment.DoesNotExist:
-                deployment = Deployment(
-                    deployment_id=deployment_id,
+                to_update[deployment_id] = deployment
+            else:
+                deployment = to_create.get(deployment_id) or Deployment(
                     research_project=research_project,
-                    date_created=timezone.now(),
+                    date_created=now,
                     owner=self.user,
                 )
+                to_create[deployment_id] = deployment
             deployment.location=location
-            deployment.deployment_code=deployment_code
-            deployment.start_date=start
-            deployment.end_date=end
-            deployment.correct_setup=correct_setup
-            deployment.correct_tstamp=correct_tstamp
-            if 'view_quality' in self.df.columns:
-                deployment.view_quality = self.df.iloc[i]['view_quality']
-            if 'comments' in self.df.columns:
-                deployment.comments = self.df.iloc[i]['comments']
-            deployment.save()
+            deployment.deployment_code=deployment_codes[i]
+            deployment.start_date=starts[i]
+            deployment.end_date=ends[i]
+            deployment.correct_setup=correct_setup[i]
+            deployment.correct_tstamp=correct_tstamp[i]
+            if view_quality is not None:
+                deployment.view_quality = view_quality[i]
+            if comments is not None:
+                deployment.comments = comments[i]
+            deployment.update_deployment_id(save=False)
             self.imported += 1
 
+        task_phase('write')
+        task_progress(self.total, self.total)
+        with transaction.atomic():
+            Deployment.objects.bulk_create(to_create.values())
+            if to_update:
+                bulk_update(
+                    to_update.values(), update_fields=self.UPDATE_FIELDS
+                )
+        moved = [
+            k.pk for k in to_update.values()
+            if k.location_id != old_locations[k.pk]
+        ]
+        # bulk_create and bulk_update do not send signals
+        created = []
+        if to_create:
+            created = list(
+                Deployment.objects.filter(
+                    owner=self.user, date_created=now
+                ).values_list('pk', flat=True)
+            )
+        refresh_accessible_sets(
+            location_pks=[old_locations[k] for k in moved],
+            deployment_pks=moved + created
+        )
+        if moved:
+            refresh_collections_bbox(deployment__pk__in=moved)
+            invalidate_accessible_sets()
+        elif to_create:
+            invalidate_accessible_sets(users=[self.user])
+
         if self.imported == 0:
 
             self.log.insert(0,
@@ -267,6 +435,7 @@ class DeploymentImporter():
 
 
 @shared_task
+@rehydrate
 def celery_import_deployments(data, user):
     """
     Celery task that imports deployments from csv file.
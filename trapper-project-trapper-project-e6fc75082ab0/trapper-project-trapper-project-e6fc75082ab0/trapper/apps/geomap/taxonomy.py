@@ -21,3 +21,18 @@ class DeploymentViewQuality(BaseTaxonomy):
         (GOOD, 'Good'),
         (PERFECT, 'Perfect'),
     )
+
+
+class AccessibleScope(BaseTaxonomy):
+    """Scopes of rows of materialized sets of accessible locations and
+    deployments; rows with a user scope refer to a single user, other
+    rows refer to all (authenticated) users"""
+    USER = 'U'
+    AUTHENTICATED = 'A'
+    PUBLIC = 'P'
+
+    CHOICES = (
+        (USER, 'User'),
+        (AUTHENTICATED, 'Authenticated users'),
+        (PUBLIC, 'Everyone'),
+    )
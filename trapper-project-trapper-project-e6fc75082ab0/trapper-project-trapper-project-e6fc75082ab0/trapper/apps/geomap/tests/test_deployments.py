@@ -1,13 +1,17 @@
 # -*- coding: utf-8 -*-
 
+import datetime
 import json
 
+import pandas
+import pytz
 from django.core.urlresolvers import reverse
 
 from trapper.apps.common.utils.test_tools import (
     ExtendedTestCase, LocationTestMixin, DeploymentTestMixin,
 )
 from trapper.apps.geomap.models import Deployment
+from trapper.apps.geomap.tasks import parse_datetime_column
 
 
 class BaseGeomapTestCase(
@@ -141,3 +145,28 @@ class DeploymentTestCase(BaseGeomapTestCase):
         self.assertTrue(
             Deployment.objects.filter(pk=deployment_other.pk).exists()
         )
+
+
+class ParseDatetimeColumnTestCase(ExtendedTestCase):
+    """Parsing of deployments' start and end dates by importers"""
+
+    def test_parse_datetime_column(self):
+        """Only offsets following a time are taken for UTC offsets; dates
+        in DD-MM-YYYY format are localized with a given timezone"""
+        tz = pytz.timezone('Europe/Warsaw')
+        values, errors = parse_datetime_column(pandas.Series([
+            '25-04-2016',
+            '25-04-2016 12:00',
+            '2016-04-25 12:00:00+02:00',
+            '2016-04-25T10:00:00.5Z',
+            'invalid',
+            None,
+        ]), tz)
+        self.assertEqual(values[:4], [
+            datetime.datetime(2016, 4, 24, 22, 0, tzinfo=pytz.UTC),
+            datetime.datetime(2016, 4, 25, 10, 0, tzinfo=pytz.UTC),
+            datetime.datetime(2016, 4, 25, 10, 0, tzinfo=pytz.UTC),
+            datetime.datetime(2016, 4, 25, 10, 0, 0, 500000, tzinfo=pytz.UTC),
+        ])
+        self.assertEqual(values[4:], [None, None])
+        self.assertEqual(errors, [4, 5])
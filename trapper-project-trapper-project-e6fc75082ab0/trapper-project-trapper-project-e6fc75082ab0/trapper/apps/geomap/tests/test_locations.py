@@ -2,12 +2,26 @@
 
 import json
 
+import pandas
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.gis.geos import Point
 from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 
 from trapper.apps.common.utils.test_tools import (
-    ExtendedTestCase, LocationTestMixin,
+    ExtendedTestCase, LocationTestMixin, CollectionTestMixin,
+)
+from trapper.apps.geomap.models import (
+    Location, Deployment, AccessibleLocation, refresh_accessible_sets,
+    get_accessible_sets_version
+)
+from trapper.apps.geomap.tasks import LocationImporter
+from trapper.apps.storage.models import Collection, CollectionMember
+from trapper.apps.storage.taxonomy import (
+    ResourceStatus, CollectionMemberLevels
 )
-from trapper.apps.geomap.models import Location
 
 
 class BaseGeomapTestCase(ExtendedTestCase, LocationTestMixin):
@@ -154,3 +168,256 @@ class LocationTestCase(BaseGeomapTestCase):
         self.assertTrue(
             Location.objects.filter(pk=location_other.pk).exists()
         )
+
+
+class LocationImporterTestCase(BaseGeomapTestCase):
+    """Bulk import of locations from csv data"""
+
+    def get_data(self, rows):
+        return {
+            'csv_file': True,
+            'df': pandas.DataFrame(
+                rows, columns=['location_id', 'X', 'Y'], dtype=object
+            ),
+            'research_project': None,
+            'timezone': 'UTC',
+        }
+
+    def test_create_and_update(self):
+        """New locations are created, editable ones are updated and
+        locations of other users are left untouched"""
+        location_owner = self.create_location(
+            owner=self.alice, location_id='ID_OWNER'
+        )
+        location_other = self.create_location(
+            owner=self.ziutek, location_id='ID_OTHER'
+        )
+        data = self.get_data([
+            ['ID_NEW', '10.5', '20.5'],
+            ['ID_OWNER', '11', '21'],
+            ['ID_OTHER', '12', '22'],
+            ['ID_INVALID', 'x', 'y'],
+        ])
+        importer = LocationImporter(data, self.alice)
+        importer.import_locations()
+
+        self.assertEqual(importer.imported, 2)
+        self.assertTrue(
+            Location.objects.filter(
+                location_id='ID_NEW', owner=self.alice
+            ).exists()
+        )
+        self.assertFalse(
+            Location.objects.filter(location_id='ID_INVALID').exists()
+        )
+        location_owner.refresh_from_db()
+        self.assertEqual(location_owner.coordinates.x, 11)
+        location_other.refresh_from_db()
+        self.assertEqual(location_other.coordinates.x, 50)
+
+
+class LocationCoordinatesTestCase(BaseGeomapTestCase, CollectionTestMixin):
+    """Propagation of location's coordinates changes"""
+
+    def move_location_of_collection(self):
+        """Move a location of a collection's deployment to (10, 10) and
+        return bboxes of a collection before and after a move"""
+        deployment1 = self.create_deployment(owner=self.alice)
+        deployment2 = self.create_deployment(owner=self.alice)
+        collection = self.create_collection(
+            owner=self.alice, resources=[
+                self.create_resource(
+                    owner=self.alice, deployment=deployment1
+                ),
+                self.create_resource(
+                    owner=self.alice, deployment=deployment2
+                ),
+            ]
+        )
+        collection.refresh_bbox()
+        old_bbox = Collection.objects.get(pk=collection.pk).bbox
+
+        location = deployment1.location
+        location.coordinates = Point(x=10, y=10)
+        location.save()
+
+        new_bbox = Collection.objects.get(pk=collection.pk).bbox
+        return old_bbox, new_bbox
+
+    def test_collection_bbox_refreshed(self):
+        """Moving a location refreshes bboxes of affected collections"""
+        old_bbox, new_bbox = self.move_location_of_collection()
+        self.assertNotEqual(old_bbox.extent, new_bbox.extent)
+        self.assertTrue(new_bbox.contains(Point(x=10, y=10)))
+
+    @override_settings(COLLECTIONS_BBOX_ASYNC_THRESHOLD=0)
+    def test_collection_bbox_refreshed_without_celery(self):
+        """When celery is disabled bboxes are refreshed synchronously
+        even above the async threshold"""
+        old_bbox, new_bbox = self.move_location_of_collection()
+        self.assertNotEqual(old_bbox.extent, new_bbox.extent)
+        self.assertTrue(new_bbox.contains(Point(x=10, y=10)))
+
+
+@override_settings(CACHES={
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+})
+class AccessibleLocationsTestCase(BaseGeomapTestCase, CollectionTestMixin):
+    """Materialized sets of locations accessible for users"""
+
+    def test_materialized_set(self):
+        """Materialized set contains the same locations as the one
+        computed by `get_available` and is refreshed after changes"""
+        location_public = self.create_location(
+            owner=self.ziutek, is_public=True
+        )
+        location_private = self.create_location(
+            owner=self.ziutek, is_public=False
+        )
+        location_owner = self.create_location(
+            owner=self.alice, is_public=False
+        )
+
+        available = Location.objects.get_available_materialized(
+            user=self.alice
+        )
+        self.assertItemsEqual(
+            available.values_list('pk', flat=True),
+            Location.objects.get_available(
+                user=self.alice
+            ).values_list('pk', flat=True)
+        )
+        self.assertIn(location_public, available)
+        self.assertIn(location_owner, available)
+        self.assertNotIn(location_private, available)
+
+        location_private.managers.add(self.alice)
+        available = Location.objects.get_available_materialized(
+            user=self.alice
+        )
+        self.assertIn(location_private, available)
+
+    def test_materialized_set_resources(self):
+        """Access to resources of a deployment is applied to materialized
+        sets of a deployment and its location when resources change"""
+        location = self.create_location(owner=self.ziutek, is_public=False)
+        deployment = self.create_deployment(
+            owner=self.ziutek, location=location
+        )
+        resource = self.create_resource(
+            owner=self.ziutek, deployment=deployment,
+            status=ResourceStatus.PRIVATE
+        )
+        collection = self.create_collection(
+            owner=self.ziutek, resources=[resource]
+        )
+        self.assertNotIn(
+            location,
+            Location.objects.get_available_materialized(user=self.alice)
+        )
+
+        CollectionMember.objects.create(
+            collection=collection, user=self.alice,
+            level=CollectionMemberLevels.ACCESS_BASIC
+        )
+        self.assertIn(
+            location,
+            Location.objects.get_available_materialized(user=self.alice)
+        )
+        self.assertIn(
+            deployment,
+            Deployment.objects.get_accessible_materialized(user=self.alice)
+        )
+
+        # public resources are accessible for everyone
+        resource.status = ResourceStatus.PUBLIC
+        resource.save()
+        self.assertIn(
+            location,
+            Location.objects.get_available_materialized(
+                user=AnonymousUser()
+            )
+        )
+
+        resource.delete()
+        self.assertNotIn(
+            location,
+            Location.objects.get_available_materialized(
+                user=AnonymousUser()
+            )
+        )
+        self.assertNotIn(
+            deployment,
+            Deployment.objects.get_accessible_materialized(user=self.alice)
+        )
+
+    def test_unrelated_resource_changes(self):
+        """Saving a resource without changing its status, owner or
+        deployment (e.g. when thumbnails are generated) doesn't refresh
+        materialized sets nor invalidate cached data"""
+        deployment = self.create_deployment(owner=self.ziutek)
+        resource = self.create_resource(
+            owner=self.ziutek, deployment=deployment,
+            status=ResourceStatus.PRIVATE
+        )
+        resource = type(resource).objects.get(pk=resource.pk)
+        version = get_accessible_sets_version(self.alice)
+
+        resource.name = u'renamed'
+        with CaptureQueriesContext(connection) as queries:
+            resource.save()
+        self.assertFalse([
+            k for k in queries.captured_queries
+            if 'accessible' in k['sql']
+        ])
+        self.assertEqual(get_accessible_sets_version(self.alice), version)
+
+        resource.status = ResourceStatus.PUBLIC
+        resource.save()
+        self.assertNotEqual(
+            get_accessible_sets_version(self.alice), version
+        )
+        self.assertIn(
+            deployment,
+            Deployment.objects.get_accessible_materialized(
+                user=AnonymousUser()
+            )
+        )
+
+    def test_materialized_set_read_only(self):
+        """Reading materialized sets never writes them and refreshing
+        the same objects again doesn't create duplicates"""
+        location = self.create_location(owner=self.alice, is_public=False)
+        rows = AccessibleLocation.objects.filter(location=location).count()
+        self.assertEqual(rows, 1)
+
+        refresh_accessible_sets(location_pks=[location.pk])
+        self.assertEqual(
+            AccessibleLocation.objects.filter(location=location).count(),
+            rows
+        )
+        with CaptureQueriesContext(connection) as queries:
+            list(Location.objects.get_available_materialized(user=self.alice))
+        self.assertFalse([
+            k for k in queries.captured_queries
+            if not k['sql'].startswith('SELECT')
+        ])
+
+    def test_location_clusters(self):
+        """Locations are clustered on a grid depending on a zoom level"""
+        self.create_location(owner=self.alice, coordinates=Point(x=50, y=50))
+        self.create_location(owner=self.alice, coordinates=Point(x=51, y=50))
+        self.create_location(
+            owner=self.alice, coordinates=Point(x=-100, y=-40)
+        )
+
+        url = reverse(
+            'geomap:api-location-clusters',
+            kwargs={'zoom': 0, 'x': 0, 'y': 0}
+        )
+        response = self.client.get(url)
+        features = json.loads(response.content)['features']
+        counts = sorted(k['properties']['count'] for k in features)
+        self.assertEqual(counts, [1, 2])
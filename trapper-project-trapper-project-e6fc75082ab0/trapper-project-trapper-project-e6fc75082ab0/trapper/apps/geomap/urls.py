@@ -52,6 +52,11 @@ urlpatterns = [
         api_views.LocationGeoViewSet.as_view(),
         name='api-location-geojson'
     ),
+    url(
+        r'^api/locations/clusters/(?P<zoom>\d+)/(?P<x>\d+)/(?P<y>\d+)/$',
+        api_views.LocationClusterView.as_view(),
+        name='api-location-clusters'
+    ),
     url(r'^api/', include(router.urls))
 ]
 
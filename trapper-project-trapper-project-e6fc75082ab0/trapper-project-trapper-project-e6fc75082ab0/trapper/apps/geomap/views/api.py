@@ -13,7 +13,10 @@ from trapper.apps.geomap import serializers as geomap_serializers
 from trapper.apps.geomap.filters import (
     LocationFilter, LocationGeoFilter, DeploymentFilter, MapFilter
 )
-from trapper.apps.geomap.models import Location, Deployment, MapManagerUtils
+from trapper.apps.geomap.models import (
+    Location, Deployment, MapManagerUtils, get_accessible_sets_version
+)
+from trapper.apps.geomap.clusters import ClusterTileViewMixin
 from trapper.apps.common.views_api import (
     PaginatedReadOnlyModelViewSet, PlainTextRenderer
 )
@@ -56,12 +59,26 @@ class LocationGeoViewSet(ListAPIView):
     )
 
     def get_queryset(self):
-        queryset = Location.objects.get_available(
+        queryset = Location.objects.get_available_materialized(
             user=self.request.user
         )
         return queryset
 
 
+class LocationClusterView(ClusterTileViewMixin, LocationGeoViewSet):
+    """Locations from :class:`LocationGeoViewSet` clustered per map tile"""
+    cluster_geo_field = 'coordinates'
+    cluster_cache_prefix = 'location_clusters'
+
+    def get_cluster_scope(self):
+        """Cached tiles are invalidated together with a version of
+        locations accessible for a user"""
+        user = self.request.user
+        return u"{pk}:{version}".format(
+            pk=user.pk, version=get_accessible_sets_version(user)
+        )
+
+
 class DeploymentViewSet(PaginatedReadOnlyModelViewSet):
     queryset = Deployment.objects.all()
     serializer_class = geomap_serializers.DeploymentSerializer
@@ -74,7 +91,7 @@ class DeploymentViewSet(PaginatedReadOnlyModelViewSet):
 
     def get_queryset(self):
         base_queryset = super(DeploymentViewSet, self).get_queryset()
-        queryset = Deployment.objects.get_accessible(
+        queryset = Deployment.objects.get_accessible_materialized(
             base_queryset=base_queryset, user=self.request.user
         ).prefetch_related(
             *self.prefetch_related
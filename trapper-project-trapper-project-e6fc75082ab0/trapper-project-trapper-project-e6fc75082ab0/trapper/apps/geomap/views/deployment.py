@@ -13,13 +13,16 @@ from braces.views import (
     UserPassesTestMixin, JSONResponseMixin
 )
 
-from trapper.apps.geomap.models import Deployment
+from trapper.apps.geomap.models import (
+    Deployment, invalidate_accessible_sets, refresh_accessible_sets
+)
 from trapper.apps.geomap.forms import (
     DeploymentForm, SimpleDeploymentForm, 
     BulkCreateDeploymentForm, BulkUpdateDeploymentForm,
     DeploymentImportForm
 )
 from trapper.apps.geomap.tasks import celery_import_deployments
+from trapper.apps.common.task_args import delay_task
 from trapper.apps.common.views import (
     LoginRequiredMixin, BaseDeleteView, BaseUpdateView, 
     BaseBulkUpdateView
@@ -169,6 +172,19 @@ class DeploymentBulkUpdateView(BaseBulkUpdateView):
     raise_exception = True
     tags_field = 'tags'
 
+    def records_selected(self, records):
+        self.previous_locations = set(
+            records.values_list('location', flat=True)
+        )
+
+    def records_updated(self, records):
+        # bulk updates do not send signals
+        refresh_accessible_sets(
+            location_pks=self.previous_locations,
+            deployment_pks=records.values_list('pk', flat=True)
+        )
+        invalidate_accessible_sets()
+
 
 view_deployment_bulk_update = DeploymentBulkUpdateView.as_view()
 
@@ -222,6 +238,14 @@ class DeploymentBulkCreateView(
                     managers_through_list.append(managers_through_obj)
             managers_through_model.objects.bulk_create(managers_through_list)
 
+        # bulk_create does not send signals
+        refresh_accessible_sets(
+            deployment_pks=Deployment.objects.filter(
+                date_created=timestamp, owner=user
+            ).values_list('pk', flat=True)
+        )
+        invalidate_accessible_sets(users=[user] + list(managers or []))
+
         messages.add_message(
             self.request,
             messages.SUCCESS,
@@ -274,7 +298,7 @@ class DeploymentImportView(LoginRequiredMixin, generic.FormView):
         }
 
         if settings.CELERY_ENABLED:
-            task = celery_import_deployments.delay(**params)
+            task = delay_task(celery_import_deployments, **params)
             user_task = UserTask(
                 user=user,
                 task_id=task.task_id
@@ -16,13 +16,17 @@ from braces.views import (
 )
 from crispy_forms.utils import render_crispy_form
 
-from trapper.apps.geomap.models import Location, MapManagerUtils
+from trapper.apps.geomap.models import (
+    Location, MapManagerUtils, invalidate_accessible_sets,
+    refresh_accessible_sets
+)
 from trapper.apps.storage.models import Collection
 from trapper.apps.geomap.forms import (
     LocationImportForm, LocationFilterForm, CreateLocationForm,
     BulkUpdateLocationForm
 )
 from trapper.apps.geomap.tasks import celery_import_locations
+from trapper.apps.common.task_args import delay_task
 from trapper.apps.common.views import (
     LoginRequiredMixin, BaseDeleteView, BaseBulkUpdateView
 )
@@ -81,7 +85,7 @@ class LocationImportView(LoginRequiredMixin, generic.FormView):
         }
 
         if settings.CELERY_ENABLED:
-            task = celery_import_locations.delay(**params)
+            task = delay_task(celery_import_locations, **params)
             user_task = UserTask(
                 user=user,
                 task_id=task.task_id
@@ -246,5 +250,12 @@ class LocationBulkUpdateView(BaseBulkUpdateView):
     form_class = BulkUpdateLocationForm
     raise_exception = True
 
+    def records_updated(self, records):
+        # bulk updates do not send signals
+        refresh_accessible_sets(
+            location_pks=records.values_list('pk', flat=True)
+        )
+        invalidate_accessible_sets()
+
 
 view_location_bulk_update = LocationBulkUpdateView.as_view()
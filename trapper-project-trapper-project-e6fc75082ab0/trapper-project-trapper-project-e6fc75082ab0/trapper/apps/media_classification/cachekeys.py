@@ -1,7 +1,7 @@
 # -*- coding:utf-8 -*-
 
 
-def get_form_fields_cache_name(classificator):
-    """Cache name used for caching generated classificator form"""
-    base_name = 'classificator:form_fields:{pk}'
-    return base_name.format(pk=classificator.pk)
+def get_schema_cache_name(classificator, version):
+    """Cache name used for caching compiled classificator schema"""
+    base_name = 'classificator:schema:{pk}:{version}'
+    return base_name.format(pk=classificator.pk, version=version)
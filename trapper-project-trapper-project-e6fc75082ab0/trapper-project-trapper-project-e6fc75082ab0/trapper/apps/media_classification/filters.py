@@ -16,6 +16,7 @@ from trapper.apps.media_classification.models import (
 from trapper.apps.media_classification.taxonomy import (
     ClassificationProjectRoleLevels
 )
+from trapper.apps.media_classification.results import ResultsTable
 from trapper.apps.common.filters import (
     BaseFilterSet, BaseOwnBooleanFilter,
     BaseDateFilter, BaseTimeFilter,
@@ -43,10 +44,21 @@ class ClassificationProjectFilter(BaseFilterSet):
 
 
 class HstoreAttrsFilter(django_filters.filters.Filter):
-    """Filter field used for simple filtering of hstore values"""
+    """Filter field used for simple filtering of hstore values. When
+    a results table of a project is given typed values are filtered
+    using this table instead of hstore columns."""
     field_class = forms.CharField
 
+    def __init__(self, results_table=None, *args, **kwargs):
+        self.results_table = results_table
+        super(HstoreAttrsFilter, self).__init__(*args, **kwargs)
+
     def filter(self, qs, value):
+        if (
+            value and self.results_table and
+            self.name in self.results_table.types
+        ):
+            return self.results_table.filter(qs, self.name, value)
         if value:
             return qs.filter(
                 Q(static_attrs__contains={self.name: value}) |
@@ -110,12 +122,20 @@ class ClassificationFilter(BaseFilterSet):
         super(ClassificationFilter, self).__init__(*args, **kwargs)
         project_pk = self.data.get('project', None)
         if project_pk:
-            c = ClassificationProject.objects.get(pk=project_pk).classificator        
+            project = ClassificationProject.objects.get(pk=project_pk)
+            c = project.classificator
             if c:
-                class_attrs = [k for l in c.get_all_attrs_names() for k in l]
+                class_attrs = [
+                    k for l in c.get_schema().get_all_attrs_names() for k in l
+                ]
+                results_table = None
+                if any(self.data.get(a) for a in class_attrs):
+                    results_table = ResultsTable.get(project)
                 for a in class_attrs:
                     if self.data.get(a) and a in class_attrs:
-                        self.filters[a] = HstoreAttrsFilter(name=a)
+                        self.filters[a] = HstoreAttrsFilter(
+                            name=a, results_table=results_table
+                        )
         # set choices for multiple choice filters
         if self.data.get('collection', None):
             self.filters['collection'].field.choices = self.queryset.order_by(
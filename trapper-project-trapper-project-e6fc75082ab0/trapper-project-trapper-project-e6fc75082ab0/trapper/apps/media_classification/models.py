@@ -6,15 +6,10 @@ from __future__ import unicode_literals
 import json
 import operator
 
-from collections import OrderedDict
-
 from django_hstore import hstore
 
-from django.db import models
+from django.db import connection, models
 from django.core.urlresolvers import reverse
-from django import forms
-from django.core.cache import cache
-from django.apps import apps
 from django.db.models.signals import pre_save, post_save, post_delete
 from django.dispatch import receiver
 from django.conf import settings
@@ -31,8 +26,8 @@ from trapper.apps.media_classification.taxonomy import (
     ClassificatorSettings, ClassificationProjectRoleLevels,
     ClassificationProjectStatus, ClassificationStatus
 )
-from trapper.apps.media_classification.cachekeys import (
-    get_form_fields_cache_name
+from trapper.apps.media_classification.schema import (
+    ClassificatorSchema, invalidate_choices
 )
 from trapper.apps.common.fields import SafeTextField
 
@@ -808,13 +803,16 @@ class Classificator(models.Model):
 
     def save(self, **kwargs):
         """Set `created_date` for newly created classificator, and
-        `updated_date` when classificator is changed"""
+        `updated_date` when classificator is changed.
+
+        `updated_date` is a version stamp of a compiled schema of
+        a classificator (see :class:`schema.ClassificatorSchema`), so it is
+        always saved."""
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'updated_date' not in update_fields:
+            kwargs['update_fields'] = list(update_fields) + ['updated_date']
         super(Classificator, self).save(**kwargs)
 
-        # Clear form fields cache
-        cache_name = get_form_fields_cache_name(self)
-        cache.delete(cache_name)
-
     def delete(self, *args, **kwargs):
         """
         If project has at least one classification that has been approved,
@@ -996,99 +994,22 @@ class Classificator(models.Model):
                 parsed_values[k] = v
         return parsed_values
 
+    def get_schema(self):
+        """Return compiled schema of a classificator
+        (see :class:`schema.ClassificatorSchema`)"""
+        return ClassificatorSchema.get(self)
+
     def prepare_form_fields(self):
         """
         Since classificator is a collection of user-defined fields these
         fields are used to generate the classification form. This method is
         responsible for converting a definition of classificator into a structured
         list of form fields.
-        """
-        
-        cache_name = get_form_fields_cache_name(self)
-        form_fields = cache.get(cache_name, settings.CACHE_UNDEFINED)
-
-        if form_fields is settings.CACHE_UNDEFINED:
-            # parsed predefined attributes
-            predefined_attrs = self.parse_hstore_values('predefined_attrs')
-            form_fields = OrderedDict()
-            form_fields['D'] = OrderedDict()  # "D" -> dynamic form
-            form_fields['S'] = OrderedDict()  # "S" -> dynamic form
-            # first prepare predefined attributes:
-            pas = ClassificatorSettings.PREDEFINED_ATTRIBUTES_SIMPLE
-            for key, val in pas.iteritems():
-                if predefined_attrs.get(key):
-                    params = {
-                        'required': predefined_attrs['required_%s' % key]
-                    }
-                    widget = val.get('widget', None)
-                    if widget:
-                        params['widget'] = widget
-
-                    formfield = val['formfield'](**params)
-
-                    # This is required for special rendering annotation widget
-                    form_fields[predefined_attrs[
-                        'target_%s' % key
-                    ]][key] = formfield
-
-            pam = ClassificatorSettings.PREDEFINED_ATTRIBUTES_MODELS
-            for key, val in pam.iteritems():
-                if predefined_attrs.get(key):
-                    model = apps.get_model(pam[key]['app'], key)
-                    selected_key = 'selected_%s' % key
-
-                    if predefined_attrs[selected_key]:
-                        query = model.objects.filter(
-                            pk__in=predefined_attrs[selected_key]
-                        )
-                    else:
-                        query = model.objects.all()
-                    values_key = pam[key]['choices_labels']
-                    choices = query.values_list(values_key, values_key)
-                    choices = [('','---------'),] + list(choices)
-
-                    formfield = forms.ChoiceField(
-                        choices=choices,
-                        required=predefined_attrs['required_%s' % key]
-                    )
-
-                    target_key = predefined_attrs['target_%s' % key]
-                    form_fields[target_key][key] = formfield
-
-            # parsed custom attributes
-            custom_attrs = self.parse_hstore_values('custom_attrs')
-            # next prepare custom attributes:
-            for key in custom_attrs:
-                dynamic_item = custom_attrs[key]
-                values_key = dynamic_item['values']
-                if values_key:
-                    # values have been already checked during a form validation
-                    # so just split them
-                    if not isinstance(values_key, list):
-                        splitted_values = values_key.split(',')
-                    else:
-                        splitted_values = values_key
-                    choices = zip(splitted_values, splitted_values)
-                    formfield = forms.ChoiceField(
-                        choices=choices, required=dynamic_item['required'],
-                        initial=dynamic_item['initial']
-                    )
-                else:
-                    fields_key = dynamic_item['field_type']
-                    formfield = ClassificatorSettings.FIELDS[fields_key](
-                        required=dynamic_item['required'],
-                        initial=dynamic_item['initial'],
-                    )
-                form_fields[dynamic_item['target']][key] = formfield
 
-            # re-order field forms
-            dao = self.get_dynamic_attrs_order()
-            form_fields['D'] = OrderedDict((k, form_fields['D'][k]) for k in dao)
-            sao = self.get_static_attrs_order()
-            form_fields['S'] = OrderedDict((k, form_fields['S'][k]) for k in sao)
-
-            cache.set(cache_name, form_fields, settings.CACHE_TIMEOUT)
-        return form_fields
+        Form fields are built from a compiled schema of a classificator and
+        are shared by all forms of a process until a classificator is changed.
+        """
+        return self.get_schema().form_fields
 
     def remove_custom_attr(self, name, commit=False):
         """Remove given name from custom attributes
@@ -1409,6 +1330,10 @@ class Classification(models.Model):
             self.updated_at = now()
             self.updated_by = user
             self.save()
+            from trapper.apps.media_classification.results import (
+                refresh_results
+            )
+            refresh_results([self.pk])
         else:
             super(Classification, self).save(*args, **kwargs)
 
@@ -1664,6 +1589,24 @@ class ClassificatorHistory(models.Model):
     change_date = models.DateTimeField(auto_now_add=True, editable=False)
 
 
+class ClassificationResultsTable(models.Model):
+    """Registry of typed tables with results of classification projects
+    (see :mod:`trapper.apps.media_classification.results`). `columns`
+    describes attributes of a classificator a table was built with."""
+    TABLE_NAME = 'media_classification_results_{pk}'
+
+    project = models.OneToOneField(
+        ClassificationProject, related_name='results_table'
+    )
+    columns = models.TextField()
+    built_at = models.DateTimeField()
+
+    @classmethod
+    def get_db_table(cls, project_pk):
+        """Return a name of a results table of given project"""
+        return cls.TABLE_NAME.format(pk=project_pk)
+
+
 @receiver(pre_save, sender=ClassificationProject)
 def classificator_history(sender, **kwargs):
     """
@@ -1779,3 +1722,55 @@ def project_collections_access_revoke(sender, instance, **kwargs):
 def project_collection_rebuild_(sender, instance, **kwargs):
     instance.rebuild_classifications()
 
+
+@receiver(post_save, sender=Classificator)
+def classificator_results_tables_rebuild(sender, instance, **kwargs):
+    """
+    Signal used to rebuild results tables of projects when attributes of
+    their classificator change
+    """
+    from trapper.apps.media_classification.results import (
+        rebuild_outdated_results_tables
+    )
+    rebuild_outdated_results_tables(
+        ClassificationProject.objects.filter(classificator=instance)
+    )
+
+
+@receiver(post_save, sender=ClassificationProject)
+def project_results_table_rebuild(sender, instance, created, **kwargs):
+    """
+    Signal used to rebuild a results table of a project when its
+    classificator is changed or removed
+    """
+    if created:
+        return
+    from trapper.apps.media_classification.results import (
+        rebuild_outdated_results_tables
+    )
+    rebuild_outdated_results_tables([instance])
+
+
+# models listed in `ClassificatorSettings.PREDEFINED_ATTRIBUTES_MODELS`
+@receiver(post_save, sender='extra_tables.Species')
+@receiver(post_delete, sender='extra_tables.Species')
+def schema_choices_invalidate(sender, **kwargs):
+    """
+    Signal used to invalidate compiled schemas of classificators when
+    choices of their predefined attributes are changed
+    """
+    invalidate_choices()
+
+
+@receiver(post_delete, sender=ClassificationResultsTable)
+def results_table_drop(sender, instance, **kwargs):
+    """
+    Signal used to drop a results table when it is removed from a registry
+    (e.g. together with its classification project)
+    """
+    with connection.cursor() as cursor:
+        cursor.execute('DROP TABLE IF EXISTS {table}'.format(
+            table=connection.ops.quote_name(
+                sender.get_db_table(instance.project_id)
+            )
+        ))
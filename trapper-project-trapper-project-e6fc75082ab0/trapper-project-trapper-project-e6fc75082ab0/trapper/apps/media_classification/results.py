@@ -0,0 +1,383 @@
+# -*- coding: utf-8 -*-
+"""
+Typed read model of classification results.
+
+Results of classifications are stored in hstore columns
+(`Classification.static_attrs` and `ClassificationDynamicAttrs.attrs`),
+so every value is a string that has to be parsed again by each export,
+aggregation or filter. When `settings.CLASSIFICATION_RESULTS_TABLES` is
+True, results of approved classifications of a project are projected into
+a separate table (see :class:`ResultsTable`) with a typed column per
+attribute of a project's classificator and one row per dynamic attributes
+row (or a single row for classifications without dynamic attributes).
+Attributes listed in `settings.CLASSIFICATION_RESULTS_INDEXED_ATTRS` are
+indexed. Names of attributes are arbitrary texts defined by owners of
+classificators, so they are never used in SQL: columns get generated names
+(`a0`, `a1`, ...) and attributes are mapped to them by a signature of
+a table.
+
+Tables are built when classifications of a project are approved for the
+first time and rebuilt when attributes of a classificator change (see
+:func:`rebuild_results_tables`); with celery enabled it is done by
+a celery task. Rows of classifications that are approved or cleared are
+refreshed with :func:`refresh_results`. Until a table is ready, results
+are read from hstore columns, so tables are never built by requests that
+only read results.
+"""
+from __future__ import unicode_literals
+
+import json
+
+import pandas
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils.timezone import now
+
+from trapper.apps.media_classification.models import (
+    Classification, ClassificationDynamicAttrs, ClassificationProject,
+    ClassificationResultsTable
+)
+from trapper.apps.media_classification.taxonomy import ClassificatorSettings
+
+COLUMN_TYPES = {
+    ClassificatorSettings.FIELD_BOOLEAN: 'boolean',
+    ClassificatorSettings.FIELD_INTEGER: 'bigint',
+    ClassificatorSettings.FIELD_FLOAT: 'double precision',
+    ClassificatorSettings.FIELD_STRING: 'text',
+}
+
+# SQL expressions casting hstore values (strings) to types of columns;
+# values that cannot be casted are stored as NULLs
+SQL_CASTS = {
+    'boolean': (
+        "CASE WHEN lower({value}) IN ('true', 't', '1') THEN true "
+        "WHEN lower({value}) IN ('false', 'f', '0') THEN false END"
+    ),
+    'bigint': (
+        r"CASE WHEN {value} ~ '^\s*[-+]?[0-9]{{1,18}}\s*$' "
+        r"THEN trim({value})::bigint END"
+    ),
+    'double precision': (
+        r"CASE WHEN {value} ~ "
+        r"'^\s*[-+]?([0-9]+\.?[0-9]*|\.[0-9]+)([eE][-+]?[0-9]+)?\s*$' "
+        r"THEN trim({value})::double precision END"
+    ),
+    'text': "NULLIF({value}, '')",
+}
+
+
+def _parse_boolean(value):
+    value = value.strip().lower()
+    if value in ('true', 't', '1'):
+        return True
+    if value in ('false', 'f', '0'):
+        return False
+    raise ValueError(value)
+
+
+# columns of every results table; attributes with these names are not
+# projected into tables (results are read from hstore columns instead)
+RESERVED_COLUMNS = ('classification_id', 'dynamic_attrs_id')
+
+# functions casting values of filters to types of columns
+PYTHON_CASTS = {
+    'boolean': _parse_boolean,
+    'bigint': int,
+    'double precision': float,
+    'text': unicode,
+}
+
+
+def get_results_columns(classificator):
+    """Return a list of `(attribute, target, column type, column)` tuples
+    describing columns of a results table of given classificator; static
+    attributes go first, in the order used by a classificator. Columns
+    have generated names, so names of attributes are never used in SQL."""
+    schema = classificator.get_schema()
+    columns = []
+    for target in (
+        ClassificatorSettings.TARGET_STATIC,
+        ClassificatorSettings.TARGET_DYNAMIC
+    ):
+        for name in schema.get_attrs_order(target):
+            field_type = schema.attrs[name]['field_type']
+            columns.append((
+                name, target, COLUMN_TYPES.get(field_type, 'text'),
+                'a{i}'.format(i=len(columns))
+            ))
+    return columns
+
+
+class ResultsTable(object):
+    """Typed table with results of approved classifications of a single
+    classification project"""
+
+    def __init__(self, project):
+        self.project = project
+        self.db_table = ClassificationResultsTable.get_db_table(project.pk)
+        self.columns = get_results_columns(project.classificator)
+        self.types = dict((k[0], k[2]) for k in self.columns)
+        self.db_columns = dict((k[0], k[3]) for k in self.columns)
+        self.signature = json.dumps(self.columns)
+
+    @classmethod
+    def get(cls, project):
+        """Return an up to date results table of given project or None
+        if results tables are disabled, a project has no classificator or
+        its table is not built yet (or is outdated)"""
+        if (
+            not settings.CLASSIFICATION_RESULTS_TABLES or
+            project is None or not project.classificator_id
+        ):
+            return None
+        table = cls(project)
+        if any(k in table.types for k in RESERVED_COLUMNS):
+            return None
+        built = ClassificationResultsTable.objects.filter(
+            project=project
+        ).values_list('columns', flat=True).first()
+        if built != table.signature:
+            return None
+        return table
+
+    def _select_sql(self, classification_pks=None):
+        """Return SQL (and its params) selecting rows of a table for
+        approved classifications of a project (optionally only for
+        classifications with given primary keys)"""
+        qn = connection.ops.quote_name
+        sources = {
+            ClassificatorSettings.TARGET_STATIC: 'C.{field}'.format(
+                field=qn(Classification._meta.get_field('static_attrs').column)
+            ),
+            ClassificatorSettings.TARGET_DYNAMIC: 'D.{field}'.format(
+                field=qn(
+                    ClassificationDynamicAttrs._meta.get_field('attrs').column
+                )
+            ),
+        }
+        values = []
+        params = []
+        for name, target, column_type, column in self.columns:
+            value = SQL_CASTS[column_type].format(
+                value='({source} -> %s)'.format(source=sources[target])
+            )
+            values.append(value)
+            params.extend([name] * value.count('%s'))
+        sql = (
+            'SELECT C.{pk}, D.{pk}{values} FROM {classification} C '
+            'LEFT OUTER JOIN {dynamic_attrs} D ON D.{classification_fk} = C.{pk} '
+            'WHERE C.{project_fk} = %s AND C.{status}'
+        ).format(
+            pk=qn('id'),
+            values=''.join(', ' + k for k in values),
+            classification=qn(Classification._meta.db_table),
+            dynamic_attrs=qn(ClassificationDynamicAttrs._meta.db_table),
+            classification_fk=qn(
+                ClassificationDynamicAttrs._meta.get_field(
+                    'classification'
+                ).column
+            ),
+            project_fk=qn(Classification._meta.get_field('project').column),
+            status=qn(Classification._meta.get_field('status').column),
+        )
+        params.append(self.project.pk)
+        if classification_pks is not None:
+            sql += ' AND C.{pk} = ANY(%s)'.format(pk=qn('id'))
+            params.append(list(classification_pks))
+        return sql, params
+
+    def _insert(self, cursor, classification_pks=None):
+        qn = connection.ops.quote_name
+        sql, params = self._select_sql(classification_pks)
+        cursor.execute(
+            'INSERT INTO {table} (classification_id, dynamic_attrs_id'
+            '{columns}) {sql}'.format(
+                table=qn(self.db_table),
+                columns=''.join(', ' + qn(k[3]) for k in self.columns),
+                sql=sql
+            ),
+            params
+        )
+
+    def build(self):
+        """(Re)create a table with results of all approved classifications
+        of a project"""
+        qn = connection.ops.quote_name
+        table = qn(self.db_table)
+        with transaction.atomic(), connection.cursor() as cursor:
+            # concurrent builds of the same table are serialized
+            list(ClassificationProject.objects.select_for_update().filter(
+                pk=self.project.pk
+            ).values_list('pk', flat=True))
+            cursor.execute('DROP TABLE IF EXISTS {table}'.format(table=table))
+            cursor.execute(
+                'CREATE TABLE {table} (classification_id integer NOT NULL, '
+                'dynamic_attrs_id integer{columns})'.format(
+                    table=table,
+                    columns=''.join(
+                        ', {name} {type}'.format(name=qn(k[3]), type=k[2])
+                        for k in self.columns
+                    )
+                )
+            )
+            self._insert(cursor)
+            indexed = ['classification_id'] + [
+                k[3] for k in self.columns
+                if k[0] in settings.CLASSIFICATION_RESULTS_INDEXED_ATTRS
+            ]
+            for i, name in enumerate(indexed):
+                cursor.execute(
+                    'CREATE INDEX {index} ON {table} ({column})'.format(
+                        index=qn('{table}_{i}'.format(
+                            table=self.db_table, i=i
+                        )),
+                        table=table,
+                        column=qn(name)
+                    )
+                )
+            ClassificationResultsTable.objects.update_or_create(
+                project=self.project,
+                defaults={'columns': self.signature, 'built_at': now()}
+            )
+
+    def refresh(self, classification_pks):
+        """Replace rows of given classifications with their current
+        results"""
+        classification_pks = list(classification_pks)
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                'DELETE FROM {table} WHERE classification_id = ANY(%s)'.format(
+                    table=connection.ops.quote_name(self.db_table)
+                ),
+                [classification_pks]
+            )
+            self._insert(cursor, classification_pks)
+
+    def read(self, queryset=None):
+        """Return a data frame with results of classifications selected by
+        given queryset (by default of all classifications of a project).
+        Columns are typed; missing values of integer columns are None."""
+        qn = connection.ops.quote_name
+        sql = 'SELECT * FROM {table}'.format(table=qn(self.db_table))
+        params = []
+        if queryset is not None:
+            subquery, params = queryset.order_by().values(
+                'pk'
+            ).query.sql_with_params()
+            sql += ' WHERE classification_id IN ({subquery})'.format(
+                subquery=subquery
+            )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            names = dict((k[3], k[0]) for k in self.columns)
+            columns = [names.get(k[0], k[0]) for k in cursor.description]
+            df = pandas.DataFrame.from_records(
+                cursor.fetchall(), columns=columns
+            )
+        for name, column_type in self.types.items():
+            if column_type == 'bigint':
+                # keep integers as integers (instead of floats) when some
+                # values are missing
+                df[name] = pandas.Series(
+                    [None if pandas.isnull(k) else int(k) for k in df[name]],
+                    index=df.index, dtype=object
+                )
+        return df
+
+    def filter(self, queryset, name, value):
+        """Limit a queryset of classifications to the ones with given
+        value of an attribute"""
+        try:
+            value = PYTHON_CASTS[self.types[name]](value)
+        except (KeyError, ValueError):
+            return queryset.none()
+        qn = connection.ops.quote_name
+        return queryset.extra(
+            where=[
+                '{classification}.{pk} IN (SELECT classification_id '
+                'FROM {table} WHERE {column} = %s)'.format(
+                    classification=qn(Classification._meta.db_table),
+                    pk=qn('id'),
+                    table=qn(self.db_table),
+                    column=qn(self.db_columns[name])
+                )
+            ],
+            params=[value]
+        )
+
+
+def build_results_tables(project_pks):
+    """(Re)build results tables of given projects"""
+    for project in ClassificationProject.objects.filter(
+        pk__in=list(project_pks), classificator__isnull=False
+    ).select_related('classificator'):
+        ResultsTable(project).build()
+
+
+def rebuild_results_tables(project_pks):
+    """(Re)build results tables of given projects. When celery is enabled
+    tables are built by a celery task after the current transaction is
+    committed."""
+    project_pks = list(project_pks)
+    if not settings.CLASSIFICATION_RESULTS_TABLES or not project_pks:
+        return
+    if settings.CELERY_ENABLED:
+        from trapper.apps.media_classification.tasks import (
+            celery_build_results_tables
+        )
+        transaction.on_commit(
+            lambda: celery_build_results_tables.apply_async(
+                kwargs={'project_pks': project_pks},
+                priority=settings.CELERY_BULK_TASK_PRIORITY
+            )
+        )
+        return
+    build_results_tables(project_pks)
+
+
+def rebuild_outdated_results_tables(projects):
+    """Rebuild existing results tables of given projects that were built
+    with other attributes of a classificator; tables of projects without
+    a classificator are removed"""
+    if not settings.CLASSIFICATION_RESULTS_TABLES:
+        return
+    outdated = []
+    for built in ClassificationResultsTable.objects.filter(
+        project__in=projects
+    ).select_related('project__classificator'):
+        if not built.project.classificator_id:
+            built.delete()
+        elif built.columns != ResultsTable(built.project).signature:
+            outdated.append(built.project_id)
+    rebuild_results_tables(outdated)
+
+
+def refresh_results(classification_pks):
+    """Refresh rows of given classifications in results tables of their
+    projects. Tables that are not built yet or are outdated are (re)built
+    (see :func:`rebuild_results_tables`)."""
+    if not settings.CLASSIFICATION_RESULTS_TABLES:
+        return
+    projects = {}
+    for project_pk, pk in Classification.objects.filter(
+        pk__in=list(classification_pks)
+    ).values_list('project_id', 'pk'):
+        projects.setdefault(project_pk, []).append(pk)
+    if not projects:
+        return
+    built = dict(
+        ClassificationResultsTable.objects.filter(
+            project__in=projects.keys()
+        ).values_list('project_id', 'columns')
+    )
+    rebuild = []
+    for project in ClassificationProject.objects.filter(
+        pk__in=projects.keys(), classificator__isnull=False
+    ).select_related('classificator'):
+        table = ResultsTable(project)
+        if built.get(project.pk) == table.signature:
+            table.refresh(projects[project.pk])
+        else:
+            rebuild.append(project.pk)
+    rebuild_results_tables(rebuild)
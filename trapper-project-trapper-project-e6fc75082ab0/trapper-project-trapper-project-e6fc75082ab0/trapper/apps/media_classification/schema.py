@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+"""
+Compiled schemas of classificators.
+
+Definition of a classificator is stored in hstore fields
+(`Classificator.custom_attrs` and `Classificator.predefined_attrs`) as
+JSON strings that used to be parsed again by each form, filter, importer
+or exporter. :func:`compile_schema` converts it once into a serializable
+description of attributes (their targets, types, choices and validators)
+and attributes orders.
+
+Compiled schemas are stored in a shared cache under a key containing a
+version of a classificator (see :func:`get_schema_version`) which is
+bumped by every `Classificator.save` and every change of models that
+provide choices of predefined attributes (e.g. species), so outdated
+schemas are never used and don't have to be deleted. Each process
+additionally keeps the latest schema of every classificator together with
+Django form fields built from it (see :meth:`ClassificatorSchema.get`).
+
+:meth:`ClassificatorSchema.validate` validates rows of imported
+classifications with form fields of a schema, without instantiating
+a form for every row.
+"""
+from __future__ import unicode_literals
+
+import json
+import uuid
+from collections import OrderedDict
+
+from django import forms
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.forms.utils import ErrorDict, ErrorList
+
+from trapper.apps.media_classification.cachekeys import get_schema_cache_name
+from trapper.apps.media_classification.taxonomy import ClassificatorSettings
+
+# schemas compiled or loaded by this process; {classificator pk: schema}
+_schemas = {}
+
+SCHEMA_CHOICES_VERSION_KEY = 'classificator:schema:choices'
+
+
+def get_choices_version():
+    """Return a version token of models that provide choices of predefined
+    attributes. A token expires after `settings.CACHE_TIMEOUT`, so changes
+    made without signals (e.g. with `QuerySet.update`) are visible at most
+    after that time"""
+    version = cache.get(SCHEMA_CHOICES_VERSION_KEY)
+    if version is None:
+        cache.add(
+            SCHEMA_CHOICES_VERSION_KEY, uuid.uuid4().hex,
+            settings.CACHE_TIMEOUT
+        )
+        version = cache.get(SCHEMA_CHOICES_VERSION_KEY) or ''
+    return version
+
+
+def invalidate_choices():
+    """Change a version of choices of predefined attributes, so schemas
+    of all classificators are compiled again"""
+    cache.set(
+        SCHEMA_CHOICES_VERSION_KEY, uuid.uuid4().hex, settings.CACHE_TIMEOUT
+    )
+
+
+def get_schema_version(classificator):
+    """Return a version stamp of given classificator; it is changed every
+    time a classificator is saved or choices of predefined attributes
+    are changed"""
+    return '{pk}.{stamp}.{choices}'.format(
+        pk=classificator.pk,
+        stamp=classificator.updated_date.strftime('%Y%m%d%H%M%S%f'),
+        choices=get_choices_version()
+    )
+
+
+def _split_values(values):
+    # values have been already checked during a form validation
+    # so just split them
+    if not isinstance(values, list):
+        values = values.split(',')
+    return values
+
+
+def compile_schema(classificator):
+    """Return a serializable description of attributes of given
+    classificator"""
+    predefined_attrs = classificator.parse_hstore_values('predefined_attrs')
+    custom_attrs = classificator.parse_hstore_values('custom_attrs')
+    attrs = {}
+
+    # first prepare predefined attributes:
+    for name in ClassificatorSettings.PREDEFINED_ATTRIBUTES_SIMPLE:
+        if predefined_attrs.get(name):
+            attrs[name] = {
+                'predefined': True,
+                'target': predefined_attrs['target_%s' % name],
+                'required': predefined_attrs['required_%s' % name],
+                'field_type': None,
+                'initial': None,
+                'choices': None,
+            }
+
+    pam = ClassificatorSettings.PREDEFINED_ATTRIBUTES_MODELS
+    for name, params in pam.iteritems():
+        if predefined_attrs.get(name):
+            model = apps.get_model(params['app'], name)
+            selected = predefined_attrs['selected_%s' % name]
+            query = model.objects.all()
+            if selected:
+                query = query.filter(pk__in=selected)
+            attrs[name] = {
+                'predefined': True,
+                'target': predefined_attrs['target_%s' % name],
+                'required': predefined_attrs['required_%s' % name],
+                'field_type': ClassificatorSettings.FIELD_STRING,
+                'initial': None,
+                'choices': list(
+                    query.values_list(params['choices_labels'], flat=True)
+                ),
+            }
+
+    # next prepare custom attributes:
+    for name, params in custom_attrs.items():
+        attrs[name] = {
+            'predefined': False,
+            'target': params['target'],
+            'required': params['required'],
+            'field_type': params['field_type'],
+            'initial': params['initial'],
+            'choices': (
+                _split_values(params['values']) if params['values'] else None
+            ),
+            'description': params.get('description'),
+        }
+
+    return {
+        'version': get_schema_version(classificator),
+        'template': classificator.template,
+        'attrs': attrs,
+        'order': {
+            ClassificatorSettings.TARGET_STATIC: [
+                k for k in classificator.get_static_attrs_order()
+                if k in attrs
+            ],
+            ClassificatorSettings.TARGET_DYNAMIC: [
+                k for k in classificator.get_dynamic_attrs_order()
+                if k in attrs
+            ],
+        },
+    }
+
+
+def build_form_field(name, attr):
+    """Return a Django form field of an attribute of a compiled schema"""
+    if attr['predefined']:
+        simple = ClassificatorSettings.PREDEFINED_ATTRIBUTES_SIMPLE
+        if name in simple:
+            params = {'required': attr['required']}
+            widget = simple[name].get('widget', None)
+            if widget:
+                params['widget'] = widget
+            return simple[name]['formfield'](**params)
+        return forms.ChoiceField(
+            choices=[('', '---------')] + zip(attr['choices'], attr['choices']),
+            required=attr['required']
+        )
+    if attr['choices']:
+        return forms.ChoiceField(
+            choices=zip(attr['choices'], attr['choices']),
+            required=attr['required'],
+            initial=attr['initial']
+        )
+    return ClassificatorSettings.FIELDS[attr['field_type']](
+        required=attr['required'], initial=attr['initial']
+    )
+
+
+class ClassificatorSchema(object):
+    """Compiled schema of a classificator (see :func:`compile_schema`)"""
+
+    def __init__(self, data):
+        self.data = data
+        self.version = data['version']
+        self.attrs = data['attrs']
+        self._form_fields = None
+
+    @classmethod
+    def get(cls, classificator):
+        """Return an up to date schema of given classificator"""
+        version = get_schema_version(classificator)
+        schema = _schemas.get(classificator.pk)
+        if schema is None or schema.version != version:
+            cache_name = get_schema_cache_name(classificator, version)
+            data = cache.get(cache_name)
+            if data is None:
+                data = json.dumps(compile_schema(classificator))
+                cache.set(cache_name, data, settings.CACHE_TIMEOUT)
+            schema = cls(json.loads(data))
+            _schemas[classificator.pk] = schema
+        return schema
+
+    def get_attrs_order(self, target):
+        """Return names of attributes with given target, in order"""
+        return list(self.data['order'][target])
+
+    def get_all_attrs_names(self):
+        """Return names of dynamic and static attributes (in the same
+        format as `Classificator.get_all_attrs_names`)"""
+        all_items = [[], []]  # [[dynamic_form], [static_form]]
+        for name, attr in sorted(self.attrs.items()):
+            if attr['target'] == ClassificatorSettings.TARGET_DYNAMIC:
+                all_items[0].append(name)
+            else:
+                all_items[1].append(name)
+        return all_items
+
+    @property
+    def form_fields(self):
+        """Form fields of dynamic ("D") and static ("S") attributes;
+        fields are built once and are deep-copied by forms that use
+        them"""
+        if self._form_fields is None:
+            form_fields = OrderedDict()
+            for target in (
+                ClassificatorSettings.TARGET_DYNAMIC,
+                ClassificatorSettings.TARGET_STATIC
+            ):
+                form_fields[target] = OrderedDict(
+                    (k, build_form_field(k, self.attrs[k]))
+                    for k in self.data['order'][target]
+                )
+            self._form_fields = form_fields
+        return self._form_fields
+
+    def validate(self, target, data):
+        """Validate a row of attributes with given target the same way
+        a :class:`forms.ClassificationForm` would do and return a tuple
+        `(cleaned data, errors)`; errors are empty when a row is valid"""
+        cleaned_data = {}
+        errors = ErrorDict()
+        for name, field in self.form_fields[target].items():
+            value = field.widget.value_from_datadict(data, {}, name)
+            try:
+                cleaned_data[name] = field.clean(value)
+            except ValidationError as e:
+                errors[name] = ErrorList(e.error_list)
+        return cleaned_data, errors
@@ -18,13 +18,15 @@ from django.utils.timezone import now
 from django.core.exceptions import ValidationError
 from django.conf import settings
 
-from trapper.apps.media_classification.forms import ClassificationForm
 from trapper.apps.media_classification.models import (
     Classification, UserClassification,
     ClassificationDynamicAttrs, UserClassificationDynamicAttrs,
     Sequence, SequenceResourceM2M
 )
 from trapper.apps.media_classification.views.api import prepare_results_table
+from trapper.apps.media_classification.results import (
+    refresh_results, build_results_tables
+)
 from trapper.apps.geomap.models import Deployment
 from trapper.apps.geomap.serializers import DeploymentTableSerializer
 from trapper.apps.common.tools import datetime_aware
@@ -32,6 +34,8 @@ from trapper.apps.accounts.utils import (
     get_external_data_packages_path, create_external_media
 )
 from trapper.apps.accounts.models import UserDataPackage
+from trapper.apps.accounts.task_metrics import task_phase, task_progress
+from trapper.apps.common.task_args import rehydrate
 from trapper.apps.accounts.taxonomy import PackageType, ExternalStorageSettings
 from trapper.apps.media_classification.eml.eml_conts import EMLSetup
 from trapper.apps.media_classification.eml.eml_generator import EMLGenerator
@@ -44,9 +48,9 @@ class ClassificationImporter():
         self.user = user
         self.timestamp = now()
         self.project = data.get('project')
-        self.static_attrs = self.project.classificator.get_static_attrs_order()
-        self.dynamic_attrs = self.project.classificator.get_dynamic_attrs_order()
-        self.form_fields = self.project.classificator.prepare_form_fields()
+        self.schema = self.project.classificator.get_schema()
+        self.static_attrs = self.schema.get_attrs_order('S')
+        self.dynamic_attrs = self.schema.get_attrs_order('D')
         self.results_df = data.get('results_df', None)
         self.dynamic_df = self.results_df[['id']+self.dynamic_attrs]
         self.dynamic_df = self.dynamic_df.dropna()
@@ -77,7 +81,9 @@ class ClassificationImporter():
         cleaned_dynamic_rows = {}
         exclude_classification_pks = []
 
+        task_phase('validate')
         for i in range(0, len(self.static_df)):
+            task_progress(i, self.total)
             dynamic_loop_broke = False
             try:
                 classification_id = int(self.static_df.iloc[i]['id'])
@@ -96,15 +102,12 @@ class ClassificationImporter():
 
             if self.static_attrs and self.static_df is not None:
 
-                static_form = ClassificationForm(
-                    fields_defs=self.form_fields['S'],
-                    attrs_order=self.static_attrs,
-                    readonly=False,
-                    data=static_data.to_dict()
+                static_cleaned_data, errors = self.schema.validate(
+                    'S', static_data.to_dict()
                 )
 
-                if not static_form.is_valid():
-                    msg = str(static_form.errors)
+                if errors:
+                    msg = str(errors)
                     self.add_error_msg(classification_id, msg)
                     exclude_classification_pks.append(classification_id)
                     continue
@@ -119,21 +122,18 @@ class ClassificationImporter():
                     for j in range(0, len(dynamic_df_rows)):
                         dynamic_data_row = dynamic_df_rows.iloc[j][self.dynamic_attrs]
 
-                        dynamic_form = ClassificationForm(
-                            fields_defs=self.form_fields['D'],
-                            attrs_order=self.dynamic_attrs,
-                            readonly=False,
-                            data=dynamic_data_row.to_dict()
+                        dynamic_cleaned_data, errors = self.schema.validate(
+                            'D', dynamic_data_row.to_dict()
                         )
-                        if not dynamic_form.is_valid():
+                        if errors:
                             dynamic_loop_broke = True
-                            msg = str(dynamic_form.errors)
+                            msg = str(errors)
                             self.add_error_msg(classification_id, msg)
                             exclude_classification_pks.append(classification_id)
                             break
 
                         cleaned_dynamic_rows[classification_id].append(
-                            dynamic_form.cleaned_data
+                            dynamic_cleaned_data
                         )
 
             # executes the following block if there is no break in the inner loop
@@ -149,15 +149,18 @@ class ClassificationImporter():
                 updated_at=self.timestamp,
             )
             if self.static_attrs:
-                user_classification.static_attrs = static_form.cleaned_data
+                user_classification.static_attrs = static_cleaned_data
                 user_classifications.append(user_classification)
 
             self.imported += 1
 
+        task_phase('write')
+        task_progress(self.total, self.total)
         # exclude invalid data
         classifications = classifications.exclude(pk__in=exclude_classification_pks)
+        classification_pks = list(classifications.values_list('pk', flat=True))
 
-        if classifications:
+        if classification_pks:
             # bulk delete UserClassification objects
             UserClassification.objects.filter(
                 classification__in=classifications, owner=self.user
@@ -221,6 +224,7 @@ class ClassificationImporter():
                 bulk_update(classifications, update_fields=[
                     'approved_source_id', 'static_attrs'
                 ])
+            refresh_results(classification_pks)
 
         if self.imported == 0:
 
@@ -255,6 +259,7 @@ class ClassificationImporter():
         return log
 
 @shared_task
+@rehydrate
 def celery_import_classifications(data, user):
     """
     Celery task that imports classifications from csv files into given
@@ -338,6 +343,7 @@ class SequencesBuilder():
         dep_aggr = self.data.get('deployments')
         cp_collections = self.data.get('project_collections')
         self.total = len(cp_collections)
+        task_progress(0, self.total)
         for cp_collection in cp_collections:
             overwrite = self.data.get('overwrite')
             if overwrite:
@@ -353,6 +359,7 @@ class SequencesBuilder():
                 groups = self.group_resources(resources, delta)
                 self.create_sequences(cp_collection, groups)
             self.processed_collections += 1
+            task_progress(self.processed_collections, self.total)
 
         if self.processed_collections == 0:
             self.log.insert(0,
@@ -379,6 +386,19 @@ class SequencesBuilder():
 
 
 @shared_task
+def celery_build_results_tables(project_pks):
+    """
+    Celery task that (re)builds typed tables with results of given
+    classification projects (see
+    :mod:`trapper.apps.media_classification.results`)
+
+    :param project_pks: list of ClassificationProject primary keys
+    """
+    build_results_tables(project_pks)
+
+
+@shared_task
+@rehydrate
 def celery_build_sequences(data, user):
     """
     Celery task to automatically build sequences of resources.
@@ -400,6 +420,9 @@ class TagsCreator():
         classifications = self.data.get('classifications', None)
         tag_keys = self.data.get('tag_keys', None)
 
+        classifications = classifications.select_related(
+            'resource'
+        ).prefetch_related('dynamic_attrs')
         for classification in classifications:
             resource = classification.resource
             classification_tags = []
@@ -430,6 +453,7 @@ class TagsCreator():
 
 
 @shared_task
+@rehydrate
 def celery_create_tags(data, user):
     """
     Celery task to automatically create tags for selected resources
@@ -492,7 +516,8 @@ class ResultsDataPackageGenerator():
         prepare_results_table(
             self.classifications,
             output_filepath,
-            self.project.classificator
+            self.project.classificator,
+            project=self.project
         )
 
     def get_deployments_table(self):
@@ -515,12 +540,16 @@ class ResultsDataPackageGenerator():
         eml.save_as_xml()
 
     def run(self):
+        task_phase('results_table')
         self.get_results_table()
         if self.data.get('deployments'):
+            task_phase('deployments_table')
             self.get_deployments_table()
         if self.data.get('eml_file'):
+            task_phase('eml')
             self.generate_eml()
 
+        task_phase('archive')
         with zipfile.ZipFile(self.package_path, 'w') as zipf:
             for filename in os.listdir(self.tmp_path):
                 filepath = os.path.join(self.tmp_path, filename)
@@ -551,6 +580,7 @@ class ResultsDataPackageGenerator():
 
 
 @shared_task
+@rehydrate
 def celery_results_to_data_package(data, user, project):
     """
     Celery task that create a data package (archive) containing the
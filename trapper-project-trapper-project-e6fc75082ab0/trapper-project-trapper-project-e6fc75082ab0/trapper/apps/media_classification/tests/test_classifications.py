@@ -3,14 +3,21 @@
 import json
 
 from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 
 from trapper.apps.common.utils.test_tools import (
     ExtendedTestCase, ResearchProjectTestMixin, SequenceTestMixin,
     ClassificationProjectTestMixin, CollectionTestMixin,
-    ClassificationTestMixin
+    ClassificationTestMixin, ClassificatorTestMixin
 )
 
-from trapper.apps.media_classification.models import Classification
+from trapper.apps.media_classification.models import (
+    Classification, ClassificationDynamicAttrs, ClassificationResultsTable
+)
+from trapper.apps.media_classification.results import (
+    ResultsTable, refresh_results
+)
 
 from trapper.apps.media_classification.taxonomy import (
     ClassificationProjectRoleLevels, ClassificationStatus
@@ -643,3 +650,149 @@ class ClassificationTestCase(BaseClassificationTestCase):
                 name=self.classification.static_attrs[tag_name]
             ).exists()
         )
+
+
+class ResultsTableTestCase(BaseClassificationTestCase, ClassificatorTestMixin):
+    """Typed read model of classification results"""
+
+    def setUp(self):
+        super(ResultsTableTestCase, self).setUp()
+        self.classificator = self.create_classificator(
+            owner=self.alice,
+            custom_attrs={
+                u'species': (
+                    u'{"initial": "", "target": "S", "required": false, '
+                    u'"values": "", "field_type": "S"}'
+                ),
+                u'count': (
+                    u'{"initial": "", "target": "D", "required": false, '
+                    u'"values": "", "field_type": "I"}'
+                ),
+            },
+            static_attrs_order=u'species',
+            dynamic_attrs_order=u'count'
+        )
+        resources = [
+            self.create_resource(owner=self.alice) for i in range(2)
+        ]
+        collection = self.create_collection(
+            owner=self.alice, resources=resources
+        )
+        research_project = self.create_research_project(owner=self.alice)
+        research_collection = self.create_research_project_collection(
+            project=research_project, collection=collection
+        )
+        self.project = self.create_classification_project(
+            owner=self.alice, research_project=research_project,
+            classificator=self.classificator
+        )
+        project_collection = self.create_classification_project_collection(
+            project=self.project, collection=research_collection
+        )
+        self.approved, user_classification = self.create_classification(
+            resource=resources[0], collection=project_collection,
+            project=self.project, owner=self.alice,
+            status=ClassificationStatus.APPROVED
+        )
+        self.approved.static_attrs = {u'species': u'Lynx'}
+        self.approved.save()
+        for count in (u'2', u'x'):
+            ClassificationDynamicAttrs.objects.create(
+                classification=self.approved, attrs={u'count': count}
+            )
+        self.pending, user_classification = self.create_classification(
+            resource=resources[1], collection=project_collection,
+            project=self.project, owner=self.alice
+        )
+
+    def test_build(self):
+        """Tables are built when results are refreshed, never when they
+        are read"""
+        with CaptureQueriesContext(connection) as queries:
+            self.assertIsNone(ResultsTable.get(self.project))
+        self.assertFalse([
+            k for k in queries.captured_queries
+            if 'CREATE' in k['sql'] or 'DROP' in k['sql']
+        ])
+        self.assertFalse(
+            ClassificationResultsTable.objects.filter(
+                project=self.project
+            ).exists()
+        )
+        refresh_results([self.approved.pk])
+        self.assertIsNotNone(ResultsTable.get(self.project))
+
+    def test_read(self):
+        """Results of approved classifications are typed; values that
+        cannot be casted are missing"""
+        refresh_results([self.approved.pk])
+        table = ResultsTable.get(self.project)
+        self.assertTrue(
+            ClassificationResultsTable.objects.filter(
+                project=self.project
+            ).exists()
+        )
+        df = table.read()
+        self.assertEqual(list(df.classification_id), [self.approved.pk] * 2)
+        self.assertEqual(sorted(df['count'], key=str), [2, None])
+        self.assertEqual(list(df.species), [u'Lynx', u'Lynx'])
+
+    def test_filter_and_refresh(self):
+        """Results are filtered by typed values and refreshed when
+        classifications are cleared"""
+        refresh_results([self.approved.pk])
+        table = ResultsTable.get(self.project)
+        queryset = Classification.objects.filter(project=self.project)
+        self.assertEqual(
+            list(table.filter(queryset, u'count', u'2')), [self.approved]
+        )
+        self.assertFalse(table.filter(queryset, u'count', u'two'))
+
+        self.approved.delete(clear=True)
+        self.assertTrue(table.read().empty)
+
+    def test_classificator_changed(self):
+        """Tables are rebuilt when attributes of a classificator change"""
+        refresh_results([self.approved.pk])
+        self.classificator.static_attrs_order = u''
+        self.classificator.save()
+        project = type(self.project).objects.get(pk=self.project.pk)
+        df = ResultsTable.get(project).read()
+        self.assertNotIn(u'species', df.columns)
+        self.assertIn(u'count', df.columns)
+
+    def test_attribute_names(self):
+        """Names of attributes are never used in SQL; attributes named
+        like fixed columns are read from hstore columns"""
+        hostile = (
+            u'x" text); DROP TABLE media_classification_classification; '
+            u'-- 100%'
+        )
+        attr = json.dumps({
+            u'initial': u'', u'target': u'S', u'required': False,
+            u'values': u'', u'field_type': u'S'
+        })
+        self.classificator.custom_attrs[hostile] = attr
+        self.classificator.static_attrs_order = u','.join([
+            u'species', hostile
+        ])
+        self.classificator.save()
+        self.approved.static_attrs = {u'species': u'Lynx', hostile: u'yes'}
+        self.approved.save()
+        refresh_results([self.approved.pk])
+
+        project = type(self.project).objects.get(pk=self.project.pk)
+        table = ResultsTable.get(project)
+        df = table.read()
+        self.assertEqual(list(df[hostile]), [u'yes', u'yes'])
+        queryset = Classification.objects.filter(project=self.project)
+        self.assertEqual(
+            list(table.filter(queryset, hostile, u'yes')), [self.approved]
+        )
+        self.assertTrue(Classification.objects.exists())
+
+        self.classificator.custom_attrs[u'classification_id'] = attr
+        self.classificator.static_attrs_order = u'species,classification_id'
+        self.classificator.save()
+        project = type(self.project).objects.get(pk=self.project.pk)
+        self.assertIsNone(ResultsTable.get(project))
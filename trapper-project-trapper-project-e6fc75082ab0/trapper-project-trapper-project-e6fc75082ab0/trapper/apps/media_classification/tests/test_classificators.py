@@ -3,6 +3,7 @@
 import json
 
 from django.core.urlresolvers import reverse
+from django.test import override_settings
 from django.utils.timezone import now
 
 from trapper.apps.common.utils.test_tools import (
@@ -10,6 +11,8 @@ from trapper.apps.common.utils.test_tools import (
     ResearchProjectTestMixin, ClassificationProjectTestMixin,
     CollectionTestMixin
 )
+from trapper.apps.extra_tables.models import Species
+from trapper.apps.media_classification.forms import ClassificationForm
 from trapper.apps.media_classification.models import (
     Classificator, Classification
 )
@@ -491,3 +494,105 @@ class ClassificatorTestCase(
         cloned_classificator = Classificator.objects.get(name=new_name)
         self.assertEqual(cloned_classificator.owner, self.alice)
 
+
+
+class ClassificatorSchemaTestCase(BaseClassificatorTestCase):
+    """Compiled schemas of classificators"""
+
+    def setUp(self):
+        super(ClassificatorSchemaTestCase, self).setUp()
+        self.classificator = self.create_classificator(
+            owner=self.alice,
+            custom_attrs={
+                u'count': (
+                    u'{"initial": "", "target": "D", "required": true, '
+                    u'"values": "", "field_type": "I"}'
+                ),
+                u'age': (
+                    u'{"initial": "", "target": "S", "required": false, '
+                    u'"values": "adult,juvenile", "field_type": "S"}'
+                ),
+            },
+            dynamic_attrs_order=u'count',
+            static_attrs_order=u'age'
+        )
+
+    def test_version(self):
+        """Saving a classificator bumps a version of its schema"""
+        schema = self.classificator.get_schema()
+        self.assertEqual(schema.get_attrs_order('D'), [u'count'])
+        self.assertIs(self.classificator.get_schema(), schema)
+
+        self.classificator.set_custom_attr(
+            u'sex',
+            {
+                u'initial': u'', u'target': u'D', u'required': False,
+                u'values': u'', u'field_type': u'S'
+            },
+            commit=True
+        )
+        classificator = Classificator.objects.get(pk=self.classificator.pk)
+        new_schema = classificator.get_schema()
+        self.assertNotEqual(new_schema.version, schema.version)
+        self.assertEqual(new_schema.get_attrs_order('D'), [u'count', u'sex'])
+        self.assertItemsEqual(
+            classificator.prepare_form_fields()['D'].keys(), [u'count', u'sex']
+        )
+
+    @override_settings(CACHES={
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    })
+    def test_species_choices(self):
+        """Changes of species are visible in schemas kept by a process"""
+        Species.objects.create(english_name=u'Lynx', latin_name=u'Lynx lynx')
+        classificator = self.create_classificator(
+            owner=self.alice,
+            predefined_attrs={
+                u'species': u'true',
+                u'required_species': u'true',
+                u'target_species': u'S',
+                u'selected_species': u'[]',
+            },
+            static_attrs_order=u'species'
+        )
+        schema = classificator.get_schema()
+        self.assertEqual(schema.attrs[u'species'][u'choices'], [u'Lynx'])
+        self.assertIs(classificator.get_schema(), schema)
+
+        species = Species.objects.create(
+            english_name=u'Wolf', latin_name=u'Canis lupus'
+        )
+        schema = classificator.get_schema()
+        self.assertEqual(
+            schema.attrs[u'species'][u'choices'], [u'Lynx', u'Wolf']
+        )
+        cleaned_data, errors = schema.validate('S', {u'species': u'Wolf'})
+        self.assertFalse(errors)
+
+        species.delete()
+        schema = classificator.get_schema()
+        self.assertEqual(schema.attrs[u'species'][u'choices'], [u'Lynx'])
+
+    def test_validate(self):
+        """Rows are validated the same way as by classification forms"""
+        schema = self.classificator.get_schema()
+        cleaned_data, errors = schema.validate('D', {u'count': u'3'})
+        self.assertFalse(errors)
+        self.assertEqual(cleaned_data, {u'count': 3})
+
+        for target, data in (
+            ('D', {u'count': u'many'}),
+            ('D', {}),
+            ('S', {u'age': u'old'}),
+        ):
+            cleaned_data, errors = schema.validate(target, data)
+            form = ClassificationForm(
+                fields_defs=schema.form_fields[target],
+                attrs_order=schema.get_attrs_order(target),
+                readonly=False,
+                data=data
+            )
+            self.assertFalse(form.is_valid())
+            self.assertEqual(str(errors), str(form.errors))
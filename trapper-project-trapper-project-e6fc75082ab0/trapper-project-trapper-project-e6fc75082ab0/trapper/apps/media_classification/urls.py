@@ -84,7 +84,12 @@ urlpatterns = [
         r'^api/classifications/import',
         classification_api_views.ClassificationImport.as_view(),
         name='api-classification-import'
-    )
+    ),
+    url(
+        r'^api/classifications/clusters/(?P<zoom>\d+)/(?P<x>\d+)/(?P<y>\d+)/$',
+        classification_api_views.ClassificationClusterView.as_view(),
+        name='api-classification-clusters'
+    ),
 ]
 
 urlpatterns += [
@@ -13,6 +13,7 @@ from rest_framework import permissions
 from rest_framework.views import APIView
 from rest_framework.generics import ListAPIView
 from rest_framework.serializers import ValidationError as rest_verror
+from rest_framework.filters import DjangoFilterBackend
 
 from bulk_update.helper import bulk_update
 
@@ -29,9 +30,12 @@ from trapper.apps.media_classification.filters import (
     ClassificationProjectCollectionFilter, ClassificationFilter,
     SequenceFilter, ClassificatorFilter,
 )
-from trapper.apps.media_classification.forms import ClassificationForm
+from trapper.apps.media_classification.results import (
+    ResultsTable, refresh_results
+)
 from trapper.apps.storage.models import Resource
 from trapper.apps.geomap.models import Deployment
+from trapper.apps.geomap.clusters import ClusterTileViewMixin
 
 from trapper.apps.media_classification import (
     serializers as classification_serializers
@@ -40,6 +44,7 @@ from trapper.apps.common.views_api import (
     PaginatedReadOnlyModelViewSet, PlainTextRenderer
 )
 from trapper.apps.common.tools import df_to_geojson, aggregate_results
+from trapper.apps.common.filters import RegExpSearchFilter
 
 
 
@@ -70,17 +75,20 @@ class UserClassificationViewSet(PaginatedReadOnlyModelViewSet):
         return queryset
 
 
-class ClassificationViewSet(PaginatedReadOnlyModelViewSet):
-    """Returns a list of classifications.
+class ClassificationListMixin(object):
+    """Permissions, filters and search of views that list classifications
+    accessible for a user. Shared by :class:`ClassificationViewSet` and
+    :class:`ClassificationClusterView`, so clusters on a map always
+    contain the same classifications as a list.
     """
     permission_classes = (permissions.IsAuthenticated, )
+    filter_backends = (
+        DjangoFilterBackend,
+        RegExpSearchFilter
+    )
     filter_class = ClassificationFilter
-    serializer_class = classification_serializers.ClassificationSerializer
     search_fields = ['resource__name', '=dynamic_attrs__attrs', '=static_attrs']
-    prefetch_related = [
-        'resource__deployment__location', 'resource__managers',
-        'dynamic_attrs',
-    ]
+    prefetch_related = []
 
     def get_queryset(self):
         queryset = Classification.objects.get_accessible(
@@ -91,11 +99,27 @@ class ClassificationViewSet(PaginatedReadOnlyModelViewSet):
         return queryset
 
 
+class ClassificationViewSet(
+    ClassificationListMixin, PaginatedReadOnlyModelViewSet
+):
+    """Returns a list of classifications.
+    """
+    serializer_class = classification_serializers.ClassificationSerializer
+    prefetch_related = [
+        'resource__deployment__location', 'resource__managers',
+        'dynamic_attrs',
+    ]
+
+
 # helper function
-def prepare_results_table(queryset, outpath, classificator, return_df=False):
+def prepare_results_table(
+    queryset, outpath, classificator, return_df=False, project=None
+):
+    """Write a table with results of classifications into `outpath`.
+    When a results table of a `project` is available (see
+    :mod:`trapper.apps.media_classification.results`) typed values
+    of attributes are read from it instead of hstore columns."""
     fields = [
-        'static_attrs',
-        'dynamic_attrs__attrs', 
         'sequence__sequence_id',
         'resource__deployment__deployment_id',
         'resource__date_recorded',
@@ -104,7 +128,6 @@ def prepare_results_table(queryset, outpath, classificator, return_df=False):
         'resource_id',
         'id'
     ]
-    values = list(queryset.values(*fields))
     static_attrs_columns = classificator.get_static_attrs_order()
     dynamic_attrs_columns = classificator.get_dynamic_attrs_order()
     columns_order = [
@@ -112,17 +135,29 @@ def prepare_results_table(queryset, outpath, classificator, return_df=False):
         'resource__resource_type', 'resource__date_recorded', 'sequence__sequence_id', 
     ] + static_attrs_columns + dynamic_attrs_columns
 
-    for k in values:
-        if k.get('static_attrs'):
-            k.update(k.pop('static_attrs'))
-        else:
-            k.pop('static_attrs')
-        if k.get('dynamic_attrs__attrs'):
-            k.update(k.pop('dynamic_attrs__attrs'))
-        else:
-            k.pop('dynamic_attrs__attrs')
-
-    df = pandas.DataFrame.from_records(values, columns=columns_order)
+    results_table = ResultsTable.get(project)
+    if results_table:
+        df = pandas.DataFrame.from_records(
+            list(queryset.values(*fields)), columns=fields
+        )
+        results = results_table.read(queryset=queryset)
+        df = df.merge(
+            results, how='left', left_on='id', right_on='classification_id'
+        )[columns_order]
+    else:
+        values = list(queryset.values(
+            'static_attrs', 'dynamic_attrs__attrs', *fields
+        ))
+        for k in values:
+            if k.get('static_attrs'):
+                k.update(k.pop('static_attrs'))
+            else:
+                k.pop('static_attrs')
+            if k.get('dynamic_attrs__attrs'):
+                k.update(k.pop('dynamic_attrs__attrs'))
+            else:
+                k.pop('dynamic_attrs__attrs')
+        df = pandas.DataFrame.from_records(values, columns=columns_order)
     df.columns = [k.split('__')[-1] for k in df.columns]
     df = df.sort(['deployment_id', 'name'])
     df.to_csv(outpath, encoding='utf-8', index=False)
@@ -173,7 +208,9 @@ class ClassificationResultsView(ListAPIView):
         if self.project:
             classificator = self.project.classificator
             if classificator:
-                prepare_results_table(queryset, data, classificator)
+                prepare_results_table(
+                    queryset, data, classificator, project=self.project
+                )
         return Response(data.getvalue())
 
 
@@ -248,11 +285,14 @@ class ClassificationResultsAggView(ListAPIView):
 
     def list(self, request, *args, **kwargs):
         queryset = self.filter_queryset(self.get_queryset())
-        if not queryset:
+        if not queryset.exists():
             return Response('[]')
         data = StringIO.StringIO()
         classificator = self.project.classificator
-        rdf = prepare_results_table(queryset, data, classificator, return_df=True)
+        rdf = prepare_results_table(
+            queryset, data, classificator, return_df=True,
+            project=self.project
+        )
         params = self.get_extra_params()
         all_dep = params.pop('all_dep')
         
@@ -303,6 +343,16 @@ class ClassificationMapViewSet(ClassificationViewSet):
     serializer_class = classification_serializers.ClassificationMapSerializer
 
 
+class ClassificationClusterView(
+    ClusterTileViewMixin, ClassificationListMixin, ListAPIView
+):
+    """Returns classifications from :class:`ClassificationViewSet`
+    clustered per map tile (by locations of classified resources).
+    """
+    cluster_geo_field = 'resource__deployment__location__coordinates'
+    cluster_cache_prefix = 'classification_clusters'
+
+
 class ClassificatorViewSet(PaginatedReadOnlyModelViewSet):
     """Returns a list of classificators.
     """
@@ -504,9 +554,9 @@ class ClassificationImport(APIView):
                 pk=data.get('cproject_id')
             )
             if cproject.can_update(user=user):
-                static_attrs = cproject.classificator.get_static_attrs_order()
-                dynamic_attrs = cproject.classificator.get_dynamic_attrs_order()
-                form_fields = cproject.classificator.prepare_form_fields()
+                schema = cproject.classificator.get_schema()
+                static_attrs = schema.get_attrs_order('S')
+                dynamic_attrs = schema.get_attrs_order('D')
 
                 data_classifications = data.get('classifications')
                 if not data_classifications:
@@ -554,16 +604,13 @@ class ClassificationImport(APIView):
 
                     # validate static_attrs
                     if static_attrs:
-                        static_form = ClassificationForm(
-                            fields_defs=form_fields['S'],
-                            attrs_order=static_attrs,
-                            readonly=False,
-                            data=data_static
+                        static_cleaned_data, errors = schema.validate(
+                            'S', data_static
                         )
-                        if not static_form.is_valid():
+                        if errors:
                             self.add_error_msg(
                                 classification_pk,
-                                dict(static_form.errors.items()),
+                                dict(errors.items()),
                                 errors_list)
                             exclude_classification_pks.append(
                                 classification_pk
@@ -574,17 +621,14 @@ class ClassificationImport(APIView):
                     #validate dynamic_attrs
                     if dynamic_attrs:
                         for dynamic_row in data_dynamic:
-                            dynamic_form = ClassificationForm(
-                                fields_defs=form_fields['D'],
-                                attrs_order=dynamic_attrs,
-                                readonly=False,
-                                data=dynamic_row
+                            dynamic_cleaned_data, errors = schema.validate(
+                                'D', dynamic_row
                             )
-                            if not dynamic_form.is_valid():
+                            if errors:
                                 dynamic_loop_broke = True
                                 self.add_error_msg(
                                     classification_pk,
-                                    dict(dynamic_form.errors.items()),
+                                    dict(errors.items()),
                                     errors_list)
                                 exclude_classification_pks.append(
                                     classification_pk
@@ -592,7 +636,7 @@ class ClassificationImport(APIView):
                                 break
 
                             cleaned_dynamic_rows[classification_pk].append(
-                                dynamic_form.cleaned_data
+                                dynamic_cleaned_data
                             )
 
                         # executes the following block if there is no break in the inner loop
@@ -608,11 +652,14 @@ class ClassificationImport(APIView):
                             updated_at=timestamp,
                         )
                         if static_attrs:
-                            user_classification.static_attrs = static_form.cleaned_data
+                            user_classification.static_attrs = static_cleaned_data
                             user_classifications.append(user_classification)
 
                 # exclude invalid data
                 classifications = classifications.exclude(pk__in=exclude_classification_pks)
+                classification_pks = list(
+                    classifications.values_list('pk', flat=True)
+                )
 
                 # bulk delete UserClassification objects
                 UserClassification.objects.filter(
@@ -676,6 +723,7 @@ class ClassificationImport(APIView):
                     bulk_update(classifications, update_fields=[
                         'approved_source_id', 'static_attrs'
                     ])
+                refresh_results(classification_pks)
 
                 summary = {
                     'totalClassifications': total,
@@ -16,7 +16,6 @@ from django.conf import settings
 from django.contrib import messages
 from django.forms.models import formset_factory
 from django.core.urlresolvers import reverse
-from django.apps import apps
 from django.db.models import Q
 from django.contrib.auth import get_user_model
 from django.utils.timezone import now
@@ -36,6 +35,7 @@ from trapper.apps.media_classification.taxonomy import (
     ClassificationProjectRoleLevels
 )
 from trapper.apps.media_classification.forms import ClassificationTagForm
+from trapper.apps.media_classification.results import refresh_results
 from trapper.apps.media_classification.tasks import (
     celery_import_classifications, celery_create_tags,
     celery_results_to_data_package
@@ -43,6 +43,7 @@ from trapper.apps.media_classification.tasks import (
 from trapper.apps.geomap.models import MapManagerUtils, Deployment
 from trapper.apps.common.views import LoginRequiredMixin, BaseDeleteView
 from trapper.apps.common.tools import parse_hstore_field, parse_pks
+from trapper.apps.common.task_args import delay_task
 from trapper.apps.accounts.models import UserTask
 
 User = get_user_model()
@@ -541,6 +542,7 @@ class ClassifyResourceView(
                             classification=classification,
                             attrs=user_attrs
                         )
+                    refresh_results([classification.pk])
                 else:
                     messages.error(
                         request=request,
@@ -687,12 +689,17 @@ class ClassificationListView(
             )
             return filter_definition
 
-        predefined_def = classificator.parse_hstore_values('predefined_attrs')
-        custom_def = classificator.parse_hstore_values('custom_attrs')
+        schema = classificator.get_schema()
+        static_attrs_list = schema.get_attrs_order(
+            ClassificatorSettings.TARGET_STATIC
+        )
 
-        static_attrs_list = classificator.static_attrs_order
+        for name, params in schema.attrs.items():
+            if params['predefined'] and not params['choices']:
+                # Annotations and comments should not be displayed on
+                # classification list
+                continue
 
-        for name, params in custom_def.items():
             if name in static_attrs_list:
                 field_type = 'static_attrs'
             else:
@@ -712,9 +719,12 @@ class ClassificationListView(
                     ('True', 'true'),
                     ('False', 'false')
                 ]
-            elif params['values']:
-                values = params['values'].split(',')
-                if settings.EXCLUDE_CLASSIFICATION_NUMBERS:
+            elif params['choices']:
+                values = params['choices']
+                if (
+                    settings.EXCLUDE_CLASSIFICATION_NUMBERS and
+                    not params['predefined']
+                ):
                     tmp_vals = []
                     for val in values:
                         try:
@@ -736,45 +746,6 @@ class ClassificationListView(
             if field['tag']['name'] != 'input':
                 filter_definition.append(field)
 
-        # work with predefined attrs
-        model_attributes = ClassificatorSettings.PREDEFINED_ATTRIBUTES_MODELS
-
-        for name, params in model_attributes.items():
-            if name in static_attrs_list:
-                field_type = 'static_attrs'
-            else:
-                field_type = 'dynamic_attrs'
-
-            if predefined_def.get(name, False):
-                values = predefined_def.get(
-                    'selected_{name}'.format(name=name), None
-                )
-                model_class = apps.get_model(params['app'], name)
-                dbvalues = [('All', '')] + list(
-                    model_class.objects.filter(
-                        pk__in=values
-                    ).values_list(
-                        params['choices_labels'],
-                        params['choices_labels']
-                    )
-                )
-
-                field = {
-                    'label': name.capitalize(),
-                    'name': name,
-                    'field': field_type,
-                    'tag': {'name': 'select', 'is_block': True},
-                    'values': dbvalues
-                }
-                filter_definition.append(field)
-
-        if predefined_def.get('annotations', False):
-            # Annotation filter should not be displayed on classification list
-            pass
-        if predefined_def.get('comments', False):
-            # Comments should not be listed as field
-            pass
-
         filter_definition.sort(key=lambda x: x['label'])
         return filter_definition
 
@@ -862,6 +833,7 @@ class ClassificationDeleteView(BaseDeleteView):
         ClassificationDynamicAttrs.objects.filter(
             classification__pk__in=pks
         ).delete()
+        refresh_results(pks)
 
     def filter_editable(self, queryset, user):
         return self.model.objects.get_accessible(
@@ -908,9 +880,12 @@ class ClassificationTagView(
         tag_keys = []
         tag_keys.extend(self.INCLUDE_PREDEFINED_FIELDS)
         classificator = self.object.classificator
-        custom_attrs = classificator.parse_hstore_values('custom_attrs')
-        for field in custom_attrs.keys():
-            if custom_attrs[field]['field_type'] in self.INCLUDE_CUSTOM_FIELDS:
+        schema = classificator.get_schema()
+        for field, params in schema.attrs.items():
+            if (
+                not params['predefined'] and
+                params['field_type'] in self.INCLUDE_CUSTOM_FIELDS
+            ):
                 tag_keys.append(field)
         return tag_keys
 
@@ -937,17 +912,17 @@ class ClassificationTagView(
 
             tag_keys = data.keys()
 
-            if classifications:
+            if classifications.exists():
 
                 params = {
                     'data': {
-                        'classifications': list(classifications),
+                        'classifications': classifications,
                         'tag_keys': tag_keys
                     },
                     'user': user
                 }
                 if settings.CELERY_ENABLED:
-                    task = celery_create_tags.delay(**params)
+                    task = delay_task(celery_create_tags, **params)
                     user_task = UserTask(
                         user=user,
                         task_id=task.task_id
@@ -1020,6 +995,7 @@ class ClassifyApproveView(LoginRequiredMixin, generic.View):
                 classification=classification,
                 attrs=user_attrs
             )
+        refresh_results([classification.pk])
         messages.success(
             request=request,
             message=ClassifyMessages.MSG_SUCCESS_APPROVED
@@ -1076,7 +1052,7 @@ class ClassificationImportView(LoginRequiredMixin, generic.FormView):
                 'user': user,
             }
             if settings.CELERY_ENABLED:
-                task = celery_import_classifications.delay(**params)
+                task = delay_task(celery_import_classifications, **params)
                 user_task = UserTask(
                     user=user,
                     task_id=task.task_id
@@ -1157,7 +1133,7 @@ class ClassificationExportView(LoginRequiredMixin, generic.FormView):
             }
 
             if settings.CELERY_ENABLED:
-                task = celery_results_to_data_package.delay(**params)
+                task = delay_task(celery_results_to_data_package, **params)
                 user_task = UserTask(
                     user=user,
                     task_id=task.task_id
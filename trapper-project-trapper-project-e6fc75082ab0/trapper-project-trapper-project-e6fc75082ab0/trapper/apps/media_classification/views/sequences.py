@@ -20,6 +20,7 @@ from trapper.apps.media_classification.models import (
 from trapper.apps.accounts.models import UserTask
 from trapper.apps.common.views import BaseDeleteView, LoginRequiredMixin
 from trapper.apps.common.tools import parse_pks, datetime_aware
+from trapper.apps.common.task_args import delay_task
 from trapper.apps.storage.models import Resource
 from trapper.apps.media_classification.serializers import (
     SequenceReadSerializer
@@ -234,7 +235,7 @@ class SequenceBuildView(
                 'user': user,
             }
             if settings.CELERY_ENABLED:
-                task = celery_build_sequences.delay(**params)
+                task = delay_task(celery_build_sequences, **params)
                 user_task = UserTask(
                     user=user,
                     task_id=task.task_id
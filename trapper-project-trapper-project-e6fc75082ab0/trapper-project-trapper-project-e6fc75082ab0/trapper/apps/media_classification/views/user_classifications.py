@@ -21,6 +21,7 @@ from trapper.apps.media_classification.models import (
     ClassificationProjectCollection,
     ClassificationDynamicAttrs
 )
+from trapper.apps.media_classification.results import refresh_results
 from trapper.apps.geomap.models import Deployment
 from trapper.apps.common.views import LoginRequiredMixin
 from trapper.apps.common.tools import parse_pks
@@ -222,6 +223,7 @@ class BulkApproveUserClassificationView(
 
             # bulk create ClassificationDynamicAttrs objects
             ClassificationDynamicAttrs.objects.bulk_create(dynamic_attrs_objects)
+            refresh_results([k.pk for k in classifications_to_update])
 
         else:
             status = False
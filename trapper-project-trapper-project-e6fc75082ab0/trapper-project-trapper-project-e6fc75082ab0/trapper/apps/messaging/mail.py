@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""
+E-mail notifications sent off the request path.
+
+E-mails are described by tuples `(subject, message, recipient_list)` and
+queued with :func:`send_emails`. When `settings.CELERY_ENABLED` is True
+they are delivered by celery tasks (one task per batch of
+`settings.EMAIL_BATCH_SIZE` e-mails) once the current transaction is
+committed; otherwise they are delivered immediately. Each batch is sent
+through a single connection to a mail server.
+"""
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+
+
+def deliver_emails(emails):
+    """Send given e-mails using one connection to a mail server"""
+    connection = get_connection(fail_silently=True)
+    messages = [
+        EmailMessage(
+            subject=subject, body=message, to=recipient_list,
+            connection=connection
+        )
+        for subject, message, recipient_list in emails
+        if recipient_list
+    ]
+    if not messages:
+        return 0
+    connection.open()
+    try:
+        return connection.send_messages(messages) or 0
+    finally:
+        connection.close()
+
+
+def send_emails(emails):
+    """Queue given e-mails to be delivered in batches"""
+    emails = [
+        (subject, message, [k for k in recipient_list if k])
+        for subject, message, recipient_list in emails
+    ]
+    if not settings.CELERY_ENABLED:
+        deliver_emails(emails)
+        return
+    from trapper.apps.messaging.tasks import celery_deliver_emails
+    size = settings.EMAIL_BATCH_SIZE
+    for i in range(0, len(emails), size):
+        batch = emails[i:i + size]
+        transaction.on_commit(
+            lambda batch=batch: celery_deliver_emails.delay(emails=batch)
+        )
+
+
+def send_email(subject, message, recipient_list):
+    """Queue a single e-mail (see :func:`send_emails`)"""
+    send_emails([(subject, message, recipient_list)])
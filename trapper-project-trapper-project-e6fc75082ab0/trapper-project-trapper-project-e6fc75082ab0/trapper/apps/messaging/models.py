@@ -16,12 +16,15 @@ from __future__ import unicode_literals
 from django.db import models
 from django.conf import settings
 from django.core.urlresolvers import reverse
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
 from django.utils.timezone import now
 
 from trapper.middleware import get_current_user
 from trapper.apps.common.utils.identity import create_hashcode
 from trapper.apps.common.fields import SafeTextField
 from trapper.apps.messaging.taxonomies import MessageType, MessageApproveStatus
+from trapper.apps.accounts.models import invalidate_user_counters
 
 
 class Message(models.Model):
@@ -115,6 +118,37 @@ class Message(models.Model):
         )
 
 
+def create_messages(
+        subject, text, user_from, recipients,
+        message_type=MessageType.STANDARD
+):
+    """
+    Send the same message to many users with a single bulk insert.
+
+    Recipients are deduplicated by their primary keys; empty values are
+    skipped. Cached counters of recipients are invalidated explicitly,
+    because `bulk_create` doesn't send `post_save` signals.
+
+    :param recipients: iterable of users or their primary keys
+    :return: list of created :class:`Message` instances
+    """
+    user_pks = set(
+        getattr(k, 'pk', k) for k in recipients if k is not None
+    )
+    messages = Message.objects.bulk_create([
+        Message(
+            subject=subject,
+            text=text,
+            user_from=user_from,
+            user_to_id=user_pk,
+            message_type=message_type
+        )
+        for user_pk in user_pks
+    ])
+    invalidate_user_counters(users=user_pks)
+    return messages
+
+
 class BaseAccessRequestModel(models.Model):
     """
     Base class for handling different kind of access requests for example
@@ -271,3 +305,23 @@ class CollectionRequest(BaseAccessRequestModel):
         collections = self.collections.all()
         users = [self.user_from.pk,]
         collections_access_revoke(collections, users, level=5)
+
+
+@receiver(post_save, sender=Message)
+@receiver(post_delete, sender=Message)
+def message_counters_invalidate(sender, instance, **kwargs):
+    """
+    Signal used to refresh counters of unread and inbox messages of
+    a recipient (see :meth:`accounts.models.UserProfile.get_counters`)
+    """
+    invalidate_user_counters(users=[instance.user_to_id])
+
+
+@receiver(post_save, sender=CollectionRequest)
+@receiver(post_delete, sender=CollectionRequest)
+def request_counters_invalidate(sender, instance, **kwargs):
+    """
+    Signal used to refresh counters of awaiting collection requests
+    (see :meth:`accounts.models.UserProfile.get_counters`)
+    """
+    invalidate_user_counters(users=[instance.user_id])
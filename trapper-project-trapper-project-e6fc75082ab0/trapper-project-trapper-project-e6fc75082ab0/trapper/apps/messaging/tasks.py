@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+"""
+Celery tasks of the messaging application
+"""
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+from celery import shared_task
+
+from trapper.apps.accounts.task_metrics import task_progress
+from trapper.apps.messaging.mail import deliver_emails
+
+
+@shared_task
+def celery_deliver_emails(emails):
+    """
+    Celery task that sends a batch of e-mails through a single connection
+
+    :param emails: list of `(subject, message, recipient_list)` tuples
+    """
+    sent = deliver_emails(emails)
+    task_progress(sent, total=len(emails))
+    return sent
@@ -3,15 +3,18 @@
 import itertools
 
 from django.core.urlresolvers import reverse
+from django.test import override_settings
 from django.utils.lorem_ipsum import words, paragraph
 
 from trapper.apps.common.utils.test_tools import (
     ExtendedTestCase, ResourceTestMixin, CollectionTestMixin,
     ResearchProjectTestMixin
 )
+from trapper.apps.accounts.models import UserProfile
 from trapper.apps.messaging.models import (
-    Message, CollectionRequest,
+    Message, CollectionRequest, create_messages
 )
+from trapper.apps.messaging.mail import send_emails
 from trapper.apps.messaging.taxonomies import MessageType
 from trapper.apps.storage.models import CollectionMember
 from trapper.apps.storage.taxonomy import CollectionMemberLevels
@@ -153,6 +156,69 @@ class MessagingTestCase(ExtendedTestCase):
             self.assertEqual(message.message_type, MessageType.STANDARD)
             self.assertEqual(message.user_to, self.alice)
 
+    @override_settings(CACHES={
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    })
+    def test_cached_counters(self):
+        """Cached counters of unread messages are refreshed when messages
+        are created or read"""
+        profile = UserProfile.objects.get(user=self.eric)
+        self.assertEqual(profile.count_unread_messages(), 0)
+
+        message = Message.objects.create(
+            subject=words(3),
+            text=paragraph(),
+            user_from=self.alice,
+            user_to=self.eric
+        )
+        profile = UserProfile.objects.get(user=self.eric)
+        self.assertEqual(profile.count_unread_messages(), 1)
+        self.assertEqual(profile.count_inbox_messages(), 1)
+        self.assertTrue(profile.has_unread_messages())
+
+        message.mark_received(user=self.eric)
+        profile = UserProfile.objects.get(user=self.eric)
+        self.assertEqual(profile.count_unread_messages(), 0)
+        self.assertEqual(profile.count_inbox_messages(), 1)
+
+    @override_settings(CACHES={
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    })
+    def test_create_messages(self):
+        """The same message is sent once to each of deduplicated
+        recipients and their cached counters are refreshed"""
+        profile = UserProfile.objects.get(user=self.eric)
+        self.assertEqual(profile.count_unread_messages(), 0)
+
+        create_messages(
+            subject=words(3),
+            text=paragraph(),
+            user_from=self.alice,
+            recipients=[self.eric, self.eric.pk, self.ziutek, None]
+        )
+        self.assertItemsEqual(
+            Message.objects.filter(
+                user_from=self.alice
+            ).values_list('user_to', flat=True),
+            [self.eric.pk, self.ziutek.pk]
+        )
+        profile = UserProfile.objects.get(user=self.eric)
+        self.assertEqual(profile.count_unread_messages(), 1)
+
+    def test_send_emails(self):
+        """Queued e-mails are delivered (immediately when celery is
+        disabled) and e-mails without recipients are skipped"""
+        send_emails([
+            (words(3), paragraph(), [self.alice.email]),
+            (words(3), paragraph(), [self.ziutek.email]),
+            (words(3), paragraph(), ['']),
+        ])
+        self.assertEqual(len(self.mail.outbox), 2)
+
     def test_unauth_access_message_details(self):
         """User should not have access to other messsages"""
         self.login_alice()
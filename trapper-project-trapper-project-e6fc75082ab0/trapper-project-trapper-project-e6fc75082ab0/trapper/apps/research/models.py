@@ -8,7 +8,7 @@ from django.db import models
 from django.db.models import Q
 from django.core.urlresolvers import reverse
 from django.contrib.auth import get_user_model
-from django.core.mail import mail_admins, send_mail
+from django.core.mail import mail_admins
 from django.db.models.signals import post_save, post_delete, pre_save
 from django.dispatch import receiver
 
@@ -16,7 +16,8 @@ from trapper.middleware import get_current_user
 from trapper.apps.research.taxonomy import (
     ResearchProjectRoleType, ResearchProjectStatus
 )
-from trapper.apps.messaging.models import Message
+from trapper.apps.messaging.models import create_messages
+from trapper.apps.messaging.mail import send_email
 from trapper.apps.messaging.taxonomies import MessageType
 from trapper.apps.common.fields import SafeTextField
 from trapper.middleware import get_current_request
@@ -256,7 +257,7 @@ class ResearchProject(models.Model):
         User = get_user_model()
         recipients = User.objects.filter(
             is_active=True, is_superuser=True
-        )
+        ).values_list('pk', flat=True)
 
         body_template = (
             'New research project has been created. You can approve or reject it '
@@ -268,20 +269,18 @@ class ResearchProject(models.Model):
             )
         )
 
-        for recipient in recipients:
-            Message.objects.create(
-                subject=(
-                    u"New research project: <strong>{name}</strong> "
-                    u"created"
-                ).format(
-                    name=self.name
-                ),
-                text=body_template,
-                user_from=self.owner,
-                user_to=recipient,
-                date_sent=datetime_aware(),
-                message_type=MessageType.RESEARCH_PROJECT_CREATED
-            )
+        create_messages(
+            subject=(
+                u"New research project: <strong>{name}</strong> "
+                u"created"
+            ).format(
+                name=self.name
+            ),
+            text=body_template,
+            user_from=self.owner,
+            recipients=recipients,
+            message_type=MessageType.RESEARCH_PROJECT_CREATED
+        )
 
 
 class ResearchProjectRole(models.Model):
@@ -500,7 +499,7 @@ def project_activated_notifiction(sender, instance, **kwargs):
         ):
             request = get_current_request()
             # send an email notification to a user that a research project has been activated
-            send_mail(
+            send_email(
                 subject='Your Trapper research project has just been activated!',
                 message=(
                     'Dear {username},\n\n'
@@ -517,7 +516,5 @@ def project_activated_notifiction(sender, instance, **kwargs):
                         )
                     )
                 ),
-                from_email=None,
-                recipient_list=[instance.owner.email],
-                fail_silently=True
+                recipient_list=[instance.owner.email]
             )
@@ -328,6 +328,7 @@ class CollectionProcessor(object):
 
         """
         from trapper.apps.storage.tasks import celery_update_thumbnails
+        from trapper.apps.common.task_args import delay_task
         User = get_user_model()
 
         collection_model = apps.get_model('storage', 'Collection')
@@ -478,6 +479,6 @@ class CollectionProcessor(object):
             )
             resources_pks = [k.pk for k in resources]
             collection.resources.add(*resources_pks)
-            celery_update_thumbnails.delay(resources)
+            delay_task(celery_update_thumbnails, resources=resources)
             if not self.errors[collection.name]:
                 self.errors.pop(collection.name)
@@ -6,16 +6,18 @@ from __future__ import unicode_literals
 from django.utils.translation import ugettext as _
 
 from mimetypes import guess_type
-import itertools
 import datetime
 
 from django.conf import settings
 from django.apps import apps
 from django.contrib.gis.db import models as gis_models
 from django.contrib.gis.geos import Polygon
+from django.core.cache import cache
 from django.core.urlresolvers import reverse
-from django.db import models
-from django.db.models.signals import m2m_changed, post_save, post_delete
+from django.db import connection, models, transaction
+from django.db.models.signals import (
+    m2m_changed, post_init, post_save, post_delete, pre_save, pre_delete
+)
 from django.dispatch import receiver
 from django.utils.timezone import now, get_current_timezone
 from django.templatetags.tz import do_timezone
@@ -23,14 +25,17 @@ from django.templatetags.tz import do_timezone
 from taggit.models import TaggedItemBase
 from taggit.managers import TaggableManager
 
-from trapper.apps.geomap.models import Location
+from trapper.apps.geomap.models import (
+    Location, invalidate_accessible_sets, get_accessible_sets_version,
+    refresh_accessible_sets, defer_accessible_sets
+)
 from trapper.apps.storage.taxonomy import (
     ResourceMimeType, ResourceStatus, ResourceType,
     CollectionStatus, CollectionMemberLevels
 )
 from trapper.middleware import get_current_user
 from trapper.apps.messaging.models import (
-    CollectionRequest, Message
+    CollectionRequest, create_messages
 )
 from trapper.apps.messaging.taxonomies import MessageType
 from trapper.apps.accounts.models import UserTask
@@ -42,9 +47,15 @@ from trapper.apps.storage.mixins import (
 from trapper.apps.common.fields import SafeTextField
 from trapper.apps.common.utils.models import delete_old_file
 from trapper.apps.storage.tasks import celery_update_thumbnails
+from trapper.apps.common.task_args import delay_task
 from trapper.apps.storage.thumbnailer import Thumbnailer
 
 
+MEMBER_COLLECTIONS_CACHE_KEY = (
+    'storage_member_collections_{pk}_{basic}_{version}'
+)
+
+
 class ResourceManager(APIContextManagerMixin, models.Manager):
     """The manager of the :class:`Resource` model.
     """
@@ -101,6 +112,98 @@ class ResourceManager(APIContextManagerMixin, models.Manager):
             models.Q(managers=user) |
             models.Q(pk__in=col_res)
         )
+
+    def get_selected(self, pks, app=None):
+        """Return resources selected in a grid of given application;
+        for `media_classification` given primary keys are primary keys
+        of classifications"""
+        if app == 'media_classification':
+            return self.filter(classifications__pk__in=pks)
+        return self.filter(pk__in=pks)
+
+    def get_member_collections(self, user, basic=False):
+        """Return a set of primary keys of collections given user is
+        a member of (with any level; basic access is included only when
+        `basic` is True).
+
+        Sets are memoized on a user instance (so they are loaded once per
+        request) and cached together with a version of accessible sets,
+        which is changed whenever memberships of a user are changed.
+        """
+        memo = getattr(user, '_member_collections', None)
+        if memo is None:
+            memo = {}
+            user._member_collections = memo
+        if basic not in memo:
+            cache_key = MEMBER_COLLECTIONS_CACHE_KEY.format(
+                pk=user.pk, basic=int(basic),
+                version=get_accessible_sets_version(user)
+            )
+            collection_pks = cache.get(cache_key)
+            if collection_pks is None:
+                members = CollectionMember.objects.filter(user=user)
+                if not basic:
+                    members = members.exclude(
+                        level=CollectionMemberLevels.ACCESS_BASIC
+                    )
+                collection_pks = set(
+                    members.values_list('collection_id', flat=True)
+                )
+                cache.set(
+                    cache_key, collection_pks,
+                    settings.ACCESSIBLE_SETS_TIMEOUT
+                )
+            memo[basic] = collection_pks
+        return memo[basic]
+
+    def can_view_many(self, resources, user=None, basic=False):
+        """Return a set of primary keys of given resources that can be
+        viewed by given user (see :meth:`Resource.can_view`).
+
+        Public and owned resources are accepted without queries; remaining
+        ones are checked with at most two queries (collections of resources
+        and managers) against the set of user's collections
+        (see :meth:`get_member_collections`).
+
+        :param resources: iterable of :class:`Resource` instances
+        :param user: an instance of the
+            :class:`django.contrib.auth.models.User` model; if not provided
+            then currently logged in user is used
+        :param basic: a boolean value; if True then basic access to
+            collections is enough to view resources
+        """
+        user = user or get_current_user()
+        authenticated = user is not None and user.is_authenticated()
+        allowed = set()
+        pending = set()
+        for resource in resources:
+            if resource.status == ResourceStatus.PUBLIC or (
+                authenticated and resource.owner_id == user.pk
+            ):
+                allowed.add(resource.pk)
+            else:
+                pending.add(resource.pk)
+        if not pending:
+            return allowed
+
+        members = set()
+        if authenticated:
+            members = self.get_member_collections(user=user, basic=basic)
+        collections = Collection.resources.through.objects.filter(
+            resource__pk__in=pending
+        ).values_list('resource_id', 'collection_id', 'collection__status')
+        for resource_pk, collection_pk, status in collections:
+            if status == CollectionStatus.PUBLIC or collection_pk in members:
+                allowed.add(resource_pk)
+        pending -= allowed
+
+        if pending and authenticated:
+            allowed.update(
+                self.model.managers.through.objects.filter(
+                    resource__pk__in=pending, user=user
+                ).values_list('resource_id', flat=True)
+            )
+        return allowed
     
     
 class TaggedResource(TaggedItemBase):
@@ -176,35 +279,14 @@ class Resource(AccessModelMixin, models.Model):
         ordering = ('-date_recorded', )
 
     def can_view(self, user=None, basic=False):
+        """Check if given user can view a resource: it is public, belongs
+        to a public collection, user is its owner or manager or is a member
+        of one of its collections (basic access is enough only when `basic`
+        is True). See :meth:`ResourceManager.can_view_many`.
         """
-        """
-        if self.status == 'Public':
-            return True
-        if self.collection_set.filter(
-                status=CollectionStatus.PUBLIC
-        ).count():
-            return True
-        if not user.is_authenticated():
-            return False
-        user = user or get_current_user()
-        access_status = (
-            self.owner_id == user.pk or user.pk in self.managers.values_list(
-                'pk', flat=True
-            )
+        return self.pk in Resource.objects.can_view_many(
+            [self], user=user, basic=basic
         )
-        if access_status:
-            return True
-        qs1 = user.collectionmember_set.values_list(
-            'collection__pk', flat=True
-        )
-        if not basic:
-            qs1 = qs1.exclude(
-                level=CollectionMemberLevels.ACCESS_BASIC
-            )
-        qs2 = self.collection_set.values_list(
-            'pk', flat=True
-        ).exclude(owner=user,managers=user)
-        return len(list(set(qs1) & set(qs2))) > 0
 
     def __unicode__(self):
         return u"{resource_type}: {name}".format(
@@ -300,9 +382,7 @@ class Resource(AccessModelMixin, models.Model):
                 settings.CELERY_ENABLED and
                 self.file.size > settings.CELERY_MIN_IMAGE_SIZE
             ):
-                task = celery_update_thumbnails.delay(
-                    resources=[self,]
-                )
+                task = delay_task(celery_update_thumbnails, resources=[self])
                 user_task = UserTask(
                     user=self.owner,
                     task_id=task.task_id
@@ -721,6 +801,38 @@ class Collection(AccessModelMixin, models.Model):
             return cprojects.exists()
         return rprojects.exists() or cprojects.exists()
 
+    @classmethod
+    def get_used(
+            cls, collection_pks, user_pks, rproject=None, cproject=None
+    ):
+        """Set-wise version of :meth:`is_used`. Return a set of
+        `(collection pk, user pk)` pairs (limited to given collections and
+        users) for which users should still have access to collections.
+        """
+        research_project = apps.get_model('research', 'ResearchProject')
+        classification_project = apps.get_model(
+            'media_classification', 'ClassificationProject'
+        )
+        used = set()
+        if not cproject:
+            used.update(
+                research_project.objects.filter(
+                    collections__pk__in=collection_pks,
+                    project_roles__user__pk__in=user_pks
+                ).values_list('collections__pk', 'project_roles__user__pk')
+            )
+        if not rproject:
+            used.update(
+                classification_project.objects.filter(
+                    collections__collection__pk__in=collection_pks,
+                    classification_project_roles__user__pk__in=user_pks
+                ).values_list(
+                    'collections__collection__pk',
+                    'classification_project_roles__user__pk'
+                )
+            )
+        return used
+
     def delete(self, **kwargs):
         """Send notification before deleting objects"""
         delete_collection_notification(instance=self)
@@ -749,7 +861,7 @@ class Collection(AccessModelMixin, models.Model):
             self.bbox = polygon
         else:
             self.bbox = None
-            self.save()
+        self.save(update_fields=['bbox'])
 
     @property
     def period(self):
@@ -854,6 +966,189 @@ def rebuild_cp_collections(sender, instance, action, **kwargs):
             cp_collection.rebuild_classifications()
 
 
+# fields of resources and collections that change accessible sets
+ACCESS_FIELDS = {
+    'resource': ('status', 'owner_id', 'deployment_id'),
+    'collection': ('status', 'owner_id'),
+}
+# value of a field that was not loaded (e.g. excluded with `only`)
+DEFERRED_FIELD = object()
+
+
+def _get_access_state(instance):
+    """Return values of fields of an instance that change accessible sets;
+    deferred fields are not loaded"""
+    return tuple(
+        instance.__dict__.get(k, DEFERRED_FIELD)
+        for k in ACCESS_FIELDS[instance._meta.model_name]
+    )
+
+
+def _collection_deployments(collection_pks):
+    """Return primary keys of deployments of resources of given
+    collections"""
+    return set(
+        Resource.objects.filter(
+            collection__in=list(collection_pks)
+        ).values_list('deployment', flat=True)
+    )
+
+
+def _resource_deployments(resource_pks):
+    """Return primary keys of deployments of given resources"""
+    return set(
+        Resource.objects.filter(
+            pk__in=list(resource_pks)
+        ).values_list('deployment', flat=True)
+    )
+
+
+def _m2m_deployments(sender, instance, reverse, pk_set):
+    """Return primary keys of deployments affected by a change of
+    resources or managers of collections or managers of resources; when
+    `pk_set` is None all related objects of an instance are affected"""
+    if sender is Collection.resources.through:
+        if reverse:
+            return set([instance.deployment_id])
+        if pk_set is None:
+            return _collection_deployments([instance.pk])
+        return _resource_deployments(pk_set)
+    if sender is Collection.managers.through:
+        if not reverse:
+            return _collection_deployments([instance.pk])
+        if pk_set is None:
+            pk_set = instance.managed_collections.values_list(
+                'pk', flat=True
+            )
+        return _collection_deployments(pk_set)
+    if not reverse:
+        return set([instance.deployment_id])
+    if pk_set is None:
+        pk_set = instance.managed_resources.values_list('pk', flat=True)
+    return _resource_deployments(pk_set)
+
+
+@receiver(post_init, sender=Resource)
+@receiver(post_init, sender=Collection)
+def resource_store_access_state(sender, instance, **kwargs):
+    """
+    Signal used to remember a status, an owner and a deployment of
+    a loaded resource or collection, so accessible sets are refreshed
+    only when one of them is changed.
+    """
+    instance._access_state = _get_access_state(instance)
+
+
+@receiver(pre_save, sender=Resource)
+def resource_store_deployment(sender, instance, **kwargs):
+    """
+    Signal used to remember a previous deployment of a resource, so
+    the materialized set of that deployment can be refreshed too.
+    """
+    instance._previous_deployment_id = None
+    if not instance.pk:
+        return
+    previous = getattr(instance, '_access_state', None)
+    if previous is not None and previous[2] is not DEFERRED_FIELD:
+        instance._previous_deployment_id = previous[2]
+        return
+    update_fields = kwargs.get('update_fields')
+    if not update_fields or 'deployment' in update_fields:
+        instance._previous_deployment_id = Resource.objects.filter(
+            pk=instance.pk
+        ).values_list('deployment', flat=True).first()
+
+
+@receiver(pre_delete, sender=Collection)
+def collection_store_deployments(sender, instance, **kwargs):
+    """
+    Signal used to remember deployments of resources of a collection
+    before its resources are removed together with it.
+    """
+    instance._deployment_pks = _collection_deployments([instance.pk])
+
+
+@receiver(post_save, sender=Resource)
+@receiver(post_delete, sender=Resource)
+@receiver(post_save, sender=Collection)
+@receiver(post_delete, sender=Collection)
+def resource_accessible_sets_refresh(sender, instance, **kwargs):
+    """
+    Signal used to refresh materialized sets of accessible locations
+    and deployments (only of deployments of changed resources) and to
+    invalidate data cached for them when a resource or a collection
+    (i.e. its status, owner or deployment) is changed.
+
+    Saves that don't change these fields (e.g. of thumbnails) are ignored.
+    """
+    update_fields = kwargs.get('update_fields')
+    if update_fields and not set(update_fields) & set(
+        ['status', 'owner', 'deployment']
+    ):
+        return
+    if 'created' in kwargs:
+        previous = getattr(instance, '_access_state', None)
+        current = _get_access_state(instance)
+        instance._access_state = current
+        unchanged = previous == current and DEFERRED_FIELD not in current
+        if unchanged and not kwargs['created']:
+            return
+    if sender is Resource:
+        deployment_pks = [
+            instance.deployment_id,
+            getattr(instance, '_previous_deployment_id', None)
+        ]
+    elif kwargs.get('created'):
+        deployment_pks = []
+    else:
+        deployment_pks = getattr(instance, '_deployment_pks', None)
+        if deployment_pks is None:
+            deployment_pks = _collection_deployments([instance.pk])
+    refresh_accessible_sets(deployment_pks=deployment_pks)
+    invalidate_accessible_sets()
+
+
+@receiver(m2m_changed, sender=Collection.resources.through)
+@receiver(m2m_changed, sender=Collection.managers.through)
+@receiver(m2m_changed, sender=Resource.managers.through)
+def collection_accessible_sets_refresh(
+        sender, instance, action, reverse, pk_set, **kwargs
+):
+    """
+    Signal used to refresh materialized sets of accessible locations
+    and deployments and to invalidate data cached for them when resources
+    of a collection or managers are changed.
+    """
+    if action == 'pre_clear':
+        # related objects are not known after they are cleared
+        instance._cleared_deployment_pks = _m2m_deployments(
+            sender, instance, reverse, None
+        )
+        return
+    if action not in ['post_add', 'post_remove', 'post_clear']:
+        return
+    if action == 'post_clear':
+        deployment_pks = getattr(instance, '_cleared_deployment_pks', [])
+    else:
+        deployment_pks = _m2m_deployments(sender, instance, reverse, pk_set)
+    refresh_accessible_sets(deployment_pks=deployment_pks)
+    invalidate_accessible_sets()
+
+
+@receiver(post_save, sender=CollectionMember)
+@receiver(post_delete, sender=CollectionMember)
+def member_accessible_sets_refresh(sender, instance, **kwargs):
+    """
+    Signal used to refresh materialized sets of accessible locations
+    and deployments of resources of a collection and to invalidate data
+    cached for a user whose access to a collection is changed.
+    """
+    refresh_accessible_sets(
+        deployment_pks=_collection_deployments([instance.collection_id])
+    )
+    invalidate_accessible_sets(users=[instance.user_id])
+
+
 def collections_access_grant(
         collections, users,
         level=CollectionMemberLevels.ACCESS_BASIC
@@ -862,22 +1157,56 @@ def collections_access_grant(
     Method used to grant an access to specified collections.
 
     Add specified permission level :class:`CollectionMemberLevels`
-    to all specified users for all specified collections.
+    to all specified users for all specified collections. Owners, managers
+    and public collections are skipped. Missing memberships are calculated
+    with a constant number of queries and created with a single bulk insert.
 
     :param users: iterable of :class:`auth.User` instances
     :param collections: iterable of :class:`Collection`
     :return: None
     """
-    for user, collection in itertools.product(users, collections):
-        if not collection.owner_id == user.pk and \
-           not user.pk in collection.managers.values_list(
-               'pk', flat=True
-           ) and not collection.is_public:
-            CollectionMember.objects.get_or_create(
-                collection=collection,
-                user=user,
-                level=level
+    user_pks = set(user.pk for user in users)
+    collection_pks = set(collection.pk for collection in collections)
+    if not user_pks or not collection_pks:
+        return
+
+    owners = dict(
+        Collection.objects.filter(
+            pk__in=collection_pks
+        ).exclude(
+            status=ResourceStatus.PUBLIC
+        ).values_list('pk', 'owner_id')
+    )
+    excluded = set(
+        Collection.managers.through.objects.filter(
+            collection__pk__in=owners.keys(), user__pk__in=user_pks
+        ).values_list('collection_id', 'user_id')
+    )
+    excluded.update(
+        CollectionMember.objects.filter(
+            collection__pk__in=owners.keys(), user__pk__in=user_pks,
+            level=level
+        ).values_list('collection_id', 'user_id')
+    )
+    members = [
+        CollectionMember(
+            collection_id=collection_pk, user_id=user_pk, level=level
+        )
+        for collection_pk, owner_pk in owners.items()
+        for user_pk in user_pks
+        if user_pk != owner_pk and (collection_pk, user_pk) not in excluded
+    ]
+    if members:
+        CollectionMember.objects.bulk_create(members)
+        # bulk_create doesn't send post_save signals
+        refresh_accessible_sets(
+            deployment_pks=_collection_deployments(
+                set(member.collection_id for member in members)
             )
+        )
+        invalidate_accessible_sets(
+            users=set(member.user_id for member in members)
+        )
 
 
 def collections_access_revoke(
@@ -889,30 +1218,124 @@ def collections_access_revoke(
     Method used to revoke an access to specified collections.
 
     Remove all entries with specified level :class:`CollectionMemberLevels`
-    or for all given resources and all given users.
+    or for all given resources and all given users, unless a collection
+    is still used by a user (see :meth:`Collection.get_used`).
 
-    :param users: iterable of :class:`auth.User` instances
-    :param collections: iterable of :class:`Collection`
+    :param collection_pks: iterable of :class:`Collection` primary keys
+    :param user_pks: iterable of :class:`auth.User` primary keys
     :return: None
     """
-    queryset = CollectionMember.objects.filter(
-        collection__pk__in=collection_pks,
-        user__pk__in=user_pks, level=level
-    ).prefetch_related('collection', 'user')
-
-    for m in queryset:
-        user = m.user
-        collection = m.collection
-        params = {'user': user}
-        if rproject:
-            params.update({'rproject': rproject})
-        if cproject:
-            params.update({'cproject': cproject})
-        if collection.is_used(**params):
-            queryset = queryset.exclude(
-                collection=collection, user=user,
+    members = list(
+        CollectionMember.objects.filter(
+            collection__pk__in=collection_pks,
+            user__pk__in=user_pks, level=level
+        ).values_list('pk', 'collection_id', 'user_id')
+    )
+    if not members:
+        return
+    used = Collection.get_used(
+        collection_pks=set(k[1] for k in members),
+        user_pks=set(k[2] for k in members),
+        rproject=rproject, cproject=cproject
+    )
+    # members are deleted one by one (with signals), so sets of their
+    # collections are refreshed once afterwards
+    with defer_accessible_sets():
+        CollectionMember.objects.filter(pk__in=[
+            pk for pk, collection_pk, user_pk in members
+            if (collection_pk, user_pk) not in used
+        ]).delete()
+
+
+def collection_resources_append(collection, resources, user):
+    """
+    Method used to append resources to a collection in bulk.
+
+    Resources (from given queryset) accessible for a user are evaluated
+    once into a temporary table. Resources that are not owned or managed
+    by a user cannot be added to a collection that is not private; in that
+    case nothing is appended. Remaining resources are inserted with
+    a single `INSERT ... SELECT ... ON CONFLICT DO NOTHING` query and one
+    `post_add` signal (with all added primary keys) is sent afterwards,
+    so gis data of a collection and classification projects are refreshed
+    only once.
+
+    :param collection: :class:`Collection` instance
+    :param resources: queryset of :class:`Resource` candidates
+    :param user: :class:`auth.User` instance
+    :return: a tuple `(accessible, forbidden, added)` with numbers of
+        accessible and forbidden resources and a set of primary keys of
+        appended resources
+    """
+    qn = connection.ops.quote_name
+    table = qn('storage_collection_append')
+    through = Collection.resources.through
+    sql, params = Resource.objects.get_accessible(
+        user=user, base_queryset=resources
+    ).order_by().values('pk', 'owner').query.sql_with_params()
+    added = set()
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            'CREATE TEMPORARY TABLE {table} ON COMMIT DROP AS '
+            'SELECT DISTINCT U.{pk} AS id, U.{owner} AS owner_id '
+            'FROM ({sql}) U'.format(
+                table=table,
+                pk=qn(Resource._meta.pk.column),
+                owner=qn(Resource._meta.get_field('owner').column),
+                sql=sql
+            ),
+            params
+        )
+        forbidden_sql = '0'
+        forbidden_params = []
+        if collection.status != CollectionStatus.PRIVATE:
+            forbidden_sql = (
+                'COALESCE(SUM(CASE WHEN T.owner_id <> %s AND NOT EXISTS ('
+                'SELECT 1 FROM {managers} M WHERE M.{resource} = T.id '
+                'AND M.{user} = %s) THEN 1 ELSE 0 END), 0)'
+            ).format(
+                managers=qn(Resource.managers.through._meta.db_table),
+                resource=qn(
+                    Resource.managers.through._meta.get_field(
+                        'resource'
+                    ).column
+                ),
+                user=qn(
+                    Resource.managers.through._meta.get_field('user').column
+                ),
             )
-    queryset.delete()
+            forbidden_params = [user.pk, user.pk]
+        cursor.execute(
+            'SELECT COUNT(*), {forbidden} FROM {table} T'.format(
+                forbidden=forbidden_sql, table=table
+            ),
+            forbidden_params
+        )
+        accessible, forbidden = cursor.fetchone()
+        if accessible and not forbidden:
+            cursor.execute(
+                'INSERT INTO {through} ({collection}, {resource}) '
+                'SELECT %s, T.id FROM {table} T '
+                'ON CONFLICT DO NOTHING RETURNING {resource}'.format(
+                    through=qn(through._meta.db_table),
+                    collection=qn(
+                        through._meta.get_field('collection').column
+                    ),
+                    resource=qn(through._meta.get_field('resource').column),
+                    table=table
+                ),
+                [collection.pk]
+            )
+            added = set(k[0] for k in cursor.fetchall())
+        # table is dropped explicitly in case of an outer transaction
+        cursor.execute('DROP TABLE {table}'.format(table=table))
+    if added:
+        m2m_changed.send(
+            sender=through, action='post_add', instance=collection,
+            reverse=False, model=Resource, pk_set=added,
+            using=connection.alias
+        )
+    return accessible, forbidden, added
 
 
 def delete_collection_notification(instance):
@@ -920,30 +1343,35 @@ def delete_collection_notification(instance):
     Messages sent when collection is deleted to:
     * owner
     * all managers
-    * owners of collections
-    * all users that have access to resource
+    * all users that have access to collection
+
+    Each user gets a single message; messages are created with
+    a single bulk insert (see
+    :func:`trapper.apps.messaging.models.create_messages`).
     """
     user = get_current_user()
-    recipients = set()
-    # Owner
-    recipients.add(instance.owner)
-    # managers
-    recipients.update(instance.managers.all())
-    # people with access
+    if not user:
+        return
+    recipients = set([instance.owner_id])
+    recipients.update(
+        Collection.managers.through.objects.filter(
+            collection=instance
+        ).values_list('user_id', flat=True)
+    )
     recipients.update(
         CollectionMember.objects.filter(
             collection=instance,
             level=CollectionMemberLevels.ACCESS
-        )
+        ).values_list('user_id', flat=True)
+    )
+    create_messages(
+        subject=u"Collection: {name} has been deleted".format(
+            name=instance.name
+        ),
+        text=u"Collection: {name} has been deleted".format(
+            name=instance.name
+        ),
+        user_from=user,
+        recipients=recipients,
+        message_type=MessageType.RESOURCE_DELETED
     )
-
-    for recipient in recipients:
-        if user and recipient:
-            Message.objects.create(
-                subject=u"Collection: {name} has been deleted".format(name=instance.name),
-                text=u"Collection: {name} has been deleted".format(name=instance.name),
-                user_from=user,
-                user_to=recipient,
-                date_sent=now(),
-                message_type=MessageType.RESOURCE_DELETED
-            )
@@ -23,11 +23,39 @@ class ResourceNestedSerializer(BasePKSerializer):
     url = serializers.ReadOnlyField(source='get_absolute_url')
 
 
-class ResourceSerializer(BasePKSerializer):
+class ResourceTagsMixin(object):
+    """Mixin for resource serializers used with many resources; tags of
+    all serialized resources are fetched with a single query"""
+
+    def get_tags(self, obj):
+        """Custom method for retrieving resource tags"""
+        if getattr(self, 'tags_dict', None) is None:
+            pks = [k.pk for k in self.instance]
+            tags_values = TaggedResource.objects.filter(
+                content_object__pk__in=pks
+            ).values_list('content_object__pk', 'tag__name')
+            self.tags_dict = {
+                k:list(x[1] for x in v) for k,v in itertools.groupby(
+                    sorted(tags_values), key=lambda x: x[0]
+                )
+            }
+        return self.tags_dict.get(obj.pk)
+
+
+class ResourceSerializer(ResourceTagsMixin, BasePKSerializer):
     """Serializer for :class:`apps.storage.models.Resource`
     Serializer contains urls for details/delete/update resource if user
     has enough permissions
     """
+    # columns fetched by list views (see `storage.views.api.ResourceViewSet`)
+    QUERYSET_COLUMNS = (
+        'name', 'custom_prefix', 'inherit_prefix', 'resource_type',
+        'date_recorded', 'file_thumbnail', 'mime_type',
+        'extra_mime_type', 'owner__username', 'owner__first_name',
+        'owner__last_name', 'deployment__deployment_id',
+        'deployment__start_date', 'deployment__end_date',
+        'deployment__location__timezone',
+    )
 
     class Meta:
         model = Resource
@@ -86,26 +114,16 @@ class ResourceSerializer(BasePKSerializer):
             user=self.context['request'].user
         )
 
-    def get_tags(self, obj):
-        """Custom method for retrieving resource tags"""
-        if not getattr(self, 'tags_dict', None):
-            pks = [k.pk for k in self.instance]
-            tags_values = TaggedResource.objects.filter(
-                content_object__pk__in=pks
-            ).values_list('content_object__pk', 'tag__name')
-            self.tags_dict = {
-                k:list(x[1] for x in v) for k,v in itertools.groupby(
-                    sorted(tags_values), key=lambda x: x[0]
-                )
-            }
-        tags = self.tags_dict.get(obj.pk)
-        return tags
-
 
-class ResourceMapSerializer(BasePKSerializer):
+class ResourceMapSerializer(ResourceTagsMixin, BasePKSerializer):
     """Serializer for :class:`apps.storage.models.Resource` used
     by the map view.
     """
+    QUERYSET_COLUMNS = (
+        'name', 'custom_prefix', 'inherit_prefix', 'resource_type',
+        'date_recorded', 'file_thumbnail', 'deployment__deployment_id',
+        'deployment__location__timezone',
+    )
 
     class Meta:
         model = Resource
@@ -129,10 +147,6 @@ class ResourceMapSerializer(BasePKSerializer):
             user=self.context['request'].user
         )
 
-    def get_tags(self, obj):
-        """Custom method for retrieving resource tags"""
-        return [k.name for k in obj.tags.all()]
-
 
 class CollectionSerializer(BasePKSerializer):
     """Serializer for :class:`storage.Collection`
@@ -32,10 +32,13 @@ from trapper.apps.accounts.utils import (
     get_external_data_packages_path, create_external_media
 )
 from trapper.apps.accounts.models import UserDataPackage
+from trapper.apps.accounts.task_metrics import task_phase, task_progress
+from trapper.apps.common.task_args import rehydrate
 from trapper.apps.accounts.taxonomy import PackageType, ExternalStorageSettings
 
 
 @shared_task
+@rehydrate
 def celery_update_thumbnails(resources):
     """
     Celery task that create thumbnails for a list of images/videos
@@ -49,7 +52,79 @@ def celery_update_thumbnails(resources):
             except ThumbnailerException:
                 continue
 
+
+@shared_task
+def celery_refresh_collections_bbox(collection_pks):
+    """
+    Celery task that recalculates bboxes of given collections
+
+    :param collection_pks: list of storage.Collection primary keys
+    """
+    from trapper.apps.storage.models import Collection
+    for collection in Collection.objects.filter(pk__in=collection_pks):
+        collection.refresh_bbox()
+
+
+@shared_task
+def celery_append_collection_resources(
+        collection_pk, resource_pks, user_pk, app=None
+):
+    """
+    Celery task that appends a large number of selected resources
+    to a collection (see
+    :func:`trapper.apps.storage.models.collection_resources_append`)
+    and notifies a user about the result.
+
+    :param collection_pk: storage.Collection primary key
+    :param resource_pks: list of primary keys selected in a grid
+    :param user_pk: primary key of a user that appends resources
+    :param app: an application of a grid (resources are selected by
+        classifications for `media_classification`)
+    """
+    from django.contrib.auth import get_user_model
+    from trapper.apps.storage.models import (
+        Collection, Resource, collection_resources_append
+    )
+    user = get_user_model().objects.get(pk=user_pk)
+    collection = Collection.objects.get(pk=collection_pk)
+    task_phase('append')
+    accessible, forbidden, added = collection_resources_append(
+        collection=collection,
+        resources=Resource.objects.get_selected(pks=resource_pks, app=app),
+        user=user
+    )
+    task_progress(len(added), total=len(resource_pks))
+    if forbidden:
+        msg = (
+            'You have no permission to add {forbidden} of selected resources '
+            'to the "{ctype}" collection <strong>{name}</strong>. No '
+            'resources have been added.'
+        ).format(
+            forbidden=forbidden, ctype=collection.status.lower(),
+            name=collection.name
+        )
+    else:
+        msg = (
+            'You have successfully added <strong>{added}</strong> new '
+            'resources (of {accessible} accessible selected resources) '
+            'to the collection <strong>{name}</strong>.'
+        ).format(
+            added=len(added), accessible=accessible, name=collection.name
+        )
+    Message.objects.create(
+        subject=u"Collection: {name} append finished".format(
+            name=collection.name
+        ),
+        text=msg,
+        user_from=user,
+        user_to=user,
+        date_sent=now()
+    )
+    return msg
+
+
 @shared_task
+@rehydrate
 def celery_process_collection_upload(
         definition_file, archive_file, owner
 ):
@@ -84,6 +159,7 @@ def celery_process_collection_upload(
             archive_file=archive_file,
             owner=owner
         )
+        task_phase('process')
         processor.create()
     except CollectionProcessorException as error:
         end = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S`')
@@ -98,6 +174,7 @@ def celery_process_collection_upload(
             date_sent=end
         )
     else:
+        task_phase('report')
         end = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S`')
         errors = []
         for col_name in processor.errors.keys():
@@ -142,6 +219,7 @@ def celery_process_collection_upload(
 
 
 @shared_task
+@rehydrate
 def celery_create_media_package(resources, user, package_name, metadata=False):
     """
     Celery task that creates a data package (archive) from selected
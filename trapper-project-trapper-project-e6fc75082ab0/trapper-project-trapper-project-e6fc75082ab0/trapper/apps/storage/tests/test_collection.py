@@ -17,7 +17,11 @@ from trapper.apps.storage.taxonomy import (
     CollectionMemberLevels
 )
 from trapper.apps.storage.forms import CollectionRequestForm
-from trapper.apps.storage.models import Collection
+from trapper.apps.storage.models import (
+    Collection, CollectionMember, Resource, collections_access_grant,
+    collections_access_revoke, collection_resources_append
+)
+from trapper.apps.research.taxonomy import ResearchProjectRoleType
 from trapper.apps.messaging.models import CollectionRequest
 
 
@@ -967,3 +971,144 @@ class CollectionTestCase(BaseCollectionTestCase, ResearchProjectTestMixin):
     #     self.assertTrue(
     #         Collection.objects.filter(name='CollectionTwo').exists()
     #     )
+
+
+class CollectionAccessTestCase(
+    BaseCollectionTestCase, ResearchProjectTestMixin
+):
+    """Tests related to granting and revoking access to many collections
+    at once"""
+
+    def get_members(self, user):
+        return set(
+            CollectionMember.objects.filter(
+                user=user, level=CollectionMemberLevels.ACCESS
+            ).values_list('collection__pk', flat=True)
+        )
+
+    def test_grant(self):
+        """Access is granted only to users that are not owners of
+        non-public collections and is not duplicated"""
+        collections = [
+            self.collection_public, self.collection_ondemand,
+            self.collection_private
+        ]
+        for i in range(2):
+            collections_access_grant(
+                collections=collections, users=[self.alice, self.ziutek],
+                level=CollectionMemberLevels.ACCESS
+            )
+        self.assertEqual(self.get_members(self.alice), set())
+        self.assertEqual(
+            self.get_members(self.ziutek),
+            set([self.collection_ondemand.pk, self.collection_private.pk])
+        )
+        self.assertEqual(
+            CollectionMember.objects.filter(user=self.ziutek).count(), 2
+        )
+
+    def test_grant_skip_managers(self):
+        """Managers of collections don't get extra access"""
+        self.collection_private.managers = [self.ziutek]
+        collections_access_grant(
+            collections=[self.collection_private], users=[self.ziutek],
+            level=CollectionMemberLevels.ACCESS
+        )
+        self.assertEqual(self.get_members(self.ziutek), set())
+
+    def test_revoke(self):
+        """Access is not revoked for collections that are still used by
+        a user in research projects"""
+        collections_access_grant(
+            collections=[self.collection_ondemand, self.collection_private],
+            users=[self.ziutek], level=CollectionMemberLevels.ACCESS
+        )
+        project = self.create_research_project(
+            owner=self.alice,
+            roles=[(self.ziutek, ResearchProjectRoleType.COLLABORATOR)]
+        )
+        self.create_research_project_collection(
+            project=project, collection=self.collection_ondemand
+        )
+        collections_access_revoke(
+            collection_pks=[
+                self.collection_ondemand.pk, self.collection_private.pk
+            ],
+            user_pks=[self.ziutek.pk], rproject=True,
+            level=CollectionMemberLevels.ACCESS
+        )
+        self.assertEqual(
+            self.get_members(self.ziutek), set([self.collection_ondemand.pk])
+        )
+
+
+class CollectionResourcesAppendTestCase(BaseCollectionTestCase):
+    """Tests related to appending resources to a collection in bulk"""
+
+    def append(self, collection, resources, user):
+        return collection_resources_append(
+            collection=collection,
+            resources=Resource.objects.filter(
+                pk__in=[k.pk for k in resources]
+            ),
+            user=user
+        )
+
+    def test_append(self):
+        """Only accessible resources that are not in a collection yet
+        are appended to a private collection"""
+        collection = self.collection_private
+        resource = collection.resources.get()
+        own = self.create_resource(owner=self.alice)
+        public = self.create_resource(
+            owner=self.ziutek, status=ResourceStatus.PUBLIC
+        )
+        private = self.create_resource(
+            owner=self.ziutek, status=ResourceStatus.PRIVATE
+        )
+        accessible, forbidden, added = self.append(
+            collection, [resource, own, public, private], self.alice
+        )
+        self.assertEqual((accessible, forbidden), (3, 0))
+        self.assertEqual(added, set([own.pk, public.pk]))
+        self.assertItemsEqual(
+            collection.resources.values_list('pk', flat=True),
+            [resource.pk, own.pk, public.pk]
+        )
+
+        accessible, forbidden, added = self.append(
+            collection, [own, public], self.alice
+        )
+        self.assertEqual(added, set())
+
+    def test_append_forbidden(self):
+        """Nothing is appended to a non-private collection when some
+        of resources are not owned or managed by a user"""
+        collection = self.collection_public
+        own = self.create_resource(owner=self.alice)
+        managed = self.create_resource(
+            owner=self.ziutek, managers=[self.alice]
+        )
+        public = self.create_resource(
+            owner=self.ziutek, status=ResourceStatus.PUBLIC
+        )
+        accessible, forbidden, added = self.append(
+            collection, [own, managed, public], self.alice
+        )
+        self.assertEqual((accessible, forbidden, added), (3, 1, set()))
+        self.assertFalse(
+            collection.resources.filter(pk__in=[own.pk, managed.pk]).exists()
+        )
+
+        accessible, forbidden, added = self.append(
+            collection, [own, managed], self.alice
+        )
+        self.assertEqual(added, set([own.pk, managed.pk]))
+
+    def test_append_refresh_period(self):
+        """Collection data is refreshed after resources are appended"""
+        collection = self.collection_private
+        resource = self.create_resource(owner=self.alice)
+        self.append(collection, [resource], self.alice)
+        collection = Collection.objects.get(pk=collection.pk)
+        self.assertGreaterEqual(collection.period_end, resource.date_recorded)
@@ -6,6 +6,8 @@ import os
 import shutil
 
 from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test.utils import override_settings, CaptureQueriesContext
 from django.utils.lorem_ipsum import words
 from django.utils.timezone import now, localtime
 
@@ -14,9 +16,9 @@ from trapper.apps.common.utils.test_tools import (
     ExtendedTestCase, ResourceTestMixin, CollectionTestMixin,
 )
 from trapper.apps.storage.taxonomy import (
-    ResourceStatus, CollectionStatus
+    ResourceStatus, CollectionStatus, CollectionMemberLevels
 )
-from trapper.apps.storage.models import Resource
+from trapper.apps.storage.models import Resource, CollectionMember
 
 
 class BaseResourceTestCase(ExtendedTestCase, ResourceTestMixin):
@@ -278,6 +280,32 @@ class ResourcePermissionsBulkUpdateTestCase(BaseResourceTestCase):
         status = self._call_helper(resource=resource)
         self.assertFalse(status)
 
+    def test_bulk_update_manager_replace_managers(self):
+        """Manager that is not an owner can replace managers (including
+        themselves) and other fields are still updated"""
+        self.summon_john()
+        resource = self.create_resource(
+            owner=self.ziutek, managers=[self.alice],
+            status=ResourceStatus.PRIVATE
+        )
+        url = reverse('storage:resource_bulk_update')
+        data = {
+            'pks': [resource.pk],
+            'status': ResourceStatus.PUBLIC,
+            'managers': [self.john.pk],
+            'tags2add': 'bulk',
+        }
+        response = self.assert_access_granted(url, method='post', data=data)
+        status = self.assert_json_context_variable(response, 'status')
+        self.assertTrue(status)
+
+        resource = Resource.objects.get(pk=resource.pk)
+        self.assertEqual(list(resource.managers.all()), [self.john])
+        self.assertEqual(resource.status, ResourceStatus.PUBLIC)
+        self.assertEqual(
+            list(resource.tags.values_list('name', flat=True)), ['bulk']
+        )
+
 
 class ResourcePermissionsDefinePrefixTestCase(BaseResourceTestCase):
     """Define prefix permission logic for logged in user"""
@@ -495,6 +523,27 @@ class ResourcePermissionsListTestCase(BaseResourceTestCase):
             'Private not shown (ziutek)'
         )
 
+    def test_resource_json_constant_queries(self):
+        """Number of queries used to list resources does not depend on
+        a number of listed resources"""
+        url = reverse('storage:api-resource-list')
+
+        def count_queries():
+            with CaptureQueriesContext(connection) as context:
+                self.client.get(url)
+            return len(context)
+
+        deployment = self.create_deployment(owner=self.alice)
+        self.create_resource(owner=self.alice, deployment=deployment)
+        queries = count_queries()
+
+        for i in range(3):
+            self.create_resource(
+                owner=self.alice,
+                deployment=self.create_deployment(owner=self.alice)
+            )
+        self.assertEqual(count_queries(), queries)
+
 
 class ResourceTestCase(BaseResourceTestCase):
     """Tests related to modifying data for resource by performing various
@@ -695,6 +744,53 @@ class ResourceTestCase(BaseResourceTestCase):
                 data['managers']
             )
 
+    def test_resource_bulk_update_repeated(self):
+        """
+        Repeated bulk update doesn't duplicate tags and managers and
+        replaces previous managers.
+        """
+        self.login_alice()
+        resources = [
+            self.create_resource(owner=self.alice, managers=[self.alice])
+            for _counter in xrange(2)
+        ]
+        url = reverse('storage:resource_bulk_update')
+        data = {
+            'records_pks': ",".join([str(k.pk) for k in resources]),
+            'tags2add': u'aaaa,bbb',
+            'managers': [self.ziutek.pk]
+        }
+        for _counter in xrange(2):
+            response = self.client.post(url, data=data)
+            self.assertTrue(
+                self.assert_json_context_variable(response, 'success')
+            )
+
+        for resource in resources:
+            self.assertEqual(
+                sorted(resource.tags.values_list('name', flat=True)),
+                [u'aaaa', u'bbb']
+            )
+            self.assertEqual(
+                list(resource.managers.values_list('pk', flat=True)),
+                [self.ziutek.pk]
+            )
+
+    @override_settings(BULK_DELETE_CHUNK_SIZE=1)
+    def test_resource_delete_multiple_chunks(self):
+        """Multiple resources are deleted in chunks"""
+        self.login_alice()
+        resources = [
+            self.create_resource(owner=self.alice) for _counter in xrange(3)
+        ]
+        pks_list = [k.pk for k in resources]
+        url = reverse('storage:resource_delete_multiple')
+        response = self.client.post(
+            url, data={'pks': ",".join(map(str, pks_list))}
+        )
+        self.assertTrue(self.assert_json_context_variable(response, 'status'))
+        self.assertFalse(Resource.objects.filter(pk__in=pks_list).exists())
+
     def test_resource_define_prefix(self):
         """
         Using define prefix view logged in user that has enough permissions can
@@ -746,3 +842,70 @@ class ResourceTestCase(BaseResourceTestCase):
             resource.update_metadata(commit=True)
             resource.generate_thumbnails()
             self.assertTrue(resource.file_thumbnail.name)
+
+
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
+})
+class ResourceCanViewTestCase(BaseResourceTestCase, CollectionTestMixin):
+    """Tests related to checking view permissions of many resources"""
+
+    def setUp(self):
+        super(ResourceCanViewTestCase, self).setUp()
+        self.resource_managed = self.create_resource(
+            owner=self.alice, status=ResourceStatus.PRIVATE,
+            managers=[self.ziutek]
+        )
+        self.resource_member = self.create_resource(
+            owner=self.alice, status=ResourceStatus.PRIVATE
+        )
+        self.resource_basic = self.create_resource(
+            owner=self.alice, status=ResourceStatus.PRIVATE
+        )
+        self.create_collection(
+            owner=self.alice, status=CollectionStatus.PRIVATE,
+            resources=[self.resource_member],
+            roles=[(self.ziutek, CollectionMemberLevels.ACCESS)]
+        )
+        self.create_collection(
+            owner=self.alice, status=CollectionStatus.PRIVATE,
+            resources=[self.resource_basic],
+            roles=[(self.ziutek, CollectionMemberLevels.ACCESS_BASIC)]
+        )
+        self.resources = [
+            self.resource_public, self.resource_ondemand,
+            self.resource_private, self.resource_managed,
+            self.resource_member, self.resource_basic
+        ]
+
+    def test_can_view_many(self):
+        """Resources are checked with a constant number of queries"""
+        with self.assertNumQueries(3):
+            allowed = Resource.objects.can_view_many(
+                self.resources, user=self.ziutek
+            )
+        self.assertEqual(allowed, set([
+            self.resource_public.pk, self.resource_managed.pk,
+            self.resource_member.pk
+        ]))
+        self.assertIn(
+            self.resource_basic.pk,
+            Resource.objects.can_view_many(
+                self.resources, user=self.ziutek, basic=True
+            )
+        )
+
+    def test_can_view_owner(self):
+        """Owners can view their resources without queries"""
+        with self.assertNumQueries(0):
+            allowed = Resource.objects.can_view_many(
+                self.resources, user=self.alice
+            )
+        self.assertEqual(allowed, set(k.pk for k in self.resources))
+
+    def test_can_view_revoked(self):
+        """Removing a membership is visible immediately"""
+        self.assertTrue(self.resource_member.can_view(user=self.ziutek))
+        CollectionMember.objects.filter(user=self.ziutek).delete()
+        self.ziutek = self.ziutek.__class__.objects.get(pk=self.ziutek.pk)
+        self.assertFalse(self.resource_member.can_view(user=self.ziutek))
@@ -18,9 +18,18 @@ class ResourceViewSet(PaginatedReadOnlyModelViewSet):
     search_fields = ['name', 'owner__username', 'custom_prefix', 'tags__name']
 
     def get_queryset(self):
-        return Resource.objects.get_accessible(self.request.user).select_related(
-            'owner', 'deployment__location__timezone',
-        ).prefetch_related('managers')        
+        """Only columns used by a serializer are fetched and related
+        objects they belong to (owners, deployments, locations) are joined,
+        so a cost of a page doesn't depend on its size"""
+        columns = self.serializer_class.QUERYSET_COLUMNS
+        related = set(
+            k.rsplit('__', 1)[0] for k in columns if '__' in k
+        )
+        return Resource.objects.get_accessible(
+            self.request.user
+        ).select_related(*related).only(*columns).prefetch_related(
+            'managers'
+        )
 
 
 class ResourceMapViewSet(ResourceViewSet):
@@ -7,11 +7,9 @@ from __future__ import unicode_literals
 
 import os
 
-from django.db.models import Q
 from django.conf import settings
 from django.core.files.storage import FileSystemStorage
 from django.core.urlresolvers import reverse_lazy, reverse
-from django.core.mail import send_mail
 from django.contrib import messages
 from django.contrib.auth import get_user_model
 from django.shortcuts import get_object_or_404, redirect
@@ -24,11 +22,16 @@ from braces.views import UserPassesTestMixin, JSONResponseMixin
 
 from trapper.apps.common.views import LoginRequiredMixin
 from trapper.apps.common.tools import parse_pks, datetime_aware
+from trapper.apps.common.task_args import delay_task
 from trapper.apps.common.views import (
     BaseDeleteView, BaseUpdateView, BaseBulkUpdateView
 )
-from trapper.apps.storage.models import Collection, Resource
-from trapper.apps.storage.tasks import celery_process_collection_upload
+from trapper.apps.storage.models import (
+    Collection, Resource, collection_resources_append
+)
+from trapper.apps.storage.tasks import (
+    celery_process_collection_upload, celery_append_collection_resources
+)
 from trapper.apps.storage.forms import (
     CollectionForm, CollectionRequestForm, CollectionUploadConfigForm,
     CollectionUploadDataForm, BulkUpdateCollectionForm
@@ -37,13 +40,16 @@ from trapper.apps.messaging.models import (
     Message, CollectionRequest
 )
 from trapper.apps.messaging.taxonomies import MessageType
+from trapper.apps.messaging.mail import send_email
 from trapper.apps.research.models import ResearchProject
 from trapper.apps.storage.views.resource import ResourceGridContextMixin
 from trapper.apps.accounts.utils import (
     create_external_media
 )
 from trapper.apps.accounts.models import UserTask
-from trapper.apps.geomap.models import MapManagerUtils
+from trapper.apps.geomap.models import (
+    MapManagerUtils, invalidate_accessible_sets, refresh_accessible_sets
+)
 
 User = get_user_model()
 
@@ -297,7 +303,7 @@ class CollectionUploadWizardView(LoginRequiredMixin, SessionWizardView):
             params['archive_file'] = uploaded_media
 
         if settings.CELERY_ENABLED:
-            task = celery_process_collection_upload.delay(**params)
+            task = delay_task(celery_process_collection_upload, **params)
             user_task = UserTask(
                 user=user,
                 task_id=task.task_id
@@ -404,12 +410,10 @@ class CollectionRequestView(LoginRequiredMixin, generic.FormView):
 
         # send email to the owner of the collection
         if collection.owner.userprofile.system_notifications:
-            send_mail(
+            send_email(
                 subject='Request for one of your collections',
                 message=form.cleaned_data['text'],
-                from_email=None,
-                recipient_list=[collection.owner.email],
-                fail_silently=True
+                recipient_list=[collection.owner.email]
             )
 
         messages.add_message(
@@ -528,35 +532,20 @@ class CollectionResourceAppendView(LoginRequiredMixin, generic.View):
 
         Before append, all resources pks are validated if user can view
         them and only those, which user has enough permissions for, are
-        added to collection.
-
-        Response contains status of update and list of resource pks that
-        were added.
+        added to collection (see
+        :func:`trapper.apps.storage.models.collection_resources_append`).
+        When more than `settings.COLLECTION_APPEND_ASYNC_THRESHOLD`
+        resources are selected, they are appended by a celery task.
 
         After that, user is redirected to collection details.
         """
         user = request.user
         collection_pk = request.POST.get('collection', None)
-        resources_pk = request.POST.get('resources', None)
+        resources_pk = parse_pks(pks=request.POST.get('resources', None))
         app = request.POST.get('app', None)
         resources_url = reverse('storage:resource_list')
-        resources = None
 
-        if resources_pk:
-            resources_pk = parse_pks(pks=resources_pk)
-            if app == 'media_classification':
-                base_queryset = Resource.objects.filter(
-                    classifications__pk__in=resources_pk
-                )
-            else:
-                base_queryset=Resource.objects.filter(
-                    pk__in=resources_pk
-                )
-            resources = Resource.objects.get_accessible(
-                base_queryset=base_queryset
-            )
-
-        if not resources:
+        if not resources_pk:
             messages.error(
                 request,
                 'You have no permissions to add any of selected resources.'
@@ -574,25 +563,50 @@ class CollectionResourceAppendView(LoginRequiredMixin, generic.View):
             )
             return redirect(resources_url)
 
-        if not collection.status == 'Private':
-            n = resources.exclude(
-                Q(owner=user) | Q(managers=user)
-            ).count()
-            if n != 0:
-                messages.error(
-                    request,
-                    'You have no permission to add some of selected resources '
-                    'to this "{ctype}" collection'.format(
-                        ctype = collection.status.lower()
-                    )                
-                )
-                return redirect(resources_url)
+        if (
+            settings.CELERY_ENABLED and
+            len(resources_pk) > settings.COLLECTION_APPEND_ASYNC_THRESHOLD
+        ):
+            task = celery_append_collection_resources.delay(
+                collection_pk=collection.pk, resource_pks=resources_pk,
+                user_pk=user.pk, app=app
+            )
+            user_task = UserTask(
+                user=user,
+                task_id=task.task_id
+            )
+            user_task.save()
+            messages.success(
+                request,
+                'You have successfully run the celery task. Selected '
+                'resources are being added to this collection now.'
+            )
+            return redirect(collection_url)
 
-        new_resources = resources.exclude(
-            pk__in=collection.resources.values_list('pk', flat=True)
+        accessible, forbidden, added = collection_resources_append(
+            collection=collection,
+            resources=Resource.objects.get_selected(pks=resources_pk, app=app),
+            user=user
         )
 
-        if not new_resources:
+        if not accessible:
+            messages.error(
+                request,
+                'You have no permissions to add any of selected resources.'
+            )
+            return redirect(resources_url)
+
+        if forbidden:
+            messages.error(
+                request,
+                'You have no permission to add some of selected resources '
+                'to this "{ctype}" collection'.format(
+                    ctype=collection.status.lower()
+                )
+            )
+            return redirect(resources_url)
+
+        if not added:
             messages.warning(
                 request,
                 'The selected resources already are in this collection.'
@@ -603,11 +617,9 @@ class CollectionResourceAppendView(LoginRequiredMixin, generic.View):
             request,
             'You have successfully added <strong>{len}</strong> new '
             'resources to this collection.'.format(
-                len=new_resources.count()
+                len=len(added)
             )
         )
-
-        collection.resources.add(*new_resources)
         return redirect(collection_url)
 
 
@@ -621,6 +633,15 @@ class CollectionBulkUpdateView(BaseBulkUpdateView):
     form_class = BulkUpdateCollectionForm
     raise_exception = True
 
+    def records_updated(self, records):
+        # bulk updates do not send signals
+        refresh_accessible_sets(
+            deployment_pks=Resource.objects.filter(
+                collection__in=records
+            ).values_list('deployment', flat=True).distinct()
+        )
+        invalidate_accessible_sets()
+
 
 view_collection_bulk_update = CollectionBulkUpdateView.as_view()
 
@@ -36,8 +36,12 @@ from trapper.apps.storage.forms import (
 from trapper.apps.accounts.models import UserProfile, UserTask
 from trapper.apps.storage.taxonomy import ResourceType, ResourceStatus
 from trapper.apps.storage.tasks import celery_create_media_package
+from trapper.apps.common.task_args import delay_task
 from trapper.apps.research.models import ResearchProject
-from trapper.apps.geomap.models import MapManagerUtils, Deployment
+from trapper.apps.geomap.models import (
+    MapManagerUtils, Deployment, invalidate_accessible_sets,
+    refresh_accessible_sets
+)
 from trapper.apps.media_classification.models import ClassificationProject
 from trapper.apps.sendfile.views import BaseServeFileView
 
@@ -330,6 +334,20 @@ class ResourceBulkUpdateView(BaseBulkUpdateView):
     raise_exception = True
     tags_field = 'tags'
 
+    def records_selected(self, records):
+        self.previous_deployments = set(
+            records.values_list('deployment', flat=True)
+        )
+
+    def records_updated(self, records):
+        # bulk updates do not send signals
+        refresh_accessible_sets(
+            deployment_pks=self.previous_deployments | set(
+                records.values_list('deployment', flat=True)
+            )
+        )
+        invalidate_accessible_sets()
+
 
 view_resource_bulk_update = ResourceBulkUpdateView.as_view()
 
@@ -431,7 +449,7 @@ class ResourceGenerateDataPackage(
             }
 
             if settings.CELERY_ENABLED:
-                task = celery_create_media_package.delay(**params)
+                task = delay_task(celery_create_media_package, **params)
                 user_task = UserTask(
                     user=user,
                     task_id=task.task_id
@@ -1,14 +1,68 @@
 # -*- coding: utf-8 -*-
 """
 Module contains model definition to work with variables stored in database.
+
+Values are cached on two levels: in a process-local LRU cache and in the
+configured django cache. Whole namespaces are loaded and cached at once.
+Local entries are revalidated against the django cache at most every
+`settings.VARIABLES_LOCAL_TIMEOUT` seconds, so changes made by other
+processes are visible after that time.
+
+Keys of cached namespaces include their current versions. A namespace is
+invalidated by changing its version, so values loaded by a concurrent
+process before a change is committed are never read afterwards.
 """
 
-from django.db import models
+import copy
+import hashlib
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import models, transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
 from django.utils.translation import ugettext_lazy as _
 
 from fields import ObjectField
 
 
+_local_cache = OrderedDict()
+_local_cache_lock = threading.Lock()
+
+
+def get_version_key(namespace):
+    return 'variables_version_{hash}'.format(
+        hash=hashlib.md5(namespace.encode('utf-8')).hexdigest()
+    )
+
+
+def get_cache_key(namespace):
+    """Return a key of cached values of given namespace in its current
+    version"""
+    version_key = get_version_key(namespace)
+    version = cache.get(version_key)
+    if version is None:
+        version = uuid.uuid4().hex
+        if not cache.add(version_key, version, None):
+            version = cache.get(version_key) or version
+    return 'variables_{hash}_{version}'.format(
+        hash=hashlib.md5(namespace.encode('utf-8')).hexdigest(),
+        version=version
+    )
+
+
+def invalidate_namespace(namespace):
+    """Remove cached values of given namespace from a local cache and
+    change its version in the django cache"""
+    with _local_cache_lock:
+        _local_cache.pop(namespace, None)
+    cache.set(get_version_key(namespace), uuid.uuid4().hex, None)
+
+
 class Variable(models.Model):
     """Model used to store custom values in database"""
     UNDEFINED = object()
@@ -23,18 +77,68 @@ class Variable(models.Model):
     name = models.CharField(verbose_name=_(u"Name"), max_length=127)
     value = ObjectField(verbose_name=_(u"Value"))
 
+    @classmethod
+    def load_namespace(cls, namespace):
+        """Return a tuple `(token, values)` with all values of given
+        namespace; values are loaded from the django cache or with
+        a single query from database"""
+        cache_key = get_cache_key(namespace)
+        data = cache.get(cache_key)
+        if data is None:
+            values = dict(
+                cls.objects.filter(
+                    namespace=namespace
+                ).values_list('name', 'value')
+            )
+            data = (uuid.uuid4().hex, values)
+            # do not overwrite values stored by a concurrent process
+            if not cache.add(
+                cache_key, data, settings.VARIABLES_CACHE_TIMEOUT
+            ):
+                data = cache.get(cache_key) or data
+        return data
+
+    @classmethod
+    def get_namespace(cls, namespace):
+        """Return a dict with all values of given namespace"""
+        now = time.time()
+        with _local_cache_lock:
+            entry = _local_cache.get(namespace)
+            if entry is not None:
+                _local_cache.pop(namespace)
+                _local_cache[namespace] = entry
+        if entry is not None and (
+            now - entry['checked_at'] < settings.VARIABLES_LOCAL_TIMEOUT
+        ):
+            return entry['values']
+
+        token, values = cls.load_namespace(namespace)
+        if entry is not None and entry['token'] == token:
+            values = entry['values']
+        with _local_cache_lock:
+            _local_cache.pop(namespace, None)
+            _local_cache[namespace] = {
+                'token': token, 'values': values, 'checked_at': now
+            }
+            while len(_local_cache) > settings.VARIABLES_LOCAL_CACHE_SIZE:
+                _local_cache.popitem(last=False)
+        return values
+
     @classmethod
     def get(cls, namespace, name, default=UNDEFINED):
         """Method used to retrieve value from database"""
-        try:
-            val = cls.objects.get(namespace=namespace, name=name)
-        except cls.DoesNotExist:
+        values = cls.get_namespace(namespace)
+        if name not in values:
             if default is cls.UNDEFINED:
-                raise
+                raise cls.DoesNotExist(
+                    u"Variable {namespace}.{name} does not exist".format(
+                        namespace=namespace, name=name
+                    )
+                )
             else:
                 return default
-        else:
-            return val.value
+        # cached values are shared, so they are copied before returning
+        return copy.deepcopy(values[name])
 
     @classmethod
     def set(cls, namespace, name, value):
@@ -48,3 +152,16 @@ class Variable(models.Model):
 
     def __unicode__(self):
         return u"%s.%s = %s" % (self.namespace, self.name, self.value)
+
+
+@receiver(post_save, sender=Variable)
+@receiver(post_delete, sender=Variable)
+def variable_cache_invalidate(sender, instance, **kwargs):
+    """
+    Signal used to invalidate cached values of a namespace. Local cache
+    is cleared immediately, the django cache (shared with other processes)
+    once the change is committed.
+    """
+    namespace = instance.namespace
+    invalidate_namespace(namespace)
+    transaction.on_commit(lambda: invalidate_namespace(namespace))
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+
+from django.core.cache import cache
+from django.test import override_settings
+
+from trapper.apps.common.utils.test_tools import ExtendedTestCase
+from trapper.apps.variables.models import (
+    Variable, get_cache_key, _local_cache
+)
+
+
+@override_settings(
+    CACHES={
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    },
+    VARIABLES_LOCAL_TIMEOUT=60
+)
+class VariableCacheTestCase(ExtendedTestCase):
+    """Two level cache of variables"""
+
+    namespace = 'test'
+
+    def setUp(self):
+        super(VariableCacheTestCase, self).setUp()
+        cache.clear()
+        _local_cache.clear()
+        Variable.set(self.namespace, 'limit', 10)
+
+    def tearDown(self):
+        _local_cache.clear()
+        super(VariableCacheTestCase, self).tearDown()
+
+    def change_shared_cache(self, value):
+        """Simulate a change of a variable made by another process"""
+        cache.set(
+            get_cache_key(self.namespace), ('other', {'limit': value})
+        )
+
+    def test_read_from_local_cache(self):
+        """Once a namespace is loaded, values are read from a local cache
+        without querying a database or the django cache"""
+        self.assertEqual(Variable.get(self.namespace, 'limit'), 10)
+        self.change_shared_cache(20)
+        with self.assertNumQueries(0):
+            self.assertEqual(Variable.get(self.namespace, 'limit'), 10)
+            self.assertEqual(
+                Variable.get(self.namespace, 'missing', default=None), None
+            )
+        with self.assertRaises(Variable.DoesNotExist):
+            Variable.get(self.namespace, 'missing')
+
+    def test_invalidate_on_save(self):
+        """Saving a variable invalidates its namespace on both cache
+        levels"""
+        self.assertEqual(Variable.get(self.namespace, 'limit'), 10)
+        self.assertIsNotNone(cache.get(get_cache_key(self.namespace)))
+
+        Variable.set(self.namespace, 'limit', 15)
+        self.assertNotIn(self.namespace, _local_cache)
+        self.assertIsNone(cache.get(get_cache_key(self.namespace)))
+        self.assertEqual(Variable.get(self.namespace, 'limit'), 15)
+
+    def test_invalidate_concurrent_load(self):
+        """Values loaded by another process before a change is committed
+        are not read after the change"""
+        stale_key = get_cache_key(self.namespace)
+        Variable.set(self.namespace, 'limit', 15)
+        cache.set(stale_key, ('other', {'limit': 10}))
+        _local_cache.clear()
+        self.assertEqual(Variable.get(self.namespace, 'limit'), 15)
+
+    def test_invalidate_on_delete(self):
+        """Deleting a variable invalidates its namespace on both cache
+        levels"""
+        self.assertEqual(Variable.get(self.namespace, 'limit'), 10)
+
+        Variable.objects.filter(namespace=self.namespace).delete()
+        self.assertNotIn(self.namespace, _local_cache)
+        self.assertIsNone(cache.get(get_cache_key(self.namespace)))
+        self.assertIsNone(
+            Variable.get(self.namespace, 'limit', default=None)
+        )
+
+    def test_local_cache_expiry(self):
+        """Local entries are revalidated against the django cache after
+        `VARIABLES_LOCAL_TIMEOUT` seconds"""
+        self.assertEqual(Variable.get(self.namespace, 'limit'), 10)
+        self.change_shared_cache(20)
+        self.assertEqual(Variable.get(self.namespace, 'limit'), 10)
+        with override_settings(VARIABLES_LOCAL_TIMEOUT=0):
+            self.assertEqual(Variable.get(self.namespace, 'limit'), 20)
+
+    def test_local_cache_size(self):
+        """The least recently used namespaces are removed from a local
+        cache"""
+        with override_settings(VARIABLES_LOCAL_CACHE_SIZE=2):
+            for namespace in ('first', self.namespace, 'second'):
+                Variable.get_namespace(namespace)
+        self.assertEqual(list(_local_cache), [self.namespace, 'second'])
@@ -3,6 +3,7 @@ from __future__ import absolute_import
 import os
 
 from celery import Celery
+from celery.signals import celeryd_init
 from django.conf import settings
 
 # set the default Django settings module for the 'celery' program.
@@ -15,3 +16,25 @@ app = Celery('trapper.celery')
 app.config_from_object('django.conf:settings')
 app.autodiscover_tasks(settings.INSTALLED_APPS, related_name='tasks')
 
+
+def get_worker_pool(queues):
+    """Return settings of a worker pool (see `settings.CELERY_WORKER_POOLS`)
+    for a worker that consumes given queues or None if a worker consumes
+    more than one queue"""
+    if not queues:
+        return None
+    if isinstance(queues, basestring):
+        queues = [k.strip() for k in queues.split(',') if k.strip()]
+    if len(queues) != 1:
+        return None
+    return settings.CELERY_WORKER_POOLS.get(queues[0])
+
+
+@celeryd_init.connect
+def configure_worker_pool(sender=None, conf=None, options=None, **kwargs):
+    """Apply settings of a worker pool when a worker is started to consume
+    a single queue. Options given explicitly in a command line (e.g.
+    `--concurrency`) take precedence."""
+    pool = get_worker_pool((options or {}).get('queues'))
+    if pool:
+        conf.update(pool)
@@ -1,11 +1,23 @@
 # -*- coding: utf-8 -*-
 
+import json
+import logging
+import random
+import re
 import threading
+import time
+from collections import Counter
+
 import pytz
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections, reset_queries
 from django.utils import timezone
 
 _thread_locals = threading.local()
 
+INSTRUMENTATION_LOGGER = logging.getLogger('trapper.instrumentation')
+
 
 def get_current_request():
     """Function used to retrieve request associated with current thread"""
@@ -61,3 +73,169 @@ class TimezoneMiddleware(object):
             timezone.activate(pytz.timezone(tzname))
         else:
             timezone.deactivate()
+
+
+class RequestStats(object):
+    """Statistics of a single sampled request collected by
+    :class:`Instrumentation` middleware.
+
+    Executed queries are taken from the `queries_log` of database
+    connections (a debug cursor is forced only for sampled requests).
+    Cache hits and misses are counted by wrapping `get` and `get_many`
+    methods of a default cache instance, which django creates separately
+    for each thread.
+    """
+    LITERALS_RE = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+    IN_LIST_RE = re.compile(r'\((?:\s*\?\s*,)*\s*\?\s*\)')
+
+    def __init__(self):
+        self.start = time.time()
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.debug_cursors = {}
+        for connection in connections.all():
+            self.debug_cursors[connection.alias] = (
+                connection.force_debug_cursor
+            )
+            connection.force_debug_cursor = True
+        reset_queries()
+        self.cache = caches['default']
+        self.cache.get = self.wrap_get(self.cache.get)
+        self.cache.get_many = self.wrap_get_many(self.cache.get_many)
+
+    def wrap_get(self, get):
+        def wrapper(key, default=None, *args, **kwargs):
+            value = get(key, default, *args, **kwargs)
+            if value is default:
+                self.cache_misses += 1
+            else:
+                self.cache_hits += 1
+            return value
+        return wrapper
+
+    def wrap_get_many(self, get_many):
+        def wrapper(keys, *args, **kwargs):
+            keys = list(keys)
+            values = get_many(keys, *args, **kwargs)
+            self.cache_hits += len(values)
+            self.cache_misses += len(keys) - len(values)
+            return values
+        return wrapper
+
+    def normalize(self, sql):
+        """Replace literals with placeholders, so queries that differ only
+        by parameters (e.g. executed in a loop) are grouped together"""
+        sql = self.LITERALS_RE.sub('?', sql)
+        return self.IN_LIST_RE.sub('(...)', sql)
+
+    def finish(self):
+        """Restore connections and cache; return a dict with stats"""
+        queries = []
+        for connection in connections.all():
+            queries.extend(connection.queries)
+            connection.force_debug_cursor = self.debug_cursors.get(
+                connection.alias, False
+            )
+        for name in ('get', 'get_many'):
+            self.cache.__dict__.pop(name, None)
+
+        sql_time = sum(float(k['time']) for k in queries)
+        duplicates = len(queries) - len(set(k['sql'] for k in queries))
+        similar = Counter(self.normalize(k['sql']) for k in queries)
+        similar_sql, similar_count = (
+            similar.most_common(1)[0] if similar else ('', 0)
+        )
+        return {
+            'time': time.time() - self.start,
+            'queries': len(queries),
+            'sql_time': sql_time,
+            'duplicates': duplicates,
+            'similar': similar_count,
+            'similar_sql': similar_sql[:500],
+            'cache_hits': self.cache_hits,
+            'cache_misses': self.cache_misses,
+        }
+
+
+class Instrumentation(object):
+    """Production-safe middleware that records, for a sample of requests,
+    a number of executed queries, total SQL time, duplicated and similar
+    queries (a sign of N+1 problems), cache hits/misses and response size.
+
+    Stats are logged to the `trapper.instrumentation` logger as a JSON
+    line (with WARNING level when any of
+    `settings.INSTRUMENTATION_THRESHOLDS` is exceeded) and optionally
+    added to a response as a `Server-Timing` header.
+    """
+
+    def is_sampled(self, request):
+        if not settings.INSTRUMENTATION_ENABLED:
+            return False
+        return random.random() < settings.INSTRUMENTATION_SAMPLE_RATE
+
+    def _finish(self, request):
+        stats = getattr(request, '_instrumentation', None)
+        if stats is None:
+            return None
+        del request._instrumentation
+        return stats.finish()
+
+    def get_view_name(self, request):
+        """Return url name of a view (DRF endpoints included) or a path
+        if request was not resolved"""
+        match = getattr(request, 'resolver_match', None)
+        if match is None:
+            return request.path
+        return match.view_name
+
+    def get_exceeded(self, data):
+        return sorted(
+            key for key, limit in settings.INSTRUMENTATION_THRESHOLDS.items()
+            if data.get(key, 0) > limit
+        )
+
+    def report(self, request, data):
+        data.update({
+            'view': self.get_view_name(request),
+            'method': request.method,
+            'path': request.path,
+            'exceeded': self.get_exceeded(data),
+        })
+        level = logging.WARNING if data['exceeded'] else logging.INFO
+        INSTRUMENTATION_LOGGER.log(level, json.dumps(data, sort_keys=True))
+
+    def get_server_timing(self, data):
+        return (
+            'total;dur={total:.1f}, '
+            'db;dur={sql:.1f};desc="{queries} queries, {duplicates} dup", '
+            'cache;desc="{hits} hits, {misses} misses"'
+        ).format(
+            total=data['time'] * 1000, sql=data['sql_time'] * 1000,
+            queries=data['queries'], duplicates=data['duplicates'],
+            hits=data['cache_hits'], misses=data['cache_misses']
+        )
+
+    def process_request(self, request):
+        """Start collecting stats for a sampled request"""
+        if self.is_sampled(request):
+            request._instrumentation = RequestStats()
+
+    def process_response(self, request, response):
+        """Stop collecting stats, log them and add a header"""
+        data = self._finish(request)
+        if data is None:
+            return response
+        data['status'] = response.status_code
+        if not response.streaming:
+            data['size'] = len(response.content)
+        self.report(request, data)
+        if settings.INSTRUMENTATION_SERVER_TIMING:
+            response['Server-Timing'] = self.get_server_timing(data)
+        return response
+
+    def process_exception(self, request, exception):
+        """Log stats of broken views too"""
+        data = self._finish(request)
+        if data is not None:
+            data['exception'] = exception.__class__.__name__
+            self.report(request, data)
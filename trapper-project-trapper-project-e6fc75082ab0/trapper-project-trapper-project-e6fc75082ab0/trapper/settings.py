@@ -44,6 +44,9 @@ DATABASES = {
 EMAIL_NOTIFICATIONS = True
 EMAIL_NOTIFICATIONS_RESEARCH_PROJECT = True
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
+# e-mail notifications are sent by celery tasks in batches of this size,
+# each batch through a single connection (see trapper.apps.messaging.mail)
+EMAIL_BATCH_SIZE = 100
 
 # EMAIL_USE_TLS = True
 # EMAIL_HOST = 'smtp.gmail.com'
@@ -102,6 +105,39 @@ MAX_UPLOAD_COLLECTION_SIZE = 500 * 1024 * 1024
 # max size of a raw data package
 DATA_PACKAGE_MAX_SIZE = 10 * 1024 * 1024
 
+# collections bboxes are refreshed asynchronously when a single change
+# (e.g. of location's coordinates) affects more collections than this
+COLLECTIONS_BBOX_ASYNC_THRESHOLD = 20
+
+# resources are appended to a collection by a celery task when more than
+# this number of resources is selected
+COLLECTION_APPEND_ASYNC_THRESHOLD = 10000
+
+# objects selected for deletion are deleted in chunks of this size; larger
+# selections than the threshold are deleted by a celery task
+BULK_DELETE_CHUNK_SIZE = 1000
+BULK_DELETE_ASYNC_THRESHOLD = 10000
+
+# results of approved classifications are projected into typed tables per
+# classification project (see trapper.apps.media_classification.results)
+# which are used by exports, aggregations and filters; attributes listed
+# below are indexed
+CLASSIFICATION_RESULTS_TABLES = True
+CLASSIFICATION_RESULTS_INDEXED_ATTRS = ('species', 'count')
+
+# maximum age (in seconds) of cached collection memberships of a user
+# (see trapper.apps.storage.models)
+ACCESSIBLE_SETS_TIMEOUT = 15 * 60
+
+# server-side clustering of map points: radius of a cluster (in pixels)
+# and a timeout of cached clustered tiles (in seconds)
+MAP_CLUSTER_RADIUS = 64
+MAP_CLUSTER_CACHE_TIMEOUT = 5 * 60
+
+# timeout (in seconds) of cached per-user counters of messages and requests;
+# counters are also invalidated when messages or requests are changed
+USER_COUNTERS_TIMEOUT = 24 * 60 * 60
+
 # Allowed file types
 ALLOWED_FILE_TYPES = (
         'aac', 'ace', 'ai', 'aiff', 'avi', 'bmp', 'fla', 'flv', 
@@ -112,6 +148,15 @@ ALLOWED_FILE_TYPES = (
 )
 
 CELERY_DATA_ROOT = os.path.join(PROJECT_ROOT, 'celery_data')
+# Shared directory where data frames passed to celery tasks are staged
+# instead of being pickled into broker messages
+CELERY_STAGING_ROOT = os.path.join(CELERY_DATA_ROOT, 'staging')
+# Maximum age (in seconds) of staged files; older files belong to tasks
+# that failed or were never executed and are removed
+CELERY_STAGING_MAX_AGE = 2 * 24 * 60 * 60
+# Number of objects passed to celery tasks as primary keys that are
+# fetched from the database at once
+CELERY_TASK_ARGS_CHUNK_SIZE = 1000
 CELERY_IMPORTS = [
     'celery.task.http'
 ]
@@ -130,11 +175,117 @@ CELERY_SEND_EVENTS = True
 
 BROKER_POOL_LIMIT = 2
 CELERYD_CONCURRENCY = 1
-CELERY_DISABLE_RATE_LIMITS = True
 CELERYD_MAX_TASKS_PER_CHILD = 20
-CELERYD_SOFT_TASK_TIME_LIMIT = 5 * 60
+CELERYD_TASK_SOFT_TIME_LIMIT = 5 * 60
 CELERYD_TASK_TIME_LIMIT = 6 * 60
 
+# Tasks are routed to separate queues per workload class, so long running
+# tasks (e.g. building packages) don't block short ones (e.g. thumbnails of
+# uploaded resources). Each queue should be consumed by its own worker
+# (see bin/celery_worker.sh and conf/supervisor.conf). Queues are declared
+# as priority queues; tasks are sent with CELERY_DEFAULT_TASK_PRIORITY and
+# chunks of long running bulk operations with CELERY_BULK_TASK_PRIORITY.
+# To test routing locally without RabbitMQ set BROKER_URL = 'memory://'
+# and run a worker in the same process.
+from kombu import Exchange, Queue
+
+CELERY_MAX_TASK_PRIORITY = 10
+CELERY_DEFAULT_TASK_PRIORITY = 5
+CELERY_BULK_TASK_PRIORITY = 1
+CELERY_DEFAULT_QUEUE = 'default'
+CELERY_QUEUES = tuple(
+    Queue(
+        name, Exchange(name), routing_key=name,
+        queue_arguments={'x-max-priority': CELERY_MAX_TASK_PRIORITY}
+    )
+    for name in ('default', 'media', 'imports', 'packaging', 'notifications')
+)
+CELERY_ROUTES = dict(
+    (task, {'queue': queue, 'priority': CELERY_DEFAULT_TASK_PRIORITY})
+    for queue, tasks in (
+        ('media', (
+            'trapper.apps.storage.tasks.celery_update_thumbnails',
+        )),
+        ('imports', (
+            'trapper.apps.storage.tasks.celery_process_collection_upload',
+            'trapper.apps.storage.tasks.celery_append_collection_resources',
+            'trapper.apps.storage.tasks.celery_refresh_collections_bbox',
+            'trapper.apps.geomap.tasks.celery_import_locations',
+            'trapper.apps.geomap.tasks.celery_import_deployments',
+            'trapper.apps.media_classification.tasks.'
+            'celery_import_classifications',
+            'trapper.apps.media_classification.tasks.celery_build_sequences',
+            'trapper.apps.media_classification.tasks.celery_create_tags',
+            'trapper.apps.media_classification.tasks.'
+            'celery_build_results_tables',
+            'trapper.apps.common.tasks.celery_bulk_delete',
+        )),
+        ('packaging', (
+            'trapper.apps.storage.tasks.celery_create_media_package',
+            'trapper.apps.media_classification.tasks.'
+            'celery_results_to_data_package',
+        )),
+        ('notifications', (
+            'trapper.apps.messaging.tasks.celery_deliver_emails',
+        )),
+    )
+    for task in tasks
+)
+# Rate limits of tasks that load workers (and a database) the most
+CELERY_DISABLE_RATE_LIMITS = False
+CELERY_ANNOTATIONS = {
+    'trapper.apps.storage.tasks.celery_create_media_package': {
+        'rate_limit': '10/m'
+    },
+    'trapper.apps.media_classification.tasks.celery_results_to_data_package': {
+        'rate_limit': '10/m'
+    },
+    'trapper.apps.common.tasks.celery_bulk_delete': {
+        'rate_limit': '30/m'
+    },
+}
+# Worker settings per queue; they are applied when a worker is started to
+# consume a single queue (celery worker -Q <queue>). Workers of queues with
+# long running tasks prefetch only one task per process, so priorities are
+# respected and short tasks are not stuck behind long ones.
+CELERY_WORKER_POOLS = {
+    'default': {
+        'CELERYD_CONCURRENCY': 1,
+        'CELERYD_PREFETCH_MULTIPLIER': 1,
+        'CELERYD_MAX_TASKS_PER_CHILD': 20,
+        'CELERYD_TASK_SOFT_TIME_LIMIT': 5 * 60,
+        'CELERYD_TASK_TIME_LIMIT': 6 * 60,
+    },
+    'media': {
+        'CELERYD_CONCURRENCY': 2,
+        'CELERYD_PREFETCH_MULTIPLIER': 1,
+        'CELERYD_MAX_TASKS_PER_CHILD': 20,
+        'CELERYD_TASK_SOFT_TIME_LIMIT': 5 * 60,
+        'CELERYD_TASK_TIME_LIMIT': 6 * 60,
+    },
+    'imports': {
+        'CELERYD_CONCURRENCY': 2,
+        'CELERYD_PREFETCH_MULTIPLIER': 1,
+        'CELERYD_MAX_TASKS_PER_CHILD': 20,
+        'CELERYD_TASK_SOFT_TIME_LIMIT': 30 * 60,
+        'CELERYD_TASK_TIME_LIMIT': 35 * 60,
+    },
+    'packaging': {
+        'CELERYD_CONCURRENCY': 1,
+        'CELERYD_PREFETCH_MULTIPLIER': 1,
+        'CELERYD_MAX_TASKS_PER_CHILD': 5,
+        'CELERYD_TASK_SOFT_TIME_LIMIT': 60 * 60,
+        'CELERYD_TASK_TIME_LIMIT': 65 * 60,
+    },
+    'notifications': {
+        'CELERYD_CONCURRENCY': 2,
+        'CELERYD_PREFETCH_MULTIPLIER': 4,
+        'CELERYD_MAX_TASKS_PER_CHILD': 100,
+        'CELERYD_TASK_SOFT_TIME_LIMIT': 60,
+        'CELERYD_TASK_TIME_LIMIT': 2 * 60,
+    },
+}
+
 import djcelery
 djcelery.setup_loader()
 
@@ -210,6 +361,7 @@ MIDDLEWARE_CLASSES = [
     # local thread and since it's first - data cleared in process_response and
     # process_exception will be available for all other middlewares
     'trapper.middleware.ThreadLocals',
+    'trapper.middleware.Instrumentation',
     'django.middleware.common.CommonMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'trapper.middleware.TimezoneMiddleware',
@@ -302,6 +454,9 @@ LOGGING = {
             ),
             'datefmt': "%d/%b/%Y %H:%M:%S"
         },
+        'raw': {
+            'format': "%(message)s"
+        },
     },
     'filters': {
         'require_debug_false': {
@@ -322,6 +477,15 @@ LOGGING = {
             'backupCount': 2,
             'formatter': 'standard',
         },
+        # celery task metrics exported as JSON lines
+        'task_metrics': {
+            'level': 'INFO',
+            'class': 'logging.handlers.RotatingFileHandler',
+            'filename': os.path.join(LOG_DIR, "task_metrics"),
+            'maxBytes': 5000000,
+            'backupCount': 5,
+            'formatter': 'raw',
+        },
     },
     'loggers': {
         'django.request': {
@@ -329,9 +493,33 @@ LOGGING = {
             'level': 'ERROR',
             'propagate': True,
         },
+        'trapper.instrumentation': {
+            'handlers': ['logfile'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+        'trapper.task_metrics': {
+            'handlers': ['task_metrics'],
+            'level': 'INFO',
+            'propagate': False,
+        },
     }
 }
 
+# Request instrumentation (see trapper.middleware.Instrumentation); stats
+# are collected for a random sample of requests and requests that exceed
+# any of thresholds (time in seconds) are logged as warnings
+INSTRUMENTATION_ENABLED = True
+INSTRUMENTATION_SAMPLE_RATE = 0.01
+INSTRUMENTATION_SERVER_TIMING = False
+INSTRUMENTATION_THRESHOLDS = {
+    'time': 2.0,
+    'queries': 100,
+    'sql_time': 1.0,
+    'duplicates': 10,
+    'similar': 20,
+}
+
 # CRISPY FORMS
 CRISPY_TEMPLATE_PACK = 'bootstrap3'
 CRISPY_FAIL_SILENTLY = not DEBUG
@@ -413,8 +601,21 @@ ACCOUNT_LOGOUT_ON_GET = True
 # Dashboard settings
 MESSAGES_COUNT = 5
 
+# number of tasks kept in a history of each user and a maximum length of
+# stored task results
+USER_TASK_HISTORY_SIZE = 100
+USER_TASK_RESULT_LENGTH = 5000
+# minimal interval (in seconds) between writes of a task progress
+TASK_PROGRESS_INTERVAL = 5
+
 # Variables settings
 VARIABLES_DEBUG = DEBUG
+# variables are cached per namespace in the django cache and in a local
+# (per process) LRU cache that is revalidated every VARIABLES_LOCAL_TIMEOUT
+# seconds
+VARIABLES_CACHE_TIMEOUT = 24 * 60 * 60
+VARIABLES_LOCAL_TIMEOUT = 5
+VARIABLES_LOCAL_CACHE_SIZE = 100
 
 # Comments settings
 COMMENTS_REDIRECT_URL = '/'
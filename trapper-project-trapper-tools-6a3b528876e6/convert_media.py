@@ -2,7 +2,12 @@
 import os
 import re
 import logging
+import json
+import time
 import datetime
+import threading
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 from optparse import OptionParser, make_option
 from subprocess import Popen, PIPE
 
@@ -13,12 +18,77 @@ logging.basicConfig(
 logging.getLogger().addHandler(logging.FileHandler('convert_media.log'))
 
 
+FFMPEG_ARGS = {
+    'mp4': (
+        '-preset fast '
+        '-pix_fmt yuv420p '
+        '-vcodec libx264 -b:v 750k '
+        '-c:a aac -strict -2 -ac 2 '
+        '-movflags faststart -qmin 10 -qmax 42 '
+        '-keyint_min 150 -g 150'
+    ),
+    'webm': (
+        '-codec:v libvpx '
+        '-codec:a vorbis -strict -2 -ac 2 -b:a 128k '
+        # -cpu-used => a critical parameter related
+        # to a speed of conversion
+        '-quality good -cpu-used 5 '
+        '-qmin 0 -qmax 45 '
+        '-keyint_min 150 -g 150'
+    ),
+}
+
+
+class ConversionJournal(object):
+    """
+    Append-only journal of conversion jobs (one JSON object per line).
+    An output file is marked as "started" before ffmpeg is called and as
+    "done" or "failed" afterwards, so when an interrupted run is resumed
+    finished outputs are skipped and partially written ones are converted
+    again.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.states = {}
+        self.stream = None
+        if path and os.path.isfile(path):
+            with open(path, 'r') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    self.states[entry['outfile']] = entry['status']
+
+    def get_status(self, outfile):
+        return self.states.get(outfile)
+
+    def mark(self, outfiles, status, **extra):
+        for outfile in outfiles:
+            self.states[outfile] = status
+            if not self.path:
+                continue
+            if self.stream is None:
+                self.stream = open(self.path, 'a')
+            entry = dict(extra, outfile=outfile, status=status)
+            self.stream.write(json.dumps(entry) + '\n')
+        if self.stream is not None:
+            self.stream.flush()
+
+    def close(self):
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+
+
 class ConvertMedia(object):
 
     def __init__(
             self, media_root, keep_mdt, src_ext, convert2mp4,
             convert2webm, overwrite, FFMPEG='ffmpeg',
-            move_converted=False, move_path = None 
+            move_converted=False, move_path = None, workers=1,
+            dual_output=False, journal_path=None, FFPROBE='ffprobe'
     ):
         if not os.path.isdir(media_root):
             raise Exception('There is no directory: %s' % media_root)
@@ -30,8 +100,14 @@ class ConvertMedia(object):
         self.convert2webm = convert2webm
         self.overwrite = overwrite
         self.FFMPEG = FFMPEG
+        self.FFPROBE = FFPROBE
         self.move_converted = move_converted
         self.move_path = move_path
+        self.workers = workers
+        self.dual_output = dual_output
+        self.journal = ConversionJournal(journal_path)
+        self.lock = threading.Lock()
+        self.durations = {}
 
     def replace_ext(self, filepath, ext):
         ext = ext.split('.')[-1]
@@ -48,6 +124,136 @@ class ConvertMedia(object):
             )
         ]
 
+    def get_outfile_base(self, video):
+        outfile = video
+        if self.move_converted and os.path.isdir(self.move_path):
+            outfile = os.path.join(
+                self.move_path, os.path.relpath(outfile, self.media_root)
+            )
+            with self.lock:
+                if not os.path.isdir(os.path.dirname(outfile)):
+                    os.makedirs(os.path.dirname(outfile))
+        return outfile
+
+    def is_pending(self, outfile):
+        """
+        Check if a given output file has to be (re)converted.
+        """
+        status = self.journal.get_status(outfile)
+        if not os.path.isfile(outfile) or status in ('started', 'failed'):
+            # missing or partially written by an interrupted/failed job
+            return True
+        if self.overwrite:
+            logging.warning(
+                'The file: %s already exists but the "overwrite" '
+                'flag has been set. Overwritting..',
+                outfile
+            )
+            return True
+        if status == 'done':
+            logging.info(
+                'The file: %s is already converted. Skipping..', outfile
+            )
+            return False
+        logging.warning(
+            'The file: %s already exists. Skipping..',
+            outfile
+        )
+        return False
+
+    def get_jobs(self, matches):
+        """
+        Build a list of conversion jobs; each job is a tuple
+        (video, [(format, outfile), ...]). Unless a single-decode,
+        dual-output invocation of ffmpeg was requested, "mp4" and "webm"
+        outputs are separate jobs so they can run concurrently.
+        """
+        formats = []
+        if self.convert2mp4:
+            formats.append('mp4')
+        if self.convert2webm:
+            formats.append('webm')
+        jobs = []
+        for video in matches:
+            outfile = self.get_outfile_base(video)
+            outputs = [
+                (fmt, self.replace_ext(outfile, fmt)) for fmt in formats
+            ]
+            outputs = [k for k in outputs if self.is_pending(k[1])]
+            if not outputs:
+                continue
+            if self.dual_output:
+                jobs.append((video, outputs))
+            else:
+                jobs.extend((video, [k]) for k in outputs)
+        return jobs
+
+    def get_command(self, video, outputs):
+        return '{ffmpeg} -y -loglevel error -nostats -i "{source}" {outputs}'.format(
+            ffmpeg=self.FFMPEG,
+            source=video,
+            outputs=' '.join(
+                '{args} "{outfile}"'.format(
+                    args=FFMPEG_ARGS[fmt], outfile=outfile
+                ) for fmt, outfile in outputs
+            )
+        )
+
+    def get_duration(self, video):
+        """
+        Duration of a source video in seconds (0 when it can not be
+        determined); used to calculate the realtime factor.
+        """
+        with self.lock:
+            if video in self.durations:
+                return self.durations[video]
+        cmd = (
+            '{ffprobe} -v error -show_entries format=duration '
+            '-of default=noprint_wrappers=1:nokey=1 "{source}"'
+        ).format(ffprobe=self.FFPROBE, source=video)
+        p = Popen(cmd, stdout=PIPE, stderr=PIPE, shell=True)
+        stdout, stderr = p.communicate()
+        try:
+            duration = float(stdout.strip())
+        except ValueError:
+            duration = 0.
+        with self.lock:
+            self.durations[video] = duration
+        return duration
+
+    def keep_modification_timestamp(self, video, outfile):
+        mdt_original = datetime.datetime.utcfromtimestamp(
+            os.path.getmtime(video)
+        )
+        timestamp = (
+            mdt_original - datetime.datetime(1970, 1, 1)
+        ).total_seconds()
+        os.utime(
+            outfile,
+            (timestamp, timestamp)
+        )
+
+    def convert(self, job):
+        """
+        Run a single ffmpeg job; it is called from worker threads and
+        returns a tuple (job, success, media duration, elapsed time).
+        """
+        video, outputs = job
+        cmd = self.get_command(video, outputs)
+        logging.info('Subprocess: {cmd}'.format(cmd=cmd))
+        start = time.time()
+        p = Popen(cmd, stdout=PIPE, stderr=PIPE, shell=True)
+        stdout, stderr = p.communicate()
+        elapsed = time.time() - start
+        success = p.returncode == 0 and not stderr
+        if stderr:
+            logging.error('Subprocess failed:')
+            logging.error(stderr)
+        if success and self.keep_mdt:
+            for fmt, outfile in outputs:
+                self.keep_modification_timestamp(video, outfile)
+        return job, success, self.get_duration(video), elapsed
+
     def handle(self):
         matches = []
         logging.info('Looking for %s files..', self.src_ext)
@@ -57,116 +263,50 @@ class ConvertMedia(object):
         logging.info('Found %s files.', len(matches))
         logging.info('')
 
-        i = 1
-        for video in matches:
-            logging.info('[%s] Original file:\n%s', i, video)
-            
-            outfile = video
-            if self.move_converted and os.path.isdir(self.move_path):
-                outfile = os.path.join(
-                    self.move_path, os.path.relpath(outfile, self.media_root)
-                )
-                if not os.path.isdir(os.path.dirname(outfile)):
-                    os.makedirs(os.path.dirname(outfile))
-
-            # "mp4" conversion
-            if self.convert2mp4:
-                outfile = self.replace_ext(outfile, 'mp4')
-                if not os.path.isfile(outfile) or self.overwrite:
-                    if self.overwrite:
-                        logging.warning(
-                            'The file: %s already exists but te "overwrite" '
-                            'flag has been set. Overwritting..',
-                            outfile
-                        )
-                    logging.info('[%s] Converting to mp4 file:\n%s', i, outfile)
-                    ffmpeg_mp4 = (
-                        '{ffmpeg} -y -i "{source}" -preset fast '
-                        '-pix_fmt yuv420p '
-                        '-vcodec libx264 -b:v 750k '
-                        '-c:a aac -strict -2 -ac 2 '  
-                        '-movflags faststart -qmin 10 -qmax 42 '
-                        '-keyint_min 150 -g 150 '
-                        '-loglevel error -nostats '
-                        '"{outfile}"'
-                        ).format(
-                            ffmpeg = self.FFMPEG,
-                            source = video,
-                            outfile = outfile
-                        )
-                    logging.info('Subprocess: {cmd}'.format(cmd=ffmpeg_mp4))
-                    p = Popen(ffmpeg_mp4, stdout=PIPE, stderr=PIPE, shell=True)
-                    stdout, stderr = p.communicate()
-                    if stderr:
-                        logging.error('Subprocess failed:')
-                        logging.error(stderr)
-                    if self.keep_mdt:
-                        mdt_original = datetime.datetime.utcfromtimestamp(
-                            os.path.getmtime(video)
-                        )
-                        timestamp = (
-                            mdt_original - datetime.datetime(1970, 1, 1)
-                        ).total_seconds()
-                        os.utime(
-                            outfile,
-                            (timestamp, timestamp)
-                        )
-                else:
-                    logging.warning(
-                        'The file: %s already exists. Skipping..',
-                        outfile
-                    )
+        jobs = self.get_jobs(matches)
+        logging.info(
+            'Running %s conversion jobs with %s workers.',
+            len(jobs), self.workers
+        )
+        for video, outputs in jobs:
+            self.journal.mark([k[1] for k in outputs], 'started', source=video)
 
-            # "webm" conversion
-            if self.convert2webm:
-                outfile = self.replace_ext(outfile, 'webm')
-                if not os.path.isfile(outfile) or self.overwrite:
-                    if self.overwrite:
-                        logging.warning(
-                            'The file: %s already exists but the "overwrite" '
-                            'flag has been set. Overwritting..',
-                            outfile
-                        )
-                    logging.info('[%s] Converting to webm file:\n%s', i, outfile)
-                    ffmpeg_webm = (
-                        '{ffmpeg} -y -i "{source}" '
-                        '-codec:v libvpx '
-                        '-codec:a vorbis -strict -2 -ac 2 -b:a 128k ' 
-                        # -cpu-used => a critical parameter related
-                        # to a speed of conversion
-                        '-quality good -cpu-used 5 '
-                        '-qmin 0 -qmax 45 '
-                        '-keyint_min 150 -g 150 '
-                        '-loglevel error -nostats '
-                        '"{outfile}"'
-                        ).format(
-                            ffmpeg = self.FFMPEG,
-                            source = video,
-                            outfile = outfile
-                        )
-                    logging.info('Subprocess: {cmd}'.format(cmd=ffmpeg_webm))
-                    p = Popen(ffmpeg_webm, stdout=PIPE, stderr=PIPE, shell=True)
-                    stdout, stderr = p.communicate()
-                    if stderr:
-                        logging.error('Subprocess failed:')
-                        logging.error(stderr)
-                    if self.keep_mdt:
-                        mdt_original = datetime.datetime.utcfromtimestamp(
-                            os.path.getmtime(video)
-                        )
-                        timestamp = (
-                            mdt_original - datetime.datetime(1970, 1, 1)
-                        ).total_seconds()
-                        os.utime(
-                            outfile,
-                            (timestamp, timestamp)
-                        )
-                else:
-                    logging.warning(
-                        'The file: %s already exists. Skipping..',
-                        outfile
-                    )
-            i = i + 1
+        pool = ThreadPool(self.workers)
+        start = time.time()
+        converted = set()
+        media_time = 0.
+        try:
+            results = pool.imap_unordered(self.convert, jobs)
+            for i, (job, success, duration, elapsed) in enumerate(results, 1):
+                video, outputs = job
+                outfiles = [k[1] for k in outputs]
+                self.journal.mark(
+                    outfiles, 'done' if success else 'failed',
+                    source=video, elapsed=round(elapsed, 2)
+                )
+                if video not in converted:
+                    converted.add(video)
+                    media_time += duration
+                wall_time = time.time() - start
+                logging.info(
+                    '[%s/%s] %s:\n%s', i, len(jobs),
+                    'Converted' if success else 'Failed',
+                    '\n'.join(outfiles)
+                )
+                logging.info(
+                    'Throughput: %.1f files/min, realtime factor: %.2fx',
+                    len(converted) * 60. / wall_time if wall_time else 0,
+                    media_time / wall_time if wall_time else 0
+                )
+        except BaseException:
+            # e.g. KeyboardInterrupt, don't wait for remaining jobs
+            pool.terminate()
+            raise
+        else:
+            pool.close()
+        finally:
+            pool.join()
+            self.journal.close()
 
 
 def main():
@@ -224,6 +364,40 @@ def main():
             default=None,
             help='Where to move converted files (default: None).'
         ),
+        make_option(
+            '--workers',
+            action='store',
+            type='int',
+            dest='workers',
+            default=multiprocessing.cpu_count(),
+            help=('Number of ffmpeg processes running concurrently '
+                  '(default: number of CPUs).')
+        ),
+        make_option(
+            '--dual-output',
+            action='store_true',
+            dest='dual_output',
+            help=('Decode a source file once and write both "mp4" and '
+                  '"webm" outputs with a single ffmpeg process.')
+        ),
+        make_option(
+            '--journal',
+            action='store',
+            dest='journal_path',
+            default='convert_media.journal',
+            help=('Journal of conversion jobs used to resume an interrupted '
+                  'run (default: convert_media.journal). Files that were '
+                  'started or failed are converted again even without the '
+                  '"overwrite" flag. Use an empty string to disable it.')
+        ),
+        make_option(
+            '--FFPROBE',
+            action='store',
+            dest='FFPROBE',
+            default='ffprobe',
+            help=('Path to ffprobe used to calculate the realtime factor '
+                  '(default: ffprobe).')
+        ),
 
     ]
     parser = OptionParser(usage, option_list=option_list)
@@ -247,7 +421,11 @@ def main():
         overwrite=options.overwrite,
         FFMPEG=options.FFMPEG,
         move_converted = options.move_converted,
-        move_path = options.move_path
+        move_path = options.move_path,
+        workers=options.workers,
+        dual_output=options.dual_output,
+        journal_path=options.journal_path,
+        FFPROBE=options.FFPROBE
     ).handle()
 
 